@@ -12,7 +12,7 @@ import omegaconf
 import pybullet as p
 from scipy.spatial.transform.rotation import Rotation as R
 
-from calvin_env.utils.utils import count_frames, get_episode_lengths, set_egl_device, to_relative_action
+from calvin_env.utils.utils import count_frames, get_episode_lengths, set_egl_device, to_relative_actions
 
 # A logger for this file
 log = logging.getLogger(__name__)
@@ -126,7 +126,7 @@ def save_step(counter, rgbs, depths, actions, robot_obs, scene_obs, cam_names, *
     np.savez_compressed(
         f"episode_{counter:07d}.npz",
         actions=actions,
-        rel_actions=to_relative_action(actions, robot_obs),
+        rel_actions=to_relative_actions(actions, robot_obs),
         robot_obs=robot_obs,
         scene_obs=scene_obs,
         **rgb_entries,
@@ -1,5 +1,6 @@
 import datetime
 import logging
+from functools import partial
 from math import pi
 import os
 from pathlib import Path
@@ -35,8 +36,10 @@ from calvin_env.envs.master_tasks.calvin_task import (
     MoveToLever,
 )
 from calvin_env.envs.observation import CalvinObservation
+from calvin_env.envs.physics import AdaptiveSubstepper, apply_physics_profile
 from calvin_env.robot.robot import Robot
 from calvin_env.scene.master_scene import Scene
+from calvin_env.utils.noise import make_rng
 from calvin_env.utils.utils import FpsController, get_git_commit_hash
 
 # A logger for this file
@@ -82,6 +85,10 @@ class CalvinEnvironment(gym.Env):
         control_freq,
         action_mode,
         task=None,
+        render_periods=None,
+        adaptive_substepping=None,
+        physics_profile="default",
+        worker_id=0,
     ):
         self.physics_client = p
         # for calculation of FPS
@@ -94,14 +101,26 @@ class CalvinEnvironment(gym.Env):
         self.cid = -1
         self.ownsPhysicsClient = False
         self.use_egl = use_egl
+        self.physics_profile = physics_profile
         self.control_freq = control_freq
         self.action_repeat = int(bullet_time_step // control_freq)
+        if adaptive_substepping is not None:
+            self.substepper = AdaptiveSubstepper(control_freq, **adaptive_substepping)
+        else:
+            self.substepper = None
+            if bullet_time_step % control_freq != 0:
+                log.warning(
+                    f"bullet_time_step {bullet_time_step} is not a multiple of control_freq {control_freq}, "
+                    f"control actually runs at {bullet_time_step / self.action_repeat:.1f} Hz"
+                )
         render_width = max([cameras[cam].width for cam in cameras]) if cameras else None
         render_height = max([cameras[cam].height for cam in cameras]) if cameras else None
         self.initialize_bullet(bullet_time_step, render_width, render_height)
         self.np_random = None
         self.seed(seed)
         self.robot: Robot = hydra.utils.instantiate(robot_cfg, cid=self.cid)
+        self.worker_id = worker_id
+        self.seed_noise(seed)
         self.scene: Scene = hydra.utils.instantiate(
             scene_cfg, p=self.physics_client, cid=self.cid, np_random=self.np_random
         )
@@ -123,6 +142,14 @@ class CalvinEnvironment(gym.Env):
         for cam in self.cameras:
             self.camera_map[cam.name] = cam
 
+        # render schedule: every camera is rendered once every `period` control steps, in between the last frame
+        # is reused and the observation reports its age in control steps
+        render_periods = dict(render_periods) if render_periods else {}
+        self.render_periods: dict[str, int] = {cam.name: int(render_periods.get(cam.name, 1)) for cam in self.cameras}
+        assert all(period >= 1 for period in self.render_periods.values()), "render periods have to be >= 1"
+        self._frame_cache: dict[str, tuple] = {}
+        self._frame_age: dict[str, int] = {}
+
     def __del__(self):
         self.close()
 
@@ -189,6 +216,13 @@ class CalvinEnvironment(gym.Env):
 
         self.robot.load()
         self.scene.load()
+        apply_physics_profile(
+            self.physics_client,
+            self.cid,
+            self.physics_profile,
+            movable_uids=[obj.uid for obj in self.scene.movable_objects],
+            fixed_uids=[obj.uid for obj in self.scene.fixed_objects],
+        )
 
     def close(self):
         if self.ownsPhysicsClient:
@@ -316,6 +350,10 @@ class CalvinEnvironment(gym.Env):
         # self.robot.np_random = self.np_random  # use the same np_randomizer for robot as for env
         return [seed]
 
+    def seed_noise(self, seed=None):
+        """Seed the observation noise, every worker_id gets an independent stream of the same seed."""
+        self.robot.seed_noise(make_rng(seed, self.worker_id))
+
     def reset(
         self, robot_obs=None, scene_obs=None, static=True, settle_time=20
     ) -> Tuple[CalvinObservation, float, bool, dict]:
@@ -323,7 +361,7 @@ class CalvinEnvironment(gym.Env):
         self.scene.reset(scene_obs, static)
         for _ in range(settle_time):
             self.physics_client.stepSimulation(physicsClientId=self.cid)
-        obs = self._get_observation()
+        obs = self._get_observation(force_render=True)
         info = self._get_info()
         reward, done = 0.0, False  # self.task.reset(obs)
 
@@ -337,12 +375,12 @@ class CalvinEnvironment(gym.Env):
         action = {"action": action, "type": action_mode}
 
         self.robot.apply_action(action)
-        for i in range(self.action_repeat):
-            self.physics_client.stepSimulation(physicsClientId=self.cid)
+        self._step_physics()
         self.scene.step()
+        self._advance_render_clock()
         obs = self._get_observation()
         info = self._get_info()
-        reward, done = 0.0, False  # self.task.step(obs)
+        reward, done = self._get_reward_and_done()
 
         # add values to observation for SceneObservation
         obs.reward = reward
@@ -350,14 +388,157 @@ class CalvinEnvironment(gym.Env):
         # obs, reward, done, info
         return obs, reward, done, info
 
+    def step_chunk(self, actions, action_mode, obs_every=None) -> Tuple[CalvinObservation, np.ndarray, bool, dict]:
+        """
+        Apply a chunk of actions in sequence, assembling full observations only at the requested steps.
+
+        Termination is evaluated after every action, the chunk is cut short as soon as an episode is done.
+        Args:
+            actions: (K, action_dim) actions, applied one per control step.
+            action_mode: action type of all actions in the chunk (see Robot.apply_action).
+            obs_every: assemble a full observation every obs_every steps, defaults to K (i.e. only after the last
+                action). A full observation is always returned for the last executed step.
+        Returns:
+            obs: full observation after the last executed action.
+            rewards: (k,) rewards of the k executed steps.
+            done: True if the episode terminated within the chunk.
+            info: info dict of the last executed step, additionally containing
+                - "robot_obs": (k, n) stacked robot states of all executed steps
+                - "scene_obs": (k, m) stacked scene states of all executed steps
+                - "observations": dict mapping the requested intermediate step indices to their full observations
+                - "num_steps": number of executed steps k
+        """
+        actions = np.asarray(actions)
+        num_actions = len(actions)
+        assert num_actions > 0, "action chunk is empty"
+        obs_every = num_actions if obs_every is None else obs_every
+        assert obs_every >= 1
+
+        robot_states, scene_states, rewards, observations = [], [], [], {}
+        done = False
+        for i, action in enumerate(actions):
+            self.robot.apply_action({"action": action, "type": action_mode})
+            self._step_physics()
+            self.scene.step()
+            self._advance_render_clock()
+
+            robot_state, _ = self.robot.get_observation()
+            robot_states.append(robot_state)
+            scene_states.append(self.scene.get_obs())
+            reward, done = self._get_reward_and_done()
+            rewards.append(reward)
+            if done or i == num_actions - 1:
+                break
+            if (i + 1) % obs_every == 0:
+                observations[i] = self._get_observation()
+
+        obs = self._get_observation()
+        obs.reward = rewards[-1]
+        obs.done = done
+        info = self._get_info()
+        info.update(
+            {
+                "robot_obs": np.stack(robot_states),
+                "scene_obs": np.stack(scene_states),
+                "observations": observations,
+                "num_steps": len(rewards),
+            }
+        )
+        return obs, np.array(rewards), done, info
+
+    def execute_trajectory(self, joint_waypoints, tolerance=0.01, max_steps=100) -> Tuple[CalvinObservation, dict]:
+        """
+        Fast-forward execution of a joint space trajectory (e.g. a motion plan).
+
+        Motor targets are streamed waypoint by waypoint and physics is advanced until the arm is within tolerance of
+        the current waypoint (or max_steps physics steps have passed). No observations are assembled in between.
+        Args:
+            joint_waypoints: (N, 7) arm joint positions or (N, 8) with the gripper action in the last column.
+            tolerance: max absolute joint error in rad at which a waypoint counts as reached.
+            max_steps: max number of physics steps spent on a single waypoint.
+        Returns:
+            obs: full observation after the last waypoint.
+            trajectory_log: dict with
+                - "joint_positions": (T, 7) arm joint positions after every physics step
+                - "waypoint_ids": (T,) index of the waypoint that was tracked in every physics step
+                - "reached": (N,) whether the waypoint was reached within max_steps
+        """
+        joint_waypoints = np.atleast_2d(np.asarray(joint_waypoints, dtype=float))
+        num_joints = len(self.robot.arm_joint_ids)
+        assert joint_waypoints.shape[1] in (num_joints, num_joints + 1)
+
+        joint_log, waypoint_ids = [], []
+        reached = np.zeros(len(joint_waypoints), dtype=bool)
+        self.robot.advance_tick()
+        for i, waypoint in enumerate(joint_waypoints):
+            target = waypoint[:num_joints]
+            if len(waypoint) > num_joints:
+                self.robot.gripper_action = 1 if waypoint[-1] >= 0 else -1
+            self.robot.set_position_targets(self.robot.arm_joint_ids, target, self.robot.arm_forces)
+            self.robot.control_gripper(self.robot.gripper_action)
+            for _ in range(max_steps):
+                self.physics_client.stepSimulation(physicsClientId=self.cid)
+                joint_positions = self.robot.get_arm_joint_positions()
+                joint_log.append(joint_positions)
+                waypoint_ids.append(i)
+                if np.max(np.abs(joint_positions - target)) < tolerance:
+                    reached[i] = True
+                    break
+            self.scene.step()
+
+        obs = self._get_observation(force_render=True)
+        obs.reward, obs.done = self._get_reward_and_done()
+        trajectory_log = {
+            "joint_positions": np.array(joint_log, dtype=np.float32).reshape(-1, num_joints),
+            "waypoint_ids": np.array(waypoint_ids, dtype=np.int32),
+            "reached": reached,
+        }
+        return obs, trajectory_log
+
+    def _step_physics(self):
+        """Advance physics by one control step, either with a fixed or an adaptive number of substeps."""
+        self.robot.advance_tick()
+        if self.substepper is not None:
+            self.substepper.step(self.physics_client, self.robot.robot_uid, self.cid)
+        else:
+            for _ in range(self.action_repeat):
+                self.physics_client.stepSimulation(physicsClientId=self.cid)
+
+    def _get_reward_and_done(self) -> Tuple[float, bool]:
+        return 0.0, False  # self.task.step(obs)
+
+    def _advance_render_clock(self):
+        """Age all cached camera frames by one control step."""
+        for name in self._frame_age:
+            self._frame_age[name] += 1
+
+    def _render_cameras(self, camera_names, force_render=False) -> dict[str, tuple]:
+        """
+        Render the cameras that are due according to the render schedule and reuse the last frame of all others.
+
+        Args:
+            camera_names: cameras to return frames for.
+            force_render: render all cameras regardless of the schedule (e.g. after a reset).
+        Returns:
+            dict mapping camera name to (rgb, depth, pcd, mask)
+        """
+        for name in camera_names:
+            due = name not in self._frame_cache or self._frame_age[name] >= self.render_periods[name]
+            if force_render or due:
+                self._frame_cache[name] = self.camera_map[name].render()
+                self._frame_age[name] = 0
+        return {name: self._frame_cache[name] for name in camera_names}
+
     def _get_observation(
         self,
         has_joint_forces=True,
         has_gripper_touch_forces=True,
+        force_render=False,
     ) -> CalvinObservation:
 
-        wrist_rgb, wrist_depth, wrist_pcd, wrist_mask = self.camera_map["wrist"].render()
-        front_rgb, front_depth, front_pcd, front_mask = self.camera_map["front"].render()
+        frames = self._render_cameras(["wrist", "front"], force_render=force_render)
+        wrist_rgb, wrist_depth, wrist_pcd, wrist_mask = frames["wrist"]
+        front_rgb, front_depth, front_pcd, front_mask = frames["front"]
 
         _, robot_obs = self.robot.get_observation()  # get state observation
         scene_obs = self.scene.get_obs()
@@ -366,11 +547,15 @@ class CalvinEnvironment(gym.Env):
         arm_joint_velocities = robot_obs["arm_joint_velocities"]
         arm_joint_positions = robot_obs["arm_joint_positions"]
 
-        joint_forces = None
-        if has_joint_forces:
-            joint_forces = self.robot.joint_forces_noise.apply(
-                np.array([-f if v < 0 else f for f, v in zip(arm_joint_forces, arm_joint_velocities)])
-            )
+        joint_velocities = np.asarray(arm_joint_velocities)
+        # forces get the sign of the joint velocity, only the first len(velocities) entries are used
+        joint_forces = np.asarray(arm_joint_forces)[: len(joint_velocities)]
+        joint_forces = np.where(joint_velocities[: len(joint_forces)] < 0, -joint_forces, joint_forces)
+        joint_pos, joint_vel, joint_forces = self.robot.apply_joint_noise(
+            arm_joint_positions, joint_velocities, joint_forces
+        )
+        if not has_joint_forces:
+            joint_forces = None
 
         ee_forces_flat = None
         if has_gripper_touch_forces:
@@ -418,10 +603,12 @@ class CalvinEnvironment(gym.Env):
             object_states=self.scene.get_dictionary_object_states(),
             low_dim_object_poses=self.scene.get_low_dim_object_poses(),
             low_dim_object_states=self.scene.get_low_dim_object_states(),
-            joint_vel=self.robot.joint_velocities_noise.apply(np.array(arm_joint_velocities)),
-            joint_pos=self.robot.joint_positions_noise.apply(np.array(arm_joint_positions)),
+            joint_vel=joint_vel,
+            joint_pos=joint_pos,
             joint_forces=joint_forces,
-            gripper_matrix=robot_obs["gripper_view_matrix"],
+            gripper_matrix=partial(
+                self.robot.get_gripper_view_matrix, robot_obs["gripper_pose"][:3], robot_obs["gripper_pose"][3:]
+            ),
             gripper_pose=robot_obs["gripper_pose"],
             gripper_state=robot_obs["gripper_opening_state"],
             tcp_pose=robot_obs["tcp_pose"],
@@ -429,6 +616,7 @@ class CalvinEnvironment(gym.Env):
             gripper_touch_forces=ee_forces_flat,
             gripper_joint_positions=robot_obs["gripper_finger_positions"],
             scene_obs=scene_obs,
+            image_age={name: self._frame_age[name] for name in frames},
         )
         return obs
 
@@ -503,7 +691,7 @@ def get_env(dataset_path, obs_space=None, show_gui=True, **kwargs):
     return env
 
 
-def get_env_from_cfg(eval: bool = False, vis: bool = True) -> CalvinEnvironment:
+def get_env_from_cfg(eval: bool = False, vis: bool = True, **env_kwargs) -> CalvinEnvironment:
     """Bypass Hydra's execution context and create the environment manually."""
     with hydra.initialize(config_path="../assets/conf", version_base="1.1"):
         config_name = "master_config_eval" if eval else "master_config"
@@ -515,7 +703,7 @@ def get_env_from_cfg(eval: bool = False, vis: bool = True) -> CalvinEnvironment:
             show_gui = False
             use_egl = True
         # env = hydra.utils.instantiate(cfg.env, show_gui=False, use_vr=False, use_scene_info=True)
-        env = CalvinEnvironment(
+        env_args = dict(
             robot_cfg=cfg.robot,  # Robot basic cfg load here
             seed=cfg.seed,  # ignore for now
             use_vr=cfg.env.use_vr,  # correct
@@ -527,6 +715,13 @@ def get_env_from_cfg(eval: bool = False, vis: bool = True) -> CalvinEnvironment:
             use_egl=use_egl,
             control_freq=cfg.env.control_freq,
             action_mode="action_mode",
+            render_periods=cfg.env.get("render_periods"),
+            adaptive_substepping=cfg.env.get("adaptive_substepping"),
+            physics_profile=cfg.env.get("physics_profile", "default"),
+            worker_id=cfg.env.get("worker_id", 0),
         )
+        # explicit keyword arguments override the config, e.g. for benchmarks comparing env settings
+        env_args.update(env_kwargs)
+        env = CalvinEnvironment(**env_args)
         assert env is not None, "Failed to create CustomSimEnv"
         return env
@@ -1,3 +1,5 @@
+from typing import Callable, Union
+
 import numpy as np
 import torch
 
@@ -26,10 +28,11 @@ class CalvinObservation(object):
         gripper_pose: np.ndarray,
         tcp_pose: np.ndarray,
         tcp_state: float,
-        gripper_matrix: np.ndarray,
+        gripper_matrix: Union[np.ndarray, Callable[[], np.ndarray]],
         gripper_joint_positions: np.ndarray,
         gripper_touch_forces: np.ndarray,
-        scene_obs: np.ndarray
+        scene_obs: np.ndarray,
+        image_age: dict[str, int] = None,
     ):
         self._camera_names = camera_names
         self._rgb = rgb
@@ -53,6 +56,7 @@ class CalvinObservation(object):
         self._gripper_joint_positions = gripper_joint_positions
         self._gripper_touch_forces = gripper_touch_forces
         self._scene_obs = scene_obs
+        self._image_age = image_age if image_age is not None else {name: 0 for name in camera_names}
 
         self._action = None
         self._reward = None
@@ -74,6 +78,18 @@ class CalvinObservation(object):
         """
         return self._camera_names
 
+    @property
+    def image_age(self) -> dict[str, int]:
+        """
+        Get the age of the camera images.
+
+        Returns
+        -------
+        dict[str, int]
+            Number of control steps since each camera image was rendered (0 = rendered this step).
+        """
+        return self._image_age
+
     @property
     def rgb(self) -> dict[str, np.ndarray]:
         """
@@ -258,6 +274,20 @@ class CalvinObservation(object):
         """
         return self._tcp_state
 
+    @property
+    def gripper_matrix(self) -> np.ndarray:
+        """
+        Get the view matrix of the gripper camera, computed on first access if it was given as a callable.
+
+        Returns
+        -------
+        np.ndarray
+            The gripper view matrix.
+        """
+        if callable(self._gripper_matrix):
+            self._gripper_matrix = self._gripper_matrix()
+        return self._gripper_matrix
+
     @property
     def action(self) -> np.ndarray:
         """
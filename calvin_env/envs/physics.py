@@ -0,0 +1,123 @@
+import logging
+import math
+
+import numpy as np
+
+# A logger for this file
+log = logging.getLogger(__name__)
+
+
+class AdaptiveSubstepper:
+    """
+    Chooses the physics timestep for every control step from the contact state of the robot.
+
+    While the robot is free in space the largest stable timestep is used, as soon as the robot touches (or is about
+    to touch) something the control period is split into finer substeps. The simulated control period is always
+    exactly 1 / control_freq, since the timestep is set to period / num_substeps.
+    """
+
+    def __init__(
+        self,
+        control_freq,
+        free_time_step=1 / 120,
+        contact_time_step=1 / 480,
+        contact_distance=0.01,
+        ignored_robot_links=(-1, 0),
+    ):
+        """
+        Args:
+            control_freq: control frequency in Hz.
+            free_time_step: max physics timestep in s while the robot is not in contact.
+            contact_time_step: max physics timestep in s while the robot is in (or close to) contact.
+            contact_distance: robot links closer than this distance in m to another body count as in contact.
+            ignored_robot_links: robot links that are permanently in contact (e.g. the base mounted on the table).
+        """
+        assert contact_time_step <= free_time_step
+        self.control_period = 1.0 / control_freq
+        self.free_substeps = max(1, math.ceil(self.control_period / free_time_step - 1e-9))
+        self.contact_substeps = max(1, math.ceil(self.control_period / contact_time_step - 1e-9))
+        self.contact_distance = contact_distance
+        self.ignored_robot_links = set(ignored_robot_links)
+        self.num_substeps = None
+        self.substep_history = []
+
+    def in_contact(self, p, robot_uid, cid):
+        """
+        Contact state from the contact manifold of the last physics step, one query for all bodies.
+
+        Bullet keeps points up to the contact breaking threshold, so near contacts within contact_distance are only
+        seen if the threshold is not smaller.
+        """
+        for point in p.getContactPoints(bodyA=robot_uid, physicsClientId=cid):
+            if point[2] != robot_uid and point[3] not in self.ignored_robot_links and point[8] <= self.contact_distance:
+                return True
+        return False
+
+    def step(self, p, robot_uid, cid):
+        """Advance the simulation by exactly one control period."""
+        num_substeps = self.contact_substeps if self.in_contact(p, robot_uid, cid) else self.free_substeps
+        if num_substeps != self.num_substeps:
+            p.setTimeStep(self.control_period / num_substeps, physicsClientId=cid)
+            self.num_substeps = num_substeps
+        for _ in range(num_substeps):
+            p.stepSimulation(physicsClientId=cid)
+        self.substep_history.append(num_substeps)
+        return num_substeps
+
+    def reset_stats(self):
+        self.substep_history = []
+
+    def get_stats(self):
+        history = np.array(self.substep_history)
+        return {
+            "control_steps": len(history),
+            "physics_steps": int(history.sum()),
+            "contact_ratio": float(np.mean(history == self.contact_substeps)) if len(history) else 0.0,
+        }
+
+
+# Named trade-offs between contact fidelity and simulation speed. "default" keeps the pybullet defaults.
+# contactBreakingThreshold must not be smaller than AdaptiveSubstepper.contact_distance, otherwise near contacts
+# between the two are not reported.
+PHYSICS_PROFILES = {
+    "accurate": {
+        "numSolverIterations": 150,
+        "numSubSteps": 2,
+        "contactBreakingThreshold": 0.01,
+        "enable_sleeping": False,
+        "collision_margin": 0.001,
+    },
+    "default": {},
+    "fast": {
+        "numSolverIterations": 15,
+        "contactBreakingThreshold": 0.02,
+        "enable_sleeping": True,
+    },
+}
+
+
+def apply_physics_profile(p, cid, profile, movable_uids=(), fixed_uids=()):
+    """
+    Configure solver and body dynamics according to a physics profile.
+
+    Args:
+        p: pybullet module or bullet client.
+        cid: physics client id.
+        profile: name of an entry in PHYSICS_PROFILES or a dict with the same keys.
+        movable_uids: bodies that may be deactivated while resting (e.g. blocks).
+        fixed_uids: bodies whose collision margin is adjusted in addition to the movable ones.
+    """
+    settings = dict(PHYSICS_PROFILES[profile]) if isinstance(profile, str) else dict(profile)
+    enable_sleeping = settings.pop("enable_sleeping", False)
+    collision_margin = settings.pop("collision_margin", None)
+    engine_params = {k: v for k, v in settings.items() if v is not None}
+    if engine_params:
+        p.setPhysicsEngineParameter(**engine_params, physicsClientId=cid)
+    if enable_sleeping:
+        for uid in movable_uids:
+            p.changeDynamics(uid, -1, activationState=p.ACTIVATION_STATE_ENABLE_SLEEPING, physicsClientId=cid)
+    if collision_margin is not None:
+        for uid in (*movable_uids, *fixed_uids):
+            for link in range(-1, p.getNumJoints(uid, physicsClientId=cid)):
+                p.changeDynamics(uid, link, collisionMargin=collision_margin, physicsClientId=cid)
+    log.info(f"Applied physics profile {profile}")
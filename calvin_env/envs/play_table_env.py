@@ -220,6 +220,7 @@ class PlayTableSimEnv(gym.Env):
         return info
 
     def step(self, action):
+        self.robot.advance_tick()
         # in vr mode real time simulation is enabled, thus p.stepSimulation() does not have to be called manually
         if self.use_vr:
             log.debug(f"SIM FPS: {(1 / (time.time() - self.t)):.0f}")
@@ -4,6 +4,8 @@ import os
 import pickle
 import time
 
+from calvin_env.utils.lazy_mapping import LazyMapping
+
 # A logger for this file
 log = logging.getLogger(__name__)
 
@@ -77,6 +79,9 @@ class DataRecorder:
         data["vr_events"] = vr_events
         data["state_obs"] = state_obs
         data["done"] = done
+        if isinstance(info.get("robot_info"), LazyMapping):
+            # the queue pickles the frame after the simulation advanced, the lazy fields can not be computed then
+            info["robot_info"].resolve()
         data["info"] = info
         self.queue.put((filename, data))
 
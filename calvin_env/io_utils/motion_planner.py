@@ -1,18 +1,16 @@
-import collections
 import logging
 import time
 
 import numpy as np
 import pybullet as p
-import quaternion  # noqa
-
-import calvin_env.utils.utils as utils
-
-from termcolor import cprint
-
-from pybullet_planning import BASE_LINK, RED, BLUE, GREEN
-import pybullet_planning as planner
 
+from calvin_env.planning.cartesian import plan_cartesian_path
+from calvin_env.planning.collision import CollisionWorld
+from calvin_env.planning.grasps import GraspDatabase
+from calvin_env.planning.plan_cache import PlanCache
+from calvin_env.planning.planner import JointPathPlanner, new_metrics
+from calvin_env.planning.pool import PlanningPool
+from calvin_env.planning.roadmap import Roadmap
 
 # A logger for this file
 log = logging.getLogger(__name__)
@@ -20,93 +18,321 @@ log = logging.getLogger(__name__)
 
 class PandaArmMotionPlanningSolver:
     """
-    pyBullet MotionPlanner for the Panda Arm
+    Headless joint-space motion planner for the Panda arm.
+
+    Plans on a dedicated DIRECT client with a copy of the robot and the scene, the live simulation is only read.
+    Queries run RRT-Connect, randomized shortcutting and a velocity and acceleration limited time parameterization at
+    the control frequency of the environment.
+
+    Args:
+        env: CalvinEnvironment to plan for.
+        max_time: planning time budget per query in seconds.
+        max_iterations: maximum number of RRT-Connect iterations per query.
+        step_size: maximum joint-space length of an RRT edge in rad.
+        resolution: joint-space collision checking resolution of edges in rad.
+        shortcut_iterations: number of shortcut candidates per path.
+        shortcut_batch_size: number of shortcut candidates collision checked together.
+        margin: minimum clearance to obstacles in m.
+        max_velocity: joint velocity limit of the trajectories in rad/s, defaults to the robot max_velocity.
+        max_acceleration: joint acceleration limit of the trajectories in rad/s^2.
+        seed: seed of the sampler.
+        roadmap: None, or dict with the Roadmap.load_or_build arguments (num_nodes, k, cache_dir) to answer queries
+            from a precomputed roadmap of the static scene first and fall back to RRT-Connect.
+        plan_cache: None, or dict with the PlanCache arguments (max_size, resolutions, filename) to reuse paths of
+            recurring planning problems.
+        num_workers: number of planning worker processes for submit(), 0 disables the pool.
+        cartesian: dict with the plan_cartesian_path step sizes (max_translation, max_rotation, max_joint_step).
+        grasp_database: None, or dict with the generate_box_grasps arguments and cache_dir to select grasps of the
+            movable objects with select_grasps().
     """
 
-    def __init__(self, env, limit_angle, visualize_vr_pos, reset_button_queue_len):
-        self.env = env  # Speichern der Umgebung
-        self.robot = env.robot  # Zugriff auf den Roboter
-        self.p = env.p  # Zugriff auf PyBullet
-        # * zoom in so we can see it, this is optional
-        camera_base_pt = (0, 0, 0)
-        camera_pt = np.array(camera_base_pt) + np.array([0.1, -0.1, 0.1])
-        planner.set_camera_pose(tuple(camera_pt), camera_base_pt)
-
-        self.visualize_vr_pos = visualize_vr_pos
-        self.vr_pos_uid = None
-        if visualize_vr_pos:
-            self.vr_pos_uid = self.create_vr_pos_visualization_shape()
-        log.info("Disable Picking")
-        p.configureDebugVisualizer(p.COV_ENABLE_VR_PICKING, 0)
-        p.configureDebugVisualizer(p.COV_ENABLE_VR_RENDER_CONTROLLERS, 0)
-        self._prev_vr_events = None
-        self.prev_action = None
-
-        # wait until first vr action event arrives
-        while self.prev_action is None:
-            _ = self.get_vr_action()
+    def __init__(
+        self,
+        env,
+        max_time=5.0,
+        max_iterations=5000,
+        step_size=0.2,
+        resolution=0.05,
+        shortcut_iterations=100,
+        shortcut_batch_size=32,
+        margin=0.0,
+        max_velocity=None,
+        max_acceleration=4.0,
+        seed=0,
+        roadmap=None,
+        plan_cache=None,
+        num_workers=0,
+        cartesian=None,
+        grasp_database=None,
+    ):
+        self.env = env
+        self.robot = env.robot
+        self.world = CollisionWorld.from_env(env, margin)
+        self.metrics = []
+        self.roadmap = None
+        roadmap_k = 10
+        if roadmap is not None:
+            roadmap = dict(roadmap)
+            roadmap_k = roadmap.get("k", roadmap_k)
+            self.roadmap = Roadmap.load_or_build(self.world, resolution=resolution, seed=seed, **roadmap)
+        self.plan_cache = PlanCache(**plan_cache) if plan_cache is not None else None
+        planner_kwargs = dict(
+            max_velocity=self.robot.max_velocity if max_velocity is None else max_velocity,
+            max_acceleration=max_acceleration,
+            dt=1.0 / env.control_freq,
+            max_time=max_time,
+            max_iterations=max_iterations,
+            step_size=step_size,
+            resolution=resolution,
+            shortcut_iterations=shortcut_iterations,
+            shortcut_batch_size=shortcut_batch_size,
+            roadmap_k=roadmap_k,
+        )
+        self.cartesian = dict(cartesian) if cartesian is not None else {}
+        self.grasp_database = None
+        if grasp_database is not None:
+            grasp_database = {"max_width": 2 * self.robot.gripper_joint_limits[1], **grasp_database}
+            self.grasp_database = GraspDatabase.from_scene(env.scene, **grasp_database)
+        self.path_planner = JointPathPlanner(self.world, seed=seed, roadmap=self.roadmap, **planner_kwargs)
+        self.pool = None
+        if num_workers > 0:
+            self.pool = PlanningPool(self.world, planner_kwargs, num_workers, self.roadmap, seed)
 
-    def create_route(self, start, goal, **kwargs):
+    def sample_valid_config(self, max_attempts=1000):
+        return self.path_planner.sample_valid_config(max_attempts)
+
+    def is_edge_valid(self, q1, q2):
+        return self.path_planner.is_edge_valid(q1, q2)
+
+    def get_current_config(self):
+        states = p.getJointStates(self.robot.robot_uid, self.robot.arm_joint_ids, physicsClientId=self.env.cid)
+        return np.array([state[0] for state in states])
+
+    def goal_to_config(self, goal):
+        """
+        Goals are either arm configurations or tcp poses (pos, orn).
+
+        With a reachability map on the robot, IK is first seeded with the stored solution of the nearest map cell.
+        Poses the map marks unreachable are still solved, a map cell only records a single IK attempt.
         """
-        Plant eine kollisionsfreie Bewegung von start zu goal.
+        if not (isinstance(goal, (tuple, list)) and len(goal) == 2):
+            return np.asarray(goal, dtype=float)
+        pos, orn = goal
+        reachability_map = self.robot.get_reachability_map()
+        if reachability_map is not None:
+            _, _, solution = reachability_map.query(pos, orn)
+            if solution is not None:
+                q, success = self.robot.solve_ik_batch(np.concatenate([pos, orn])[None], seed=solution)
+                if success[0]:
+                    return q[0]
+        return np.asarray(self.robot.mixed_ik.get_ik(pos, orn), dtype=float)
+
+    def plan(self, goal, start=None, ignore_bodies=()):
         """
-        # Lade den aktuellen Zustand des Roboters aus der Umgebung
-        joint_positions = self.robot.get_observation()[0]["arm_joint_states"]
+        Plan a collision free trajectory for the arm.
 
-        # Berechne eine Bewegungstrajektorie
-        route = planner.plan_joint_motion(self.robot.robot_uid, start, goal, **kwargs)
+        Args:
+            goal: goal configuration (7,) or tcp pose (pos, orn).
+            start: start configuration, defaults to the current configuration of the live robot.
+            ignore_bodies: names of scene bodies that are not checked for collisions, e.g. an object to grasp.
 
-        if route is None:
-            log.warning("Keine gültige Route gefunden.")
-            return None
+        Returns:
+            dict with
+                success: whether a trajectory was found.
+                positions: (T, 7) joint positions, one per control step.
+                times: (T,) time of every sample in seconds.
+                path: (N, 7) shortcut waypoints.
+                metrics: dict of per-query planning metrics.
+        """
+        t0 = time.time()
+        self.world.sync()
+        self.world.ignored_bodies = {self.world.get_body_uid(name) for name in ignore_bodies}
+        start = self.get_current_config() if start is None else np.asarray(start, dtype=float)
+        checks_before = self.world.num_checks
+        metrics = new_metrics()
+
+        goal_config = self.goal_to_config(goal)
+        path, cache_key = None, None
+        if self.plan_cache is not None:
+            t_cache = time.time()
+            scene_state = self.world.read_scene_state(self.world.cid, self.world.robot_uid, self.world.body_uids)
+            scene_state = np.concatenate([scene_state, sorted(self.world.ignored_bodies)])
+            cache_key = self.plan_cache.key(start, goal, scene_state)
+            path = self._get_cached_path(cache_key, start, goal_config)
+            metrics["cache"] = "miss" if path is None else "hit"
+            metrics["cache_time"] = time.time() - t_cache
+        if path is None:
+            path = self.path_planner.plan_path(start, goal_config, metrics)
+            if path is not None and cache_key is not None:
+                self.plan_cache.put(cache_key, path)
+        result = self.path_planner.make_result(path, metrics)
 
-        return route
+        self.world.ignored_bodies = set()
+        metrics["collision_checks"] = self.world.num_checks - checks_before
+        metrics["planning_time"] = time.time() - t0
+        self.metrics.append(metrics)
+        log.debug(f"Planning {'succeeded' if result['success'] else 'failed'} in {metrics['planning_time']:.3f}s")
+        return result
 
-    def step(self, state_obs):
+    def plan_cartesian(self, goal_pose, start=None, ignore_bodies=(), fallback=True):
         """
-        Collect state observation dict
-        --state_obs
-            --robot_obs
-                --robot_state_full
-                    -- [tcp_pos, tcp_orn, gripper_opening_width]
-                --gripper_opening_width
-                --arm_joint_states
-                --gripper_action}
-            --scene_obs
-
-        robot_obs, robot_info = self.robot.get_observation()
-        scene_obs = self.scene.get_obs()
-        obs = {"robot_obs": robot_obs, "scene_obs": scene_obs}
+        Plan a straight tcp motion, e.g. to approach or retreat from a handle or button.
+
+        The line is solved with batched IK on the kinematics client of the robot, which is much cheaper than sampling
+        based planning. If the line is infeasible (no IK solution, joint discontinuity or collision) the goal pose is
+        planned with plan() instead, unless fallback is False.
+
+        Args:
+            goal_pose: goal tcp pose (pos, orn) with orientation as quaternion.
+            start: start configuration, defaults to the current configuration of the live robot.
+            ignore_bodies: names of scene bodies that are not checked for collisions.
+            fallback: plan with plan() if the straight line is infeasible.
+
+        Returns:
+            result dict of plan(), metrics["planner"] is "cartesian" if the straight line was used.
+        """
+        t0 = time.time()
+        self.world.sync()
+        self.world.ignored_bodies = {self.world.get_body_uid(name) for name in ignore_bodies}
+        start = self.get_current_config() if start is None else np.asarray(start, dtype=float)
+        checks_before = self.world.num_checks
+        metrics = new_metrics()
+        metrics["planner"] = "cartesian"
+        start_pose = self.robot.get_kinematics().get_poses(start[None])["tcp"][0]
+        path = plan_cartesian_path(
+            self.robot.solve_ik_batch,
+            self.world,
+            start,
+            start_pose,
+            np.concatenate(goal_pose),
+            resolution=self.path_planner.resolution,
+            metrics=metrics,
+            **self.cartesian,
+        )
+        self.world.ignored_bodies = set()
+        if path is None and fallback:
+            log.debug(f"Straight line infeasible ({metrics['failure']}), falling back to plan()")
+            result = self.plan(goal_pose, start, ignore_bodies)
+            # account the failed straight line to the query
+            result["metrics"]["cartesian_failure"] = metrics["failure"]
+            result["metrics"]["collision_checks"] = self.world.num_checks - checks_before
+            result["metrics"]["planning_time"] = time.time() - t0
+            return result
+        result = self.path_planner.make_result(path, metrics, stop_at_waypoints=False)
+        metrics["collision_checks"] = self.world.num_checks - checks_before
+        metrics["planning_time"] = time.time() - t0
+        self.metrics.append(metrics)
+        return result
+
+    def select_grasps(self, object_name, max_candidates=None, **kwargs):
         """
-        robot_obs = state_obs["robot_obs"]
-        scene_obs = state_obs["scene_obs"]
-        # * get the current end effector position
-        tcp_pos, tcp_orn, gripper_opening_width = robot_obs["robot_state_full"]
-        # * get the current arm joint states
-        arm_joint_states = robot_obs["arm_joint_states"]
-        # * get the current gripper action
-        gripper_action = robot_obs["gripper_action"]
-        # * get the current gripper opening width
-        gripper_opening_width = robot_obs["gripper_opening_width"]
-
-        self.prev_action = desired_ee_pos, desired_ee_orn, gripper_action
-        return desired_ee_pos, desired_ee_orn, gripper_action
-
-    def step(self, action):
-        if isinstance(action, dict) and "motion_plan" in action:
-            # Falls die Aktion eine geplante Trajektorie enthält, iteriere darüber
-            for joint_target in action["motion_plan"]:
-                self.robot.apply_action(joint_target)
-                self.p.stepSimulation(physicsClientId=self.cid)
-                time.sleep(0.01)  # Zeitverzögerung für Stabilität
-
-        else:
-            # Standardmäßige Aktion, falls keine geplante Trajektorie vorhanden ist
-            self.robot.apply_action(action)
-            for _ in range(self.action_repeat):
-                self.p.stepSimulation(physicsClientId=self.cid)
-
-        self.scene.step()
-        obs = self.get_obs()
-        info = self.get_info()
-        return obs, 0, False, info
+        Ranked feasible grasps of a movable object at its current pose, see GraspDatabase.select.
+
+        Candidates are confirmed with the reachability map of the robot if it has one, those the map does not confirm
+        with one batched IK call seeded with the current configuration.
+        """
+        if self.grasp_database is None:
+            raise RuntimeError("select_grasps() needs a grasp database, set grasp_database")
+        uid = next(obj.uid for obj in self.env.scene.movable_objects if obj.name == object_name)
+        position, orientation = p.getBasePositionAndOrientation(uid, physicsClientId=self.env.cid)
+        grasps = self.grasp_database.select(
+            object_name,
+            position,
+            orientation,
+            reachability_map=self.robot.get_reachability_map(),
+            solve_ik=lambda poses, seed: self.robot.solve_ik_batch(poses, seed, continuity=False),
+            seed=self.get_current_config(),
+            **kwargs,
+        )
+        if max_candidates is not None:
+            grasps = {field: values[:max_candidates] for field, values in grasps.items()}
+        return grasps
+
+    def _get_cached_path(self, key, start, goal_config):
+        """
+        Cached path re-validated between the actual start and goal, the cached ones differ up to the quantization.
+
+        All edges are checked with a single batched collision check.
+        """
+        path = self.plan_cache.get(key)
+        if path is None:
+            return None
+        path[0] = start
+        path[-1] = goal_config
+        if self.world.is_valid(start) and self.path_planner.check_edges(path[:-1], path[1:]).all():
+            return path
+        self.plan_cache.invalidate(key)
+        return None
+
+    def submit(self, goal, start=None, ignore_bodies=(), scene_state=None):
+        """
+        Plan asynchronously on the worker pool, e.g. to prefetch the plan of the next subtask during execution.
+
+        Args:
+            goal: goal configuration (7,) or tcp pose (pos, orn), poses are converted with IK before submitting.
+            start: start configuration, defaults to the current configuration of the live robot.
+            ignore_bodies: names of scene bodies that are not checked for collisions.
+            scene_state: scene state vector to plan in (see CollisionWorld.read_scene_state), defaults to the
+                current state of the live simulation.
+
+        Returns:
+            Future of the result dict of plan(), the query metrics are added to self.metrics when it is done.
+        """
+        if self.pool is None:
+            raise RuntimeError("submit() needs a planning pool, set num_workers > 0")
+        start = self.get_current_config() if start is None else start
+        scene_state = self.world.read_scene_state() if scene_state is None else scene_state
+        ignored_bodies = [self.world.get_body_uid(name) for name in ignore_bodies]
+        future = self.pool.submit(start, self.goal_to_config(goal), scene_state, ignored_bodies)
+        future.add_done_callback(self._record_future_metrics)
+        return future
+
+    def _record_future_metrics(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.metrics.append(future.result()["metrics"])
+
+    def create_route(self, start, goal, **kwargs):
+        """Plan from start to goal, returns the trajectory positions or None if planning failed."""
+        result = self.plan(goal, start, **kwargs)
+        if not result["success"]:
+            log.warning(f"No route found: {result['metrics']['failure']}")
+            return None
+        return result["positions"]
+
+    def execute(self, plan, gripper_action=1):
+        """Step the environment along a planned trajectory, yields the env.step return of every control step."""
+        for q in plan["positions"]:
+            yield self.env.step(np.append(q, gripper_action), "joint_abs")
+
+    def get_metrics_summary(self):
+        """Aggregate the metrics of all queries so far."""
+        if not self.metrics:
+            return {"queries": 0}
+        successful = [m for m in self.metrics if m["success"]]
+        planning_times = np.array([m["planning_time"] for m in self.metrics])
+        summary = {
+            "queries": len(self.metrics),
+            "success_rate": len(successful) / len(self.metrics),
+            "planning_time_mean": float(planning_times.mean()),
+            "planning_time_median": float(np.median(planning_times)),
+            "planning_time_p95": float(np.percentile(planning_times, 95)),
+            "collision_checks_mean": float(np.mean([m["collision_checks"] for m in self.metrics])),
+        }
+        if self.roadmap is not None:
+            summary["roadmap_rate"] = float(np.mean([m.get("planner") == "roadmap" for m in successful] or [0.0]))
+        cartesian = [m for m in self.metrics if m.get("planner") == "cartesian" or "cartesian_failure" in m]
+        if cartesian:
+            summary["cartesian_rate"] = float(np.mean([m.get("planner") == "cartesian" for m in cartesian]))
+        if self.plan_cache is not None:
+            summary["plan_cache"] = self.plan_cache.get_metrics()
+        if successful:
+            summary["path_length_mean"] = float(np.mean([m["path_length"] for m in successful]))
+            summary["duration_mean"] = float(np.mean([m["duration"] for m in successful]))
+        return summary
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+        if self.plan_cache is not None and self.plan_cache.filename is not None:
+            self.plan_cache.save()
+        self.world.close()
@@ -1,46 +1,67 @@
 #!/usr/bin/python3
-from copy import deepcopy
 import logging
-import os
-import sys
 
 import hydra
-import pybullet as p
+import numpy as np
 import quaternion  # noqa
 
 from calvin_env.io_utils.data_recorder import DataRecorder
-from calvin_env.io_utils.motion_planner import PandaArmMotionPlanningSolver
 
 # A logger for this file
 log = logging.getLogger(__name__)
 
 
-@hydra.main(config_path="../conf", config_name="config_data_collection")
+@hydra.main(config_path="assets/conf", config_name="config_planner_data_collection")
 def main(cfg):
     # Load Scene
     env = hydra.utils.instantiate(cfg.env)
-    planner = hydra.utils.instantiate(cfg.motion_planner)
-    route = planner.create_route(start, goal, **kwargs)
+    planner = hydra.utils.instantiate(cfg.motion_planner, env=env)
 
     data_recorder = None
     if cfg.recorder.record:
         data_recorder = DataRecorder(env, cfg.recorder.record_fps, cfg.recorder.enable_tts)
 
-    log.info("Level Initiated and Route Calculated!")
-
-    done = False
-
-    while not done:
-        # get input events
-        prev_obs = env.get_state_obs()
-        action = route.step(prev_obs)
-        obs, _, _, info = env.step(action)
-        done = info.get("goal_reached", False)
-
-        if cfg.recorder.record:
-            data_recorder.step(None, obs, done, info)  # 'None' or planner-specific events
+    log.info("Initialization done!")
 
+    for episode in range(cfg.num_episodes):
         env.reset()
+        goals = [planner.sample_valid_config() for _ in range(cfg.num_subtasks)]
+        if any(goal is None for goal in goals):
+            log.warning(f"Episode {episode}: no valid goal configuration found")
+            continue
+        plan = planner.plan(goals[0])
+        for subtask, goal in enumerate(goals):
+            if not plan["success"]:
+                log.warning(f"Episode {episode}, subtask {subtask}: planning failed ({plan['metrics']['failure']})")
+                break
+            # plan the next subtask from the goal of this one while it executes
+            next_plan = None
+            if planner.pool is not None and subtask + 1 < len(goals):
+                next_plan = planner.submit(goals[subtask + 1], start=plan["positions"][-1])
+            num_steps = len(plan["positions"])
+            for i, (obs, _, _, info) in enumerate(planner.execute(plan)):
+                done = i == num_steps - 1 and subtask == len(goals) - 1
+                if data_recorder is not None:
+                    data_recorder.step([], obs, done, info)
+            log.info(
+                f"Episode {episode}, subtask {subtask}: {num_steps} steps, "
+                f"planned in {plan['metrics']['planning_time']:.3f}s"
+            )
+            if subtask + 1 == len(goals):
+                break
+            if next_plan is not None:
+                plan = next_plan.result()
+                # the controller tracks the trajectory only approximately, replan if it ended too far from its goal
+                if plan["success"] and np.abs(planner.get_current_config() - plan["positions"][0]).max() > 0.05:
+                    plan = planner.plan(goals[subtask + 1])
+            else:
+                plan = planner.plan(goals[subtask + 1])
+
+    log.info(f"Planning metrics: {planner.get_metrics_summary()}")
+    planner.close()
+    if data_recorder is not None:
+        # let the serialization worker write the queued frames and exit
+        data_recorder.close()
 
 
 if __name__ == "__main__":
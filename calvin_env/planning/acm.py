@@ -0,0 +1,122 @@
+import hashlib
+import logging
+from pathlib import Path
+
+import numpy as np
+import pybullet as p
+
+from calvin_env.planning.sdf import DEFAULT_CACHE_DIR as SDF_CACHE_DIR
+
+# A logger for this file
+log = logging.getLogger(__name__)
+
+ACM_CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = SDF_CACHE_DIR.parent / "acm"
+
+
+def _pair(a, b):
+    return (a, b) if a < b else (b, a)
+
+
+def get_adjacent_pairs(cid, body_uid, rigid_groups):
+    """
+    Link pairs that touch by construction: parent and child link and links of the same or of adjacent rigid groups.
+
+    Args:
+        cid: physics client id.
+        body_uid: body to analyse.
+        rigid_groups: map from link to the first link of its rigid group, see CollisionWorld.
+
+    Returns:
+        set of (link_a, link_b) pairs with link_a < link_b, the base link is -1.
+    """
+    links = sorted(rigid_groups)
+    parents = {i: p.getJointInfo(body_uid, i, physicsClientId=cid)[16] for i in links if i >= 0}
+    # parent group of every rigid group, -1 has no parent
+    group_parents = {rigid_groups[i]: rigid_groups[parents[i]] for i in links if i >= 0 and rigid_groups[i] == i}
+    adjacent = set()
+    for a in links:
+        for b in links:
+            if a >= b:
+                continue
+            group_a, group_b = rigid_groups[a], rigid_groups[b]
+            if group_a == group_b or group_parents.get(group_a) == group_b or group_parents.get(group_b) == group_a:
+                adjacent.add((a, b))
+    return adjacent
+
+
+def sample_self_collisions(world, num_samples, rng):
+    """
+    Count for every link pair of the robot in how many random configurations it is in contact.
+
+    Arm and gripper joints are sampled uniformly within their limits. The world must not filter self collisions yet.
+
+    Returns:
+        dict mapping (link_a, link_b) to the number of configurations with a contact.
+    """
+    cid, uid = world.cid, world.robot_uid
+    gripper_limits = np.array(
+        [p.getJointInfo(uid, i, physicsClientId=cid)[8:10] for i in world.gripper_joint_ids], dtype=float
+    )
+    joint_ids = world.arm_joint_ids + world.gripper_joint_ids
+    initial_state = [[s[0]] for s in p.getJointStates(uid, joint_ids, physicsClientId=cid)]
+    counts = {}
+    for _ in range(num_samples):
+        world.set_arm(rng.uniform(world.lower_limits, world.upper_limits))
+        gripper = rng.uniform(gripper_limits[:, 0], gripper_limits[:, 1])
+        p.resetJointStatesMultiDof(uid, world.gripper_joint_ids, [[x] for x in gripper], physicsClientId=cid)
+        p.performCollisionDetection(physicsClientId=cid)
+        pairs = {_pair(c[3], c[4]) for c in p.getContactPoints(uid, uid, physicsClientId=cid) if c[8] < 0}
+        for pair in pairs:
+            counts[pair] = counts.get(pair, 0) + 1
+    p.resetJointStatesMultiDof(uid, joint_ids, initial_state, physicsClientId=cid)
+    return counts
+
+
+def compute_allowed_collisions(world, num_samples=20000, seed=0):
+    """
+    Allowed collision matrix of the robot: adjacent link pairs and pairs that never collide in num_samples random
+    configurations. Contacts of allowed pairs never need to be checked.
+
+    Args:
+        world: CollisionWorld without pair filtering.
+        num_samples: number of random configurations.
+        seed: seed of the sampler.
+
+    Returns:
+        sorted list of allowed (link_a, link_b) pairs.
+    """
+    rng = np.random.default_rng(seed)
+    links = sorted(world.robot_link_groups)
+    adjacent = get_adjacent_pairs(world.cid, world.robot_uid, world.robot_link_groups)
+    counts = sample_self_collisions(world, num_samples, rng)
+    never = {(a, b) for a in links for b in links if a < b and (a, b) not in counts}
+    allowed = adjacent | never
+    log.info(
+        f"Allowed collision matrix: {len(adjacent)} adjacent and {len(never - adjacent)} never colliding of "
+        f"{len(links) * (len(links) - 1) // 2} link pairs"
+    )
+    return sorted(allowed)
+
+
+def acm_cache_key(world, num_samples, seed):
+    """Hash of the robot, the sampled joints and their limits and the sampling parameters."""
+    h = hashlib.sha1(Path(world.robot_urdf).read_bytes())
+    h.update(np.array([*world.arm_joint_ids, *world.gripper_joint_ids], dtype=float).tobytes())
+    h.update(np.array([*world.lower_limits, *world.upper_limits], dtype=float).tobytes())
+    h.update(np.array([num_samples, seed, ACM_CACHE_VERSION], dtype=float).tobytes())
+    return h.hexdigest()[:16]
+
+
+def load_or_compute_allowed_collisions(world, num_samples=20000, seed=0, cache_dir=DEFAULT_CACHE_DIR):
+    """Load the allowed collision matrix of the robot from cache_dir, compute and store it if there is none."""
+    key = acm_cache_key(world, num_samples, seed)
+    cache_file = Path(cache_dir) / f"acm_{key}.npz" if cache_dir is not None else None
+    if cache_file is not None and cache_file.is_file():
+        log.info(f"Loading allowed collision matrix from {cache_file}")
+        return [tuple(pair) for pair in np.load(cache_file)["allowed_collisions"].tolist()]
+    allowed = compute_allowed_collisions(world, num_samples, seed)
+    if cache_file is not None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(cache_file, allowed_collisions=np.array(allowed, dtype=int).reshape(-1, 2), key=key)
+    return allowed
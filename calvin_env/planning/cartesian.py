@@ -0,0 +1,95 @@
+import time
+
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+from scipy.spatial.transform import Slerp
+
+
+def interpolate_poses(start_pose, goal_pose, max_translation=0.01, max_rotation=0.05):
+    """
+    Straight-line tcp poses from start to goal, linear in position and slerped in orientation.
+
+    Args:
+        start_pose: (7,) pose [x, y, z, qx, qy, qz, qw].
+        goal_pose: (7,) pose.
+        max_translation: maximum distance between consecutive poses in m.
+        max_rotation: maximum rotation between consecutive poses in rad.
+
+    Returns:
+        (N, 7) poses excluding the start pose and including the goal pose, N >= 1.
+    """
+    start_pose, goal_pose = np.asarray(start_pose, dtype=float), np.asarray(goal_pose, dtype=float)
+    rotations = R.from_quat([start_pose[3:7], goal_pose[3:7]])
+    distance = np.linalg.norm(goal_pose[:3] - start_pose[:3])
+    angle = (rotations[0].inv() * rotations[1]).magnitude()
+    num_steps = max(int(np.ceil(max(distance / max_translation, angle / max_rotation))), 1)
+    s = np.arange(1, num_steps + 1) / num_steps
+    positions = start_pose[:3] + s[:, None] * (goal_pose[:3] - start_pose[:3])
+    orientations = Slerp([0.0, 1.0], rotations)(s).as_quat()
+    return np.concatenate([positions, orientations], axis=1)
+
+
+def find_discontinuities(path, max_joint_step):
+    """Indices of the edges of a joint-space path along which a joint moves more than max_joint_step."""
+    return np.flatnonzero(np.any(np.abs(np.diff(path, axis=0)) > max_joint_step, axis=1))
+
+
+def plan_cartesian_path(
+    solve_ik,
+    world,
+    start,
+    start_pose,
+    goal_pose,
+    max_translation=0.01,
+    max_rotation=0.05,
+    max_joint_step=0.2,
+    resolution=0.05,
+    metrics=None,
+):
+    """
+    Joint-space path that moves the tcp along a straight line.
+
+    All interpolated poses are solved in one batched IK call, every pose seeded with the solution of the previous
+    one. The path is rejected if a pose has no solution, if consecutive solutions jump (e.g. the IK flipped to
+    another branch of the arm) or if an edge collides, the configurations along all edges are checked in one batch.
+
+    Args:
+        solve_ik: function (poses, seed) -> (q, success), e.g. Robot.solve_ik_batch.
+        world: CollisionWorld synced to the scene.
+        start: (dof,) start configuration.
+        start_pose: (7,) tcp pose of the start configuration.
+        goal_pose: (7,) goal tcp pose [x, y, z, qx, qy, qz, qw].
+        max_translation: maximum tcp translation between consecutive poses in m.
+        max_rotation: maximum tcp rotation between consecutive poses in rad.
+        max_joint_step: maximum joint motion between consecutive poses in rad.
+        resolution: joint-space collision checking resolution of the edges in rad.
+        metrics: optional dict the failure reason and timings are written to.
+
+    Returns:
+        (N, dof) waypoints from start to the goal, or None if the straight line is infeasible.
+    """
+    metrics = {} if metrics is None else metrics
+    t0 = time.time()
+    poses = interpolate_poses(start_pose, goal_pose, max_translation, max_rotation)
+    qs, success = solve_ik(poses, np.asarray(start, dtype=float))
+    metrics["ik_time"] = time.time() - t0
+    metrics["cartesian_poses"] = len(poses)
+    path = np.concatenate([np.asarray(start, dtype=float)[None], qs])
+    if not world.is_valid(path[0]):
+        metrics["failure"] = "invalid_start"
+        return None
+    if not np.all(success):
+        metrics["failure"] = "ik"
+        return None
+    if len(find_discontinuities(path, max_joint_step)):
+        metrics["failure"] = "discontinuity"
+        return None
+    t_check = time.time()
+    # the edges are short, check all their configurations in one pass that stops at the first collision
+    qs = np.concatenate([world.interpolate_edge(q1, q2, resolution) for q1, q2 in zip(path[:-1], path[1:])])
+    valid = world.check_configs(qs, early_exit=True)
+    metrics["cartesian_check_time"] = time.time() - t_check
+    if not valid.all():
+        metrics["failure"] = "collision"
+        return None
+    return path
@@ -0,0 +1,401 @@
+import functools
+import logging
+
+import numpy as np
+import pybullet as p
+
+from calvin_env.planning.acm import DEFAULT_CACHE_DIR as ACM_CACHE_DIR, load_or_compute_allowed_collisions
+
+# A logger for this file
+log = logging.getLogger(__name__)
+
+# subsets of contacts for in_collision: static contacts never change between planning queries (self collisions of
+# the arm and contacts with non-moving links of fixed bodies), dynamic contacts depend on the scene state (movable
+# objects, doors and drawers, gripper opening)
+ALL, STATIC, DYNAMIC = "all", "static", "dynamic"
+
+# collision filter groups, scene bodies are only checked against moving robot links
+SCENE_GROUP = 1
+ROBOT_GROUP = 2
+STATIC_ROBOT_GROUP = 4
+
+
+@functools.lru_cache(maxsize=None)
+def bisection_order(n):
+    """Order 0..n-1 coarse to fine (n/2, n/4, 3n/4, ...), collisions along an edge are found after fewer checks."""
+    order, seen = [], set()
+    intervals = [(0, n - 1)]
+    while intervals:
+        next_intervals = []
+        for lo, hi in intervals:
+            if lo > hi:
+                continue
+            mid = (lo + hi) // 2
+            if mid not in seen:
+                seen.add(mid)
+                order.append(mid)
+            next_intervals += [(lo, mid - 1), (mid + 1, hi)]
+        intervals = next_intervals
+    return np.array(order, dtype=int)
+
+
+class CollisionWorld:
+    """
+    Headless copy of the robot and the scene in its own DIRECT pybullet client, used for collision checking.
+
+    The live simulation is never touched, scene changes (doors, drawers, blocks, gripper opening) are copied over
+    with sync() or as compact state vectors with set_scene_state().
+
+    Args:
+        robot_urdf: path of the robot urdf.
+        base_position: robot base position.
+        base_orientation: robot base orientation (quaternion).
+        arm_joint_ids: joint ids of the arm joints that are planned for.
+        gripper_joint_ids: joint ids of the gripper fingers.
+        lower_limits: lower joint limits of the arm joints.
+        upper_limits: upper joint limits of the arm joints.
+        bodies: scene bodies as dicts with file, position, orientation, global_scaling and movable.
+        margin: minimum clearance, configurations closer than margin to an obstacle are in collision.
+        filter_pairs: let pybullet skip allowed robot link pairs and scene-scene pairs in the narrowphase. Otherwise
+            all contacts are reported and filtered in python.
+        allowed_collisions: allowed robot link pairs, sampled with acm_samples configurations if None.
+        acm_samples: number of random configurations to sample the allowed collision matrix.
+        acm_cache_dir: directory the sampled allowed collision matrix is cached in, None to always sample it.
+    """
+
+    def __init__(
+        self,
+        robot_urdf,
+        base_position,
+        base_orientation,
+        arm_joint_ids,
+        gripper_joint_ids,
+        lower_limits,
+        upper_limits,
+        bodies=(),
+        margin=0.0,
+        filter_pairs=True,
+        allowed_collisions=None,
+        acm_samples=20000,
+        acm_cache_dir=ACM_CACHE_DIR,
+    ):
+        self.init_kwargs = dict(
+            robot_urdf=str(robot_urdf),
+            base_position=tuple(base_position),
+            base_orientation=tuple(base_orientation),
+            arm_joint_ids=list(arm_joint_ids),
+            gripper_joint_ids=list(gripper_joint_ids),
+            lower_limits=np.asarray(lower_limits, dtype=float),
+            upper_limits=np.asarray(upper_limits, dtype=float),
+            bodies=[dict(body) for body in bodies],
+            margin=margin,
+            filter_pairs=filter_pairs,
+            acm_samples=acm_samples,
+            acm_cache_dir=acm_cache_dir,
+        )
+        self.cid = p.connect(p.DIRECT)
+        self.robot_urdf = str(robot_urdf)
+        self.base_position = tuple(base_position)
+        self.base_orientation = tuple(base_orientation)
+        self.robot_uid = p.loadURDF(
+            str(robot_urdf),
+            base_position,
+            base_orientation,
+            useFixedBase=True,
+            flags=p.URDF_USE_SELF_COLLISION | p.URDF_USE_SELF_COLLISION_EXCLUDE_PARENT,
+            physicsClientId=self.cid,
+        )
+        self.arm_joint_ids = list(arm_joint_ids)
+        self.gripper_joint_ids = list(gripper_joint_ids)
+        self.lower_limits = np.asarray(lower_limits, dtype=float)
+        self.upper_limits = np.asarray(upper_limits, dtype=float)
+        self.margin = margin
+        self.num_dof = len(self.arm_joint_ids)
+        self.body_cfgs = [dict(body) for body in bodies]
+        self.body_uids = [
+            p.loadURDF(
+                str(body["file"]),
+                body["position"],
+                body["orientation"],
+                useFixedBase=True,
+                globalScaling=body.get("global_scaling", 1.0),
+                physicsClientId=self.cid,
+            )
+            for body in self.body_cfgs
+        ]
+        self.body_num_joints = [p.getNumJoints(uid, physicsClientId=self.cid) for uid in self.body_uids]
+        self.robot_link_groups = self._get_rigid_groups(self.robot_uid)
+        # links whose pose does not depend on the arm joints, e.g. the base resting on the table
+        self.static_robot_links = self._get_static_links(self.robot_uid, self.arm_joint_ids)
+        self.gripper_links = self._get_links_behind(self.robot_uid, self.gripper_joint_ids)
+        # per body: links rigidly attached to its base, the others move with the scene state
+        self.static_body_links = {
+            uid: self._get_static_links(uid, self._get_moving_joints(uid)) for uid in self.body_uids
+        }
+        self.movable_body_uids = {uid for uid, body in zip(self.body_uids, self.body_cfgs) if body["movable"]}
+        self.ignored_bodies = set()
+        self.num_checks = 0
+        self.filter_pairs = filter_pairs
+        self.allowed_collisions = []
+        if filter_pairs:
+            if allowed_collisions is None:
+                allowed_collisions = load_or_compute_allowed_collisions(self, acm_samples, cache_dir=acm_cache_dir)
+            self._set_collision_filters(allowed_collisions)
+
+    def get_init_kwargs(self):
+        """Constructor arguments of an identical world, e.g. for worker processes, reusing the sampled ACM."""
+        return {**self.init_kwargs, "allowed_collisions": self.allowed_collisions if self.filter_pairs else None}
+
+    def _set_collision_filters(self, allowed_collisions):
+        self.allowed_collisions = [tuple(pair) for pair in allowed_collisions]
+        for link_a, link_b in self.allowed_collisions:
+            p.setCollisionFilterPair(self.robot_uid, self.robot_uid, link_a, link_b, 0, physicsClientId=self.cid)
+        for link in self.robot_link_groups:
+            if link in self.static_robot_links:
+                p.setCollisionFilterGroupMask(self.robot_uid, link, STATIC_ROBOT_GROUP, ROBOT_GROUP, self.cid)
+            else:
+                mask = SCENE_GROUP | ROBOT_GROUP | STATIC_ROBOT_GROUP
+                p.setCollisionFilterGroupMask(self.robot_uid, link, ROBOT_GROUP, mask, self.cid)
+        for uid, num_joints in zip(self.body_uids, self.body_num_joints):
+            for link in range(-1, num_joints):
+                p.setCollisionFilterGroupMask(uid, link, SCENE_GROUP, ROBOT_GROUP, self.cid)
+
+    @classmethod
+    def from_env(cls, env, margin=0.0, **kwargs):
+        """Clone the robot and the scene of a running environment, kwargs are passed to the constructor."""
+        robot, scene = env.robot, env.scene
+        bodies = []
+        live_uids = []
+        for obj in [*scene.fixed_objects, *scene.movable_objects]:
+            position, orientation = p.getBasePositionAndOrientation(obj.uid, physicsClientId=env.cid)
+            bodies.append(
+                {
+                    "name": obj.name,
+                    "file": obj.file,
+                    "position": position,
+                    "orientation": orientation,
+                    "global_scaling": obj.global_scaling,
+                    "movable": obj in scene.movable_objects,
+                }
+            )
+            live_uids.append(obj.uid)
+        world = cls(
+            robot.get_urdf_path(),
+            robot.base_position,
+            robot.base_orientation,
+            robot.arm_joint_ids,
+            robot.gripper_joint_ids,
+            robot.ll_real,
+            robot.ul_real,
+            bodies,
+            margin,
+            **kwargs,
+        )
+        world.live_cid = env.cid
+        world.live_robot_uid = robot.robot_uid
+        world.live_body_uids = live_uids
+        world.sync()
+        return world
+
+    def _get_static_links(self, body_uid, joint_ids):
+        static = {-1}
+        for i in range(p.getNumJoints(body_uid, physicsClientId=self.cid)):
+            info = p.getJointInfo(body_uid, i, physicsClientId=self.cid)
+            if info[16] in static and i not in joint_ids:
+                static.add(i)
+        return static
+
+    def _get_moving_joints(self, body_uid):
+        return [
+            i
+            for i in range(p.getNumJoints(body_uid, physicsClientId=self.cid))
+            if p.getJointInfo(body_uid, i, physicsClientId=self.cid)[2] != p.JOINT_FIXED
+        ]
+
+    def _get_links_behind(self, body_uid, joint_ids):
+        """Links moved by any of the joints, in pybullet the child link of a joint has the joint index."""
+        links = set()
+        for i in range(p.getNumJoints(body_uid, physicsClientId=self.cid)):
+            if i in joint_ids or p.getJointInfo(body_uid, i, physicsClientId=self.cid)[16] in links:
+                links.add(i)
+        return links
+
+    def _get_rigid_groups(self, body_uid):
+        """Map every link to the first link of its rigid group, links connected by fixed joints never move apart."""
+        groups = {-1: -1}
+        for i in range(p.getNumJoints(body_uid, physicsClientId=self.cid)):
+            info = p.getJointInfo(body_uid, i, physicsClientId=self.cid)
+            groups[i] = groups[info[16]] if info[2] == p.JOINT_FIXED else i
+        return groups
+
+    def get_link_names(self, links):
+        """Names of robot links, -1 is the base link."""
+        return [
+            (
+                p.getBodyInfo(self.robot_uid, physicsClientId=self.cid)[0]
+                if link == -1
+                else p.getJointInfo(self.robot_uid, link, physicsClientId=self.cid)[12]
+            ).decode()
+            for link in links
+        ]
+
+    def get_body_uid(self, name):
+        return self.body_uids[[body["name"] for body in self.body_cfgs].index(name)]
+
+    def read_scene_state(self, cid=None, robot_uid=None, body_uids=None):
+        """
+        Read the collision-relevant scene state of the live simulation as a compact vector.
+
+        Layout: gripper joint positions, then per body its joint positions followed by position and quaternion for
+        movable bodies.
+        """
+        cid = self.live_cid if cid is None else cid
+        robot_uid = self.live_robot_uid if robot_uid is None else robot_uid
+        body_uids = self.live_body_uids if body_uids is None else body_uids
+        state = [s[0] for s in p.getJointStates(robot_uid, self.gripper_joint_ids, physicsClientId=cid)]
+        for uid, num_joints, body in zip(body_uids, self.body_num_joints, self.body_cfgs):
+            if num_joints:
+                state.extend(s[0] for s in p.getJointStates(uid, range(num_joints), physicsClientId=cid))
+            if body["movable"]:
+                position, orientation = p.getBasePositionAndOrientation(uid, physicsClientId=cid)
+                state.extend(position)
+                state.extend(orientation)
+        return np.array(state)
+
+    def set_scene_state(self, state):
+        """Apply a scene state vector as returned by read_scene_state."""
+        state = np.asarray(state, dtype=float)
+        n = len(self.gripper_joint_ids)
+        p.resetJointStatesMultiDof(
+            self.robot_uid, self.gripper_joint_ids, [[x] for x in state[:n]], physicsClientId=self.cid
+        )
+        for uid, num_joints, body in zip(self.body_uids, self.body_num_joints, self.body_cfgs):
+            if num_joints:
+                p.resetJointStatesMultiDof(
+                    uid, range(num_joints), [[x] for x in state[n : n + num_joints]], physicsClientId=self.cid
+                )
+                n += num_joints
+            if body["movable"]:
+                p.resetBasePositionAndOrientation(uid, state[n : n + 3], state[n + 3 : n + 7], physicsClientId=self.cid)
+                n += 7
+
+    def sync(self):
+        """Copy the scene state of the live simulation."""
+        self.set_scene_state(self.read_scene_state())
+
+    def set_arm(self, q):
+        p.resetJointStatesMultiDof(self.robot_uid, self.arm_joint_ids, [[x] for x in q], physicsClientId=self.cid)
+
+    def within_limits(self, q):
+        return bool(np.all(q >= self.lower_limits) and np.all(q <= self.upper_limits))
+
+    def is_dynamic_contact(self, contact):
+        """Whether a robot contact depends on the scene state, see STATIC and DYNAMIC."""
+        if contact[3] in self.gripper_links:
+            return True
+        if contact[2] == self.robot_uid:
+            return contact[4] in self.gripper_links
+        return contact[2] in self.movable_body_uids or contact[4] not in self.static_body_links[contact[2]]
+
+    def in_collision(self, q, subset=ALL):
+        """
+        Whether the arm configuration q collides with itself or the scene.
+
+        Args:
+            q: arm configuration.
+            subset: ALL, or only STATIC or DYNAMIC contacts, e.g. to re-validate precomputed roadmaps.
+        """
+        self.num_checks += 1
+        self.set_arm(q)
+        p.performCollisionDetection(physicsClientId=self.cid)
+        for contact in p.getContactPoints(bodyA=self.robot_uid, physicsClientId=self.cid):
+            if contact[8] >= self.margin or contact[2] in self.ignored_bodies:
+                continue
+            if not self.filter_pairs:
+                if contact[2] == self.robot_uid:
+                    if self.robot_link_groups[contact[3]] == self.robot_link_groups[contact[4]]:
+                        continue
+                elif contact[3] in self.static_robot_links:
+                    continue
+            if subset != ALL and self.is_dynamic_contact(contact) != (subset == DYNAMIC):
+                continue
+            return True
+        return False
+
+    def is_valid(self, q, subset=ALL):
+        return self.within_limits(q) and not self.in_collision(q, subset)
+
+    def check_configs(self, qs, early_exit=False, subset=ALL):
+        """
+        Validate a batch of configurations, one collision detection pass per configuration within the joint limits.
+
+        Args:
+            qs: (N, dof) configurations.
+            early_exit: stop at the first invalid configuration, later configurations are reported invalid.
+            subset: contacts to check, see in_collision.
+
+        Returns:
+            (N,) bool array, True for valid configurations.
+        """
+        qs = np.asarray(qs, dtype=float)
+        valid = np.all((qs >= self.lower_limits) & (qs <= self.upper_limits), axis=1)
+        if early_exit and not valid.all():
+            return np.zeros(len(qs), dtype=bool)
+        for i in np.flatnonzero(valid):
+            if self.in_collision(qs[i], subset):
+                valid[i] = False
+                if early_exit:
+                    valid[:] = False
+                    break
+        return valid
+
+    @staticmethod
+    def interpolate_edge(q1, q2, resolution=0.05):
+        """Configurations along the straight edge from q1 to q2 (excluding q1), at most resolution apart."""
+        q1, q2 = np.asarray(q1, dtype=float), np.asarray(q2, dtype=float)
+        num_steps = max(int(np.ceil(np.max(np.abs(q2 - q1)) / resolution)), 1)
+        t = np.arange(1, num_steps + 1)[:, None] / num_steps
+        return q1 + t * (q2 - q1)
+
+    def is_edge_valid(self, q1, q2, resolution=0.05, subset=ALL):
+        """Check the straight joint-space edge from q1 to q2 (excluding q1) in steps of at most resolution."""
+        qs = self.interpolate_edge(q1, q2, resolution)
+        # the end point first, then coarse to fine
+        order = np.concatenate([[len(qs) - 1], bisection_order(len(qs) - 1)])
+        return bool(self.check_configs(qs[order], early_exit=True, subset=subset)[-1])
+
+    def check_edges(self, starts, goals, resolution=0.05, subset=ALL):
+        """
+        Validate a batch of edges, returns a (N,) bool array.
+
+        The configurations of all edges are checked level by level in the order of is_edge_valid, first the end
+        points of all edges, then their midpoints and so on. Configurations of edges that are already known to be
+        invalid are skipped.
+        """
+        edges = [self.interpolate_edge(q1, q2, resolution) for q1, q2 in zip(starts, goals)]
+        if not edges:
+            return np.zeros(0, dtype=bool)
+        counts = np.array([len(qs) for qs in edges])
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        edge_ids = np.repeat(np.arange(len(edges)), counts)
+        qs = np.concatenate(edges)
+        # position of every configuration in the coarse to fine order of its edge
+        levels = np.empty(len(qs), dtype=int)
+        for offset, n in zip(offsets, counts):
+            levels[offset + np.concatenate([[n - 1], bisection_order(n - 1)])] = np.arange(n)
+        valid = np.all((qs >= self.lower_limits) & (qs <= self.upper_limits), axis=1)
+        edge_valid = np.logical_and.reduceat(valid, offsets)
+        order = np.argsort(levels, kind="stable")
+        for level in np.split(order, np.flatnonzero(np.diff(levels[order])) + 1):
+            level = level[edge_valid[edge_ids[level]]]
+            if not len(level):
+                # the following levels only contain configurations of longer edges, which are invalid as well
+                break
+            valid[level] = self.check_configs(qs[level], subset=subset)
+            edge_valid[edge_ids[level]] = valid[level]
+        return np.logical_and.reduceat(valid, offsets)
+
+    def close(self):
+        if self.cid >= 0:
+            p.disconnect(physicsClientId=self.cid)
+            self.cid = -1
@@ -0,0 +1,271 @@
+import hashlib
+import logging
+from pathlib import Path
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+from calvin_env.planning.sdf import DEFAULT_CACHE_DIR as SDF_CACHE_DIR
+from calvin_env.planning.spheres import load_mesh_vertices
+from calvin_env.robot.kinematics import _origin_to_matrix
+from calvin_env.utils.pose import quat_multiply, quat_to_matrix
+
+# A logger for this file
+log = logging.getLogger(__name__)
+
+GRASP_CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = SDF_CACHE_DIR.parent / "grasps"
+TOP, SIDE = 0, 1
+
+
+def _geometry_points(geometry, urdf_dir):
+    """Corner points of a urdf collision geometry in its own frame, or None if the type is not supported."""
+    box, cylinder, sphere, mesh = (geometry.find(tag) for tag in ("box", "cylinder", "sphere", "mesh"))
+    if box is not None:
+        half = np.array([float(x) for x in box.get("size").split()]) / 2
+        return np.array(np.meshgrid(*[[-h, h] for h in half], indexing="ij")).reshape(3, -1).T
+    if cylinder is not None:
+        radius, half_length = float(cylinder.get("radius")), float(cylinder.get("length")) / 2
+        return np.array(np.meshgrid([-radius, radius], [-radius, radius], [-half_length, half_length])).reshape(3, -1).T
+    if sphere is not None:
+        radius = float(sphere.get("radius"))
+        return np.array(np.meshgrid(*[[-radius, radius]] * 3)).reshape(3, -1).T
+    if mesh is not None:
+        scale = np.array([float(x) for x in mesh.get("scale", "1 1 1").split()])
+        return load_mesh_vertices(urdf_dir / mesh.get("filename").replace("package://", "")) * scale
+    return None
+
+
+def get_collision_box(urdf_file, global_scaling=1.0):
+    """
+    Axis aligned bounding box of the base link collision geometry in the base frame.
+
+    Returns:
+        center: (3,) box center.
+        half_extents: (3,) half edge lengths.
+    """
+    urdf_file = Path(urdf_file)
+    link = ET.parse(urdf_file).getroot().find("link")
+    points = []
+    for collision in link.findall("collision"):
+        geometry_points = _geometry_points(collision.find("geometry"), urdf_file.parent)
+        if geometry_points is None:
+            log.warning(f"Skipping unsupported collision geometry of {urdf_file.name}")
+            continue
+        T = _origin_to_matrix(collision.find("origin"))
+        points.append(geometry_points @ T[:3, :3].T + T[:3, 3])
+    if not points:
+        raise ValueError(f"No collision geometry in {urdf_file}")
+    points = np.concatenate(points) * global_scaling
+    lower, upper = points.min(axis=0), points.max(axis=0)
+    return (lower + upper) / 2, (upper - lower) / 2
+
+
+def generate_box_grasps(center, half_extents, max_width=0.08, finger_depth=0.02, clearance=0.01, num_offsets=3):
+    """
+    Parallel jaw grasps of a box in its own frame.
+
+    The gripper approaches every face along the inward face normal and closes along each perpendicular box axis
+    that fits between the opened fingers, in both closing directions. Grasps are offset along the remaining axis,
+    keeping the fingers on the face. Approaches from +z (the top face when the box lies flat) are top grasps, the
+    others side grasps.
+
+    Tcp frames have their z axis along the approach and their y axis along the closing direction.
+
+    Args:
+        center: (3,) box center.
+        half_extents: (3,) half edge lengths.
+        max_width: maximum opening of the gripper in m.
+        finger_depth: how deep the fingertips reach past the approached face in m.
+        clearance: minimum free opening around the grasped width, also the margin of the offsets to the box edges.
+        num_offsets: number of grasp positions along the remaining axis.
+
+    Returns:
+        dict with positions (K, 3), orientations (K, 4) quaternions [x, y, z, w], approaches (K, 3) and closings
+        (K, 3) unit vectors, widths (K,) grasped widths and types (K,) TOP or SIDE.
+    """
+    center, half_extents = np.asarray(center, dtype=float), np.asarray(half_extents, dtype=float)
+    positions, rotations, widths, types = [], [], [], []
+    axes = np.eye(3)
+    for face_axis in range(3):
+        for face_sign in (1.0, -1.0):
+            approach = -face_sign * axes[face_axis]
+            depth = min(finger_depth, half_extents[face_axis])
+            face_point = center + face_sign * (half_extents[face_axis] - depth) * axes[face_axis]
+            for closing_axis in set(range(3)) - {face_axis}:
+                width = 2 * half_extents[closing_axis]
+                if width + clearance > max_width:
+                    continue
+                (free_axis,) = set(range(3)) - {face_axis, closing_axis}
+                reach = max(half_extents[free_axis] - clearance, 0.0)
+                for closing_sign in (1.0, -1.0):
+                    y = closing_sign * axes[closing_axis]
+                    rotation = np.stack([np.cross(y, approach), y, approach], axis=1)
+                    for offset in np.linspace(-reach, reach, num_offsets) if reach > 0 else [0.0]:
+                        positions.append(face_point + offset * axes[free_axis])
+                        rotations.append(rotation)
+                        widths.append(width)
+                        types.append(TOP if face_axis == 2 and face_sign > 0 else SIDE)
+    return {
+        "positions": np.array(positions).reshape(-1, 3),
+        "orientations": R.from_matrix(np.array(rotations).reshape(-1, 3, 3)).as_quat().reshape(-1, 4),
+        "approaches": np.array([r[:, 2] for r in rotations]).reshape(-1, 3),
+        "closings": np.array([r[:, 1] for r in rotations]).reshape(-1, 3),
+        "widths": np.array(widths),
+        "types": np.array(types, dtype=int),
+    }
+
+
+class GraspDatabase:
+    """
+    Grasp candidates of the movable objects in object frame, generated once from their urdfs and global_scaling.
+
+    At runtime the candidates of an object are transformed by its pose in one batch and ranked. Grasps that approach
+    from below or close vertically (the fingers would hit the table) are dropped, the others are confirmed with the
+    reachability map of the robot and with one batched IK call, which also provide the IK seeds of the candidates.
+
+    Args:
+        grasps: dict object name -> dict of grasp arrays, see generate_box_grasps.
+        key: cache key of the object geometries and generation parameters.
+    """
+
+    def __init__(self, grasps, key=""):
+        self.grasps = grasps
+        self.key = str(key)
+
+    @classmethod
+    def build(cls, objects, key="", **kwargs):
+        """
+        Args:
+            objects: list of (name, urdf file, global_scaling).
+            kwargs: arguments of generate_box_grasps.
+        """
+        grasps = {}
+        for name, urdf_file, global_scaling in objects:
+            center, half_extents = get_collision_box(urdf_file, global_scaling)
+            grasps[name] = generate_box_grasps(center, half_extents, **kwargs)
+            log.info(f"Generated {len(grasps[name]['positions'])} grasps of {name}")
+        return cls(grasps, key)
+
+    @staticmethod
+    def cache_key(objects, **kwargs):
+        h = hashlib.sha1()
+        for name, urdf_file, global_scaling in objects:
+            h.update(name.encode())
+            h.update(Path(urdf_file).read_bytes())
+            h.update(np.array([global_scaling], dtype=float).tobytes())
+        h.update(repr(sorted(kwargs.items())).encode())
+        h.update(np.array([GRASP_CACHE_VERSION], dtype=float).tobytes())
+        return h.hexdigest()[:16]
+
+    @classmethod
+    def load_or_build(cls, objects, cache_dir=DEFAULT_CACHE_DIR, **kwargs):
+        """Load the grasps of the objects from cache_dir, generate and store them if there are none."""
+        key = cls.cache_key(objects, **kwargs)
+        cache_file = Path(cache_dir) / f"grasps_{key}.npz" if cache_dir is not None else None
+        if cache_file is not None and cache_file.is_file():
+            return cls.load(cache_file)
+        database = cls.build(objects, key, **kwargs)
+        if cache_file is not None:
+            database.save(cache_file)
+        return database
+
+    @classmethod
+    def from_scene(cls, scene, cache_dir=DEFAULT_CACHE_DIR, **kwargs):
+        objects = [(obj.name, obj.file, obj.global_scaling) for obj in scene.movable_objects]
+        return cls.load_or_build(objects, cache_dir, **kwargs)
+
+    def save(self, filename):
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        arrays = {f"{name}/{field}": values for name, grasps in self.grasps.items() for field, values in grasps.items()}
+        np.savez_compressed(filename, key=self.key, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        grasps = {}
+        for entry in data.files:
+            if entry != "key":
+                name, field = entry.rsplit("/", 1)
+                grasps.setdefault(name, {})[field] = data[entry]
+        return cls(grasps, str(data["key"]))
+
+    def transform(self, name, position, orientation):
+        """Grasps of an object at a pose (position, quaternion) in world frame, same fields as in object frame."""
+        grasps = self.grasps[name]
+        rotation = quat_to_matrix(orientation)
+        return {
+            **grasps,
+            "positions": grasps["positions"] @ rotation.T + np.asarray(position, dtype=float),
+            "orientations": quat_multiply(orientation, grasps["orientations"]),
+            "approaches": grasps["approaches"] @ rotation.T,
+            "closings": grasps["closings"] @ rotation.T,
+        }
+
+    def select(
+        self,
+        name,
+        position,
+        orientation,
+        reachability_map=None,
+        solve_ik=None,
+        seed=None,
+        max_approach_z=0.1,
+        max_closing_z=0.5,
+        pregrasp_distance=0.1,
+    ):
+        """
+        Feasible grasps of an object at a pose, best first.
+
+        Candidates are ranked by how vertical their approach is (top grasps first) plus the manipulability of the
+        stored IK solution if a reachability map is given. A map cell only records a single IK attempt, so candidates
+        the map does not confirm are solved with one batched solve_ik call and dropped if that fails as well. Without
+        solve_ik they are kept and ranked below the confirmed candidates.
+
+        Args:
+            name: object name.
+            position: (3,) object position.
+            orientation: (4,) object orientation quaternion [x, y, z, w].
+            reachability_map: optional ReachabilityMap to confirm and seed the candidates.
+            solve_ik: optional function (poses, seed) -> (q, success) to confirm the candidates the map does not, e.g.
+                a partial of Robot.solve_ik_batch with continuity=False.
+            seed: IK seed configuration for solve_ik.
+            max_approach_z: maximum upwards component of the world approach vector.
+            max_closing_z: maximum vertical component of the world closing direction.
+            pregrasp_distance: distance of the pre-grasp positions before the grasp along the approach in m.
+
+        Returns:
+            dict of the grasp arrays of the feasible candidates in world frame, with additional scores (K,),
+            pregrasp_positions (K, 3) and solutions (K, dof) IK seeds (nan if unknown).
+        """
+        grasps = self.transform(name, position, orientation)
+        feasible = (grasps["approaches"][:, 2] <= max_approach_z) & (np.abs(grasps["closings"][:, 2]) <= max_closing_z)
+        grasps = {field: values[feasible] for field, values in grasps.items()}
+        scores = -grasps["approaches"][:, 2]
+        reachable = np.ones(len(scores), dtype=bool)
+        confirmed = np.zeros(len(scores), dtype=bool)
+        solutions = None
+        if reachability_map is not None:
+            cells, known = reachability_map.lookup(grasps["positions"], grasps["orientations"])
+            cells = tuple(cells.T)
+            confirmed = known & reachability_map.reachable[cells]
+            solutions = np.where(confirmed[:, None], reachability_map.solutions[cells], np.nan)
+            scores = scores + np.where(confirmed, reachability_map.manipulability[cells], 0.0)
+        if solve_ik is not None and not confirmed.all():
+            pending = np.flatnonzero(~confirmed)
+            poses = np.concatenate([grasps["positions"][pending], grasps["orientations"][pending]], axis=1)
+            q, success = solve_ik(poses, seed)
+            if solutions is None:
+                solutions = np.full((len(scores), q.shape[1]), np.nan)
+            solutions[pending] = q
+            reachable[pending] = confirmed[pending] = success
+        grasps = {field: values[reachable] for field, values in grasps.items()}
+        scores, confirmed = scores[reachable], confirmed[reachable]
+        solutions = solutions[reachable] if solutions is not None else np.full((len(scores), 0), np.nan)
+        order = np.lexsort((-scores, ~confirmed))
+        grasps = {field: values[order] for field, values in grasps.items()}
+        grasps["scores"] = scores[order]
+        grasps["pregrasp_positions"] = grasps["positions"] - pregrasp_distance * grasps["approaches"]
+        grasps["solutions"] = solutions[order]
+        return grasps
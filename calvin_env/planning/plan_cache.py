@@ -0,0 +1,120 @@
+import collections
+import hashlib
+import logging
+from pathlib import Path
+
+import numpy as np
+
+# A logger for this file
+log = logging.getLogger(__name__)
+
+
+class PlanCache:
+    """
+    LRU cache of planned paths keyed by quantized start configuration, goal and collision-relevant scene state.
+
+    Goals can be configurations or poses (pos, orn), they are flattened before quantization. Scene states are the
+    vectors of CollisionWorld.read_scene_state, hashed after quantization. Cached paths have to be re-validated by
+    the caller, since quantization maps nearby problems to the same key.
+
+    Args:
+        max_size: maximum number of cached paths, the least recently used path is evicted first.
+        start_resolution: quantization of start configurations in rad.
+        goal_resolution: quantization of goals (rad for configurations, m and quaternion units for poses).
+        state_resolution: quantization of scene states.
+        filename: optional npz store, loaded on construction if it exists and written by save().
+    """
+
+    def __init__(
+        self,
+        max_size=1000,
+        start_resolution=0.01,
+        goal_resolution=0.01,
+        state_resolution=0.005,
+        filename=None,
+    ):
+        self.max_size = max_size
+        self.start_resolution = start_resolution
+        self.goal_resolution = goal_resolution
+        self.state_resolution = state_resolution
+        self.filename = filename
+        self._paths = collections.OrderedDict()
+        self.stats = collections.Counter(hits=0, misses=0, invalidated=0, evictions=0)
+        if filename is not None and Path(filename).is_file():
+            self.load(filename)
+
+    @staticmethod
+    def _flatten_goal(goal):
+        if isinstance(goal, (tuple, list)) and len(goal) == 2:
+            pos, orn = np.asarray(goal[0], dtype=float), np.asarray(goal[1], dtype=float)
+            # q and -q encode the same rotation
+            if len(orn) == 4 and orn[np.argmax(np.abs(orn))] < 0:
+                orn = -orn
+            return np.concatenate([pos, orn])
+        return np.asarray(goal, dtype=float)
+
+    def key(self, start, goal, scene_state):
+        h = hashlib.sha1()
+        for values, resolution in (
+            (np.asarray(start, dtype=float), self.start_resolution),
+            (self._flatten_goal(goal), self.goal_resolution),
+            (np.asarray(scene_state, dtype=float), self.state_resolution),
+        ):
+            h.update(np.round(values / resolution).astype(np.int64).tobytes())
+            h.update(b"|")
+        return h.hexdigest()
+
+    def get(self, key):
+        """Cached path for key or None, counts hits and misses."""
+        path = self._paths.get(key)
+        if path is None:
+            self.stats["misses"] += 1
+            return None
+        self._paths.move_to_end(key)
+        self.stats["hits"] += 1
+        return path.copy()
+
+    def put(self, key, path):
+        self._paths[key] = np.array(path, dtype=float)
+        self._paths.move_to_end(key)
+        while len(self._paths) > self.max_size:
+            self._paths.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, key):
+        """Drop a cached path that failed re-validation, the hit is counted as invalidated instead."""
+        if self._paths.pop(key, None) is not None:
+            self.stats["hits"] -= 1
+            self.stats["invalidated"] += 1
+
+    def __len__(self):
+        return len(self._paths)
+
+    def get_metrics(self):
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["invalidated"]
+        return {
+            **self.stats,
+            "size": len(self._paths),
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+        }
+
+    def save(self, filename=None):
+        """Store all paths in one npz, waypoints are concatenated with offsets."""
+        filename = self.filename if filename is None else filename
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        paths = list(self._paths.values())
+        lengths = np.array([len(path) for path in paths], dtype=int)
+        np.savez_compressed(
+            filename,
+            keys=np.array(list(self._paths.keys()), dtype="U40"),
+            lengths=lengths,
+            waypoints=np.concatenate(paths) if paths else np.zeros((0, 0)),
+        )
+        log.info(f"Saved {len(paths)} cached plans to {filename}")
+
+    def load(self, filename):
+        data = np.load(filename)
+        offsets = np.concatenate([[0], np.cumsum(data["lengths"])])
+        for key, start, end in zip(data["keys"], offsets[:-1], offsets[1:]):
+            self.put(str(key), data["waypoints"][start:end])
+        log.info(f"Loaded {len(data['keys'])} cached plans from {filename}")
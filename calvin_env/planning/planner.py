@@ -0,0 +1,141 @@
+import time
+
+import numpy as np
+
+from calvin_env.planning.rrt_connect import rrt_connect
+from calvin_env.planning.trajectory import path_length, shortcut_path, time_parameterize
+
+
+def new_metrics():
+    return {"rrt_time": 0.0, "shortcut_time": 0.0, "parameterization_time": 0.0, "iterations": 0}
+
+
+class JointPathPlanner:
+    """
+    Plans collision free joint trajectories on a CollisionWorld, without access to the live simulation.
+
+    Paths come from the roadmap if there is one, otherwise or if it fails from RRT-Connect. They are shortcut and
+    time parameterized at dt with velocity and acceleration limits.
+
+    Args:
+        world: CollisionWorld synced to the scene to plan in.
+        max_velocity: joint velocity limit of the trajectories in rad/s.
+        max_acceleration: joint acceleration limit of the trajectories in rad/s^2.
+        dt: sample period of the trajectories in seconds.
+        max_time: RRT-Connect time budget per query in seconds.
+        max_iterations: maximum number of RRT-Connect iterations per query.
+        step_size: maximum joint-space length of an RRT edge in rad.
+        resolution: joint-space collision checking resolution of edges in rad.
+        shortcut_iterations: number of shortcut candidates per path.
+        shortcut_batch_size: number of shortcut candidates collision checked together.
+        seed: seed of the sampler.
+        roadmap: optional Roadmap of the static scene.
+        roadmap_k: number of roadmap nodes start and goal are connected to.
+    """
+
+    def __init__(
+        self,
+        world,
+        max_velocity,
+        max_acceleration,
+        dt,
+        max_time=5.0,
+        max_iterations=5000,
+        step_size=0.2,
+        resolution=0.05,
+        shortcut_iterations=100,
+        shortcut_batch_size=32,
+        seed=0,
+        roadmap=None,
+        roadmap_k=10,
+    ):
+        self.world = world
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+        self.dt = dt
+        self.max_time = max_time
+        self.max_iterations = max_iterations
+        self.step_size = step_size
+        self.resolution = resolution
+        self.shortcut_iterations = shortcut_iterations
+        self.shortcut_batch_size = shortcut_batch_size
+        self.rng = np.random.default_rng(seed)
+        self.roadmap = roadmap
+        self.roadmap_k = roadmap_k
+
+    def sample_config(self):
+        return self.rng.uniform(self.world.lower_limits, self.world.upper_limits)
+
+    def sample_valid_config(self, max_attempts=1000):
+        for _ in range(max_attempts):
+            q = self.sample_config()
+            if self.world.is_valid(q):
+                return q
+        return None
+
+    def is_edge_valid(self, q1, q2):
+        return self.world.is_edge_valid(q1, q2, self.resolution)
+
+    def check_edges(self, starts, goals):
+        return self.world.check_edges(starts, goals, self.resolution)
+
+    def plan_path(self, start, goal, metrics):
+        """Search and shortcut a path, returns None and sets the failure reason in metrics if there is none."""
+        if not self.world.is_valid(start):
+            metrics["failure"] = "invalid_start"
+            return None
+        if not self.world.is_valid(goal):
+            metrics["failure"] = "invalid_goal"
+            return None
+        path = None
+        if self.roadmap is not None:
+            t_roadmap = time.time()
+            path, stats = self.roadmap.query(self.world, start, goal, self.roadmap_k, self.resolution)
+            metrics.update(stats)
+            metrics["roadmap_time"] = time.time() - t_roadmap
+            metrics["planner"] = "roadmap"
+        if path is None:
+            t_rrt = time.time()
+            path, stats = rrt_connect(
+                start,
+                goal,
+                self.is_edge_valid,
+                self.sample_config,
+                self.step_size,
+                self.max_iterations,
+                self.max_time,
+            )
+            metrics.update(stats)
+            metrics["rrt_time"] = time.time() - t_rrt
+            metrics["planner"] = "rrt"
+        if path is None:
+            metrics["failure"] = "timeout"
+            return None
+        metrics["raw_waypoints"] = len(path)
+        metrics["raw_path_length"] = path_length(path)
+        t_shortcut = time.time()
+        path = shortcut_path(path, self.check_edges, self.shortcut_iterations, self.rng, self.shortcut_batch_size)
+        metrics["shortcut_time"] = time.time() - t_shortcut
+        return path
+
+    def make_result(self, path, metrics, stop_at_waypoints=True):
+        """Time parameterize a path (None if planning failed) into the result dict of a planning query."""
+        result = {"success": False, "positions": None, "times": None, "path": None, "metrics": metrics}
+        if path is not None:
+            t_param = time.time()
+            times, positions = time_parameterize(
+                path,
+                self.max_velocity,
+                self.max_acceleration,
+                self.dt,
+                self.world.lower_limits,
+                self.world.upper_limits,
+                stop_at_waypoints,
+            )
+            metrics["parameterization_time"] = time.time() - t_param
+            metrics["num_waypoints"] = len(path)
+            metrics["path_length"] = path_length(path)
+            metrics["duration"] = float(times[-1])
+            result.update(success=True, positions=positions, times=times, path=path)
+        metrics["success"] = result["success"]
+        return result
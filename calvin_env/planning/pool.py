@@ -0,0 +1,98 @@
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from calvin_env.planning.collision import CollisionWorld
+from calvin_env.planning.planner import JointPathPlanner, new_metrics
+from calvin_env.planning.roadmap import Roadmap
+
+# A logger for this file
+log = logging.getLogger(__name__)
+
+# planner of the worker process, set by _init_worker
+_planner = None
+
+
+def _init_worker(world_kwargs, planner_kwargs, roadmap_data):
+    global _planner
+    world = CollisionWorld(**world_kwargs)
+    roadmap = Roadmap(*roadmap_data) if roadmap_data is not None else None
+    _planner = JointPathPlanner(world, roadmap=roadmap, **planner_kwargs)
+    log.debug(f"Planning worker {os.getpid()} ready")
+
+
+def _plan_task(start, goal, scene_state, ignored_bodies, seed):
+    t0 = time.time()
+    world = _planner.world
+    world.set_scene_state(scene_state)
+    world.ignored_bodies = set(ignored_bodies)
+    # seeded per query, results do not depend on which worker answers it
+    _planner.rng = np.random.default_rng(seed)
+    checks_before = world.num_checks
+    metrics = new_metrics()
+    metrics["worker"] = os.getpid()
+    result = _planner.make_result(_planner.plan_path(start, goal, metrics), metrics)
+    world.ignored_bodies = set()
+    metrics["collision_checks"] = world.num_checks - checks_before
+    metrics["planning_time"] = time.time() - t0
+    return result
+
+
+class PlanningPool:
+    """
+    Pool of planning processes, every worker holds its own clone of the collision world.
+
+    Queries are answered asynchronously as futures. The scene state of a query is sent along as compact vector (see
+    CollisionWorld.read_scene_state), so a query can be planned for a predicted scene state, e.g. the next subtask
+    while the current one is executed.
+
+    Args:
+        world: CollisionWorld to clone, its constructor arguments and allowed collision matrix are sent to the
+            workers.
+        planner_kwargs: arguments of JointPathPlanner except world and roadmap.
+        num_workers: number of worker processes.
+        roadmap: optional Roadmap, copied to every worker.
+        seed: seed of the per-query samplers.
+        mp_context: multiprocessing start method, spawn does not inherit the rendering context of the environment.
+    """
+
+    def __init__(self, world, planner_kwargs, num_workers=4, roadmap=None, seed=0, mp_context="spawn"):
+        roadmap_data = (roadmap.nodes, roadmap.edges, roadmap.key) if roadmap is not None else None
+        self.num_workers = num_workers
+        self.executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context(mp_context),
+            initializer=_init_worker,
+            initargs=(world.get_init_kwargs(), dict(planner_kwargs), roadmap_data),
+        )
+        self.seed_sequence = np.random.SeedSequence(seed)
+
+    def submit(self, start, goal, scene_state, ignored_bodies=()):
+        """
+        Plan from start to goal configuration in the given scene state.
+
+        Args:
+            start: (dof,) start configuration.
+            goal: (dof,) goal configuration.
+            scene_state: scene state vector of the collision world.
+            ignored_bodies: uids of collision world bodies that are not checked.
+
+        Returns:
+            Future of the result dict, see JointPathPlanner.make_result.
+        """
+        seed = self.seed_sequence.spawn(1)[0]
+        return self.executor.submit(
+            _plan_task,
+            np.asarray(start, dtype=float),
+            np.asarray(goal, dtype=float),
+            np.asarray(scene_state, dtype=float),
+            tuple(ignored_bodies),
+            seed,
+        )
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
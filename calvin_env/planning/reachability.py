@@ -0,0 +1,237 @@
+import hashlib
+import logging
+from pathlib import Path
+import time
+
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+from calvin_env.planning.sdf import DEFAULT_CACHE_DIR as SDF_CACHE_DIR
+from calvin_env.robot.batch_ik import solve_ik_batch_parallel
+
+# A logger for this file
+log = logging.getLogger(__name__)
+
+REACHABILITY_CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = SDF_CACHE_DIR.parent / "reachability"
+# table workspace of the play table scenes, from the table surface (z = 0.46) up
+DEFAULT_BOUNDS = ((-0.45, -0.35, 0.46), (0.45, 0.25, 0.86))
+
+
+def default_orientations(num_yaw=8, tilt_angles=(np.pi / 4, np.pi / 2), num_tilt_directions=4):
+    """
+    Discretized gripper orientations as (K, 4) quaternions [x, y, z, w].
+
+    Top-down grasps at num_yaw yaw angles, followed by grasps tilted from top-down by every tilt angle towards
+    num_tilt_directions horizontal directions, e.g. pi / 2 for horizontal approaches of handles and buttons.
+    """
+    top_down = [R.from_euler("xyz", [np.pi, 0, yaw]) for yaw in np.arange(num_yaw) * 2 * np.pi / num_yaw]
+    tilted = [
+        R.from_rotvec(tilt * np.array([np.cos(phi), np.sin(phi), 0.0])) * R.from_euler("xyz", [np.pi, 0, phi])
+        for tilt in tilt_angles
+        for phi in np.arange(num_tilt_directions) * 2 * np.pi / num_tilt_directions
+    ]
+    return np.array([r.as_quat() for r in top_down + tilted])
+
+
+def serpentine_order(shape):
+    """Flat indices of a 3d grid in boustrophedon order, consecutive cells are always neighbours."""
+    ix, iy, iz = np.indices(shape).reshape(3, -1)
+    iy = np.where(ix % 2, shape[1] - 1 - iy, iy)
+    iz = np.where((ix * shape[1] + iy) % 2, shape[2] - 1 - iz, iz)
+    return np.ravel_multi_index((ix, iy, iz), shape)
+
+
+class ReachabilityMap:
+    """
+    Precomputed IK reachability of tcp poses over a voxel grid of the workspace times a set of gripper orientations.
+
+    For every voxel center and orientation the map stores whether IK found a solution, the solution and the
+    manipulability sqrt(det(J J^T)) of the tcp Jacobian there. Queries look up the voxel and the nearest stored
+    orientation in constant time with respect to the grid size. Poses outside the grid or farther than
+    max_orientation_error from every stored orientation are unknown to the map and reported reachable.
+
+    A cell records a single IK attempt for its center, seeded from the previous cell of the sweep, and queries snap to
+    the nearest cell. A cell without solution is therefore only a hint to rank goals by, not a proof that IK fails.
+
+    Args:
+        lower: (3,) lower corner of the grid.
+        voxel_size: edge length of the voxels in m.
+        orientations: (K, 4) quaternions [x, y, z, w].
+        reachable: (X, Y, Z, K) bool.
+        manipulability: (X, Y, Z, K) manipulability of the solutions, 0 where unreachable.
+        solutions: (X, Y, Z, K, dof) joint solutions.
+        key: cache key of the robot and build parameters.
+        max_orientation_error: maximum angle in rad between a queried and the nearest stored orientation.
+    """
+
+    def __init__(
+        self, lower, voxel_size, orientations, reachable, manipulability, solutions, key="", max_orientation_error=0.5
+    ):
+        self.lower = np.asarray(lower, dtype=float)
+        self.voxel_size = float(voxel_size)
+        self.orientations = np.asarray(orientations, dtype=float)
+        self.reachable = np.asarray(reachable, dtype=bool)
+        self.manipulability = np.asarray(manipulability, dtype=np.float32)
+        self.solutions = np.asarray(solutions, dtype=np.float32)
+        self.key = str(key)
+        self.max_orientation_error = max_orientation_error
+        self.shape = self.reachable.shape[:3]
+
+    @staticmethod
+    def get_centers(bounds, voxel_size):
+        """Voxel centers (X, Y, Z, 3) of a grid covering bounds."""
+        lower, upper = np.asarray(bounds, dtype=float)
+        shape = np.maximum(np.ceil((upper - lower) / voxel_size - 1e-9).astype(int), 1)
+        axes = [lower[i] + (np.arange(shape[i]) + 0.5) * voxel_size for i in range(3)]
+        return np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1)
+
+    @classmethod
+    def build(
+        cls,
+        client_kwargs,
+        kinematics,
+        seed,
+        bounds=DEFAULT_BOUNDS,
+        voxel_size=0.04,
+        orientations=None,
+        num_workers=4,
+        key="",
+    ):
+        """
+        Solve IK for every voxel center and orientation on a pool of kinematics clients.
+
+        Every orientation sweeps the grid in serpentine order, so IK is seeded with the solution of a neighbouring
+        voxel. The sweeps are split into contiguous chunks that are solved in parallel and chained at their boundaries.
+
+        Args:
+            client_kwargs: KinematicsClient arguments, see Robot.get_kinematics_client_kwargs.
+            kinematics: RobotKinematics of the robot for the manipulability.
+            seed: (dof,) configuration the sweeps start from, e.g. the rest pose.
+            bounds: lower and upper corner of the workspace.
+            voxel_size: edge length of the voxels in m.
+            orientations: (K, 4) quaternions, defaults to default_orientations().
+            num_workers: number of IK processes.
+        """
+        t0 = time.time()
+        orientations = default_orientations() if orientations is None else np.asarray(orientations, dtype=float)
+        centers = cls.get_centers(bounds, voxel_size)
+        shape = centers.shape[:3]
+        order = serpentine_order(shape)
+        positions = centers.reshape(-1, 3)[order]
+        poses = np.concatenate(
+            [np.concatenate([positions, np.broadcast_to(orn, (len(positions), 4))], axis=1) for orn in orientations]
+        )
+        # about four chunks per worker, chunks that do not continue their predecessor are solved again
+        chunk_size = int(np.ceil(len(poses) / (num_workers * 4)))
+        qs, success = solve_ik_batch_parallel(
+            client_kwargs, poses, seed, continuity=True, num_workers=num_workers, chunk_size=chunk_size
+        )
+        num_dof = qs.shape[1]
+        jacobians = kinematics.jacobian(qs)
+        manipulability = np.sqrt(np.maximum(np.linalg.det(jacobians @ jacobians.transpose(0, 2, 1)), 0.0))
+        manipulability[~success] = 0.0
+
+        # back from sweep order to grid order, orientation last
+        inverse = np.argsort(order)
+        reachable = success.reshape(len(orientations), -1)[:, inverse].T.reshape(*shape, len(orientations))
+        manipulability = manipulability.reshape(len(orientations), -1)[:, inverse].T.reshape(*shape, len(orientations))
+        solutions = qs.reshape(len(orientations), -1, num_dof)[:, inverse].transpose(1, 0, 2)
+        solutions = solutions.reshape(*shape, len(orientations), num_dof)
+        log.info(
+            f"Built reachability map of {np.prod(shape)} voxels x {len(orientations)} orientations in "
+            f"{time.time() - t0:.1f}s, {reachable.mean():.1%} reachable"
+        )
+        return cls(
+            np.asarray(bounds[0], dtype=float), voxel_size, orientations, reachable, manipulability, solutions, key
+        )
+
+    @staticmethod
+    def cache_key(client_kwargs, bounds, voxel_size, orientations):
+        """Hash of the robot and the build parameters."""
+        h = hashlib.sha1(Path(client_kwargs["urdf_path"]).read_bytes())
+        for name in ("base_position", "base_orientation", "ll_real", "ul_real", "rp"):
+            h.update(np.asarray(client_kwargs[name], dtype=float).tobytes())
+        h.update(np.asarray(bounds, dtype=float).tobytes())
+        h.update(np.asarray(orientations, dtype=float).tobytes())
+        h.update(np.array([voxel_size, REACHABILITY_CACHE_VERSION], dtype=float).tobytes())
+        return h.hexdigest()[:16]
+
+    def save(self, filename):
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            filename,
+            lower=self.lower,
+            voxel_size=self.voxel_size,
+            orientations=self.orientations,
+            reachable=self.reachable,
+            manipulability=self.manipulability,
+            solutions=self.solutions,
+            key=self.key,
+        )
+
+    @classmethod
+    def load(cls, filename, max_orientation_error=0.5):
+        data = np.load(filename)
+        return cls(
+            data["lower"],
+            data["voxel_size"],
+            data["orientations"],
+            data["reachable"],
+            data["manipulability"],
+            data["solutions"],
+            str(data["key"]),
+            max_orientation_error,
+        )
+
+    def lookup(self, positions, orientations):
+        """
+        Grid cells of a batch of tcp poses.
+
+        Args:
+            positions: (N, 3) positions.
+            orientations: (N, 4) quaternions [x, y, z, w].
+
+        Returns:
+            cells: (N, 4) voxel and orientation indices.
+            known: (N,) False for poses the map has no information about.
+        """
+        positions = np.atleast_2d(np.asarray(positions, dtype=float))
+        orientations = np.atleast_2d(np.asarray(orientations, dtype=float))
+        voxels = np.floor((positions - self.lower) / self.voxel_size).astype(int)
+        inside = np.all((voxels >= 0) & (voxels < self.shape), axis=1)
+        # q and -q encode the same rotation
+        similarity = np.abs(orientations @ self.orientations.T)
+        nearest = np.argmax(similarity, axis=1)
+        angle = 2 * np.arccos(np.clip(similarity[np.arange(len(nearest)), nearest], -1.0, 1.0))
+        known = inside & (angle <= self.max_orientation_error)
+        cells = np.concatenate([np.clip(voxels, 0, np.array(self.shape) - 1), nearest[:, None]], axis=1)
+        return cells, known
+
+    def is_reachable(self, positions, orientations):
+        """(N,) bool, False only for poses whose map cell has no IK solution."""
+        cells, known = self.lookup(positions, orientations)
+        return ~known | self.reachable[tuple(cells.T)]
+
+    def query(self, position, orientation):
+        """
+        Reachability of a single tcp pose.
+
+        Returns:
+            reachable: False only if the map cell of the pose has no IK solution.
+            manipulability: stored manipulability, nan for unknown poses.
+            solution: (dof,) stored IK solution to seed IK with. For cells without solution the solution of the most
+                manipulable neighbouring voxel with the same orientation, None for unknown poses or if there is none.
+        """
+        cells, known = self.lookup(position, orientation)
+        if not known[0]:
+            return True, np.nan, None
+        cell = tuple(cells[0])
+        if self.reachable[cell]:
+            return True, float(self.manipulability[cell]), self.solutions[cell].astype(float)
+        window = tuple(slice(max(i - 1, 0), i + 2) for i in cell[:3]) + (cell[3],)
+        scores = np.where(self.reachable[window], self.manipulability[window], -1.0)
+        if scores.max() < 0:
+            return False, 0.0, None
+        best = np.unravel_index(np.argmax(scores), scores.shape)
+        return False, 0.0, self.solutions[window][best].astype(float)
@@ -0,0 +1,221 @@
+import hashlib
+import heapq
+import logging
+from pathlib import Path
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from calvin_env.planning.collision import ALL, DYNAMIC, STATIC
+from calvin_env.planning.sdf import DEFAULT_CACHE_DIR as SDF_CACHE_DIR
+
+# A logger for this file
+log = logging.getLogger(__name__)
+
+ROADMAP_CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = SDF_CACHE_DIR.parent / "roadmaps"
+
+START, GOAL = -1, -2
+
+
+class Roadmap:
+    """
+    Multi-query probabilistic roadmap (PRM) of the arm for one scene config.
+
+    Nodes and edges are collision checked against the static geometry only (self collisions, non-moving links of the
+    fixed bodies) when the roadmap is built, see STATIC in collision.py. Queries re-validate nodes and edges lazily
+    against the dynamic part of the scene (blocks, door and drawer joints, gripper opening), i.e. only those on
+    candidate shortest paths. Results are cached until the scene state of the collision world changes.
+
+    Args:
+        nodes: (N, dof) configurations.
+        edges: (E, 2) node indices of the edges.
+        key: cache key of the scene config and build parameters.
+    """
+
+    def __init__(self, nodes, edges, key=""):
+        self.nodes = np.asarray(nodes, dtype=float)
+        self.edges = np.asarray(edges, dtype=int).reshape(-1, 2)
+        self.key = str(key)
+        self.edge_lengths = np.linalg.norm(self.nodes[self.edges[:, 0]] - self.nodes[self.edges[:, 1]], axis=1)
+        self.tree = cKDTree(self.nodes)
+        self.neighbors = [[] for _ in range(len(self.nodes))]
+        for e, (a, b) in enumerate(self.edges):
+            self.neighbors[a].append((b, e))
+            self.neighbors[b].append((a, e))
+        self._scene_state = None
+        self._node_valid = {}
+        self._edge_valid = {}
+
+    @classmethod
+    def build(cls, world, num_nodes=2000, k=10, resolution=0.05, seed=0, key=""):
+        """
+        Sample num_nodes statically valid configurations and connect every node to its k nearest neighbours.
+
+        Args:
+            world: CollisionWorld of the scene.
+            num_nodes: number of roadmap nodes.
+            k: number of neighbours every node is connected to.
+            resolution: collision checking resolution of the edges.
+            seed: seed of the sampler.
+        """
+        t0 = time.time()
+        rng = np.random.default_rng(seed)
+        nodes = []
+        while len(nodes) < num_nodes:
+            qs = rng.uniform(world.lower_limits, world.upper_limits, (num_nodes, world.num_dof))
+            nodes.extend(qs[world.check_configs(qs, subset=STATIC)])
+        nodes = np.array(nodes[:num_nodes])
+        _, neighbors = cKDTree(nodes).query(nodes, k + 1)
+        candidates = {(min(a, b), max(a, b)) for a, row in enumerate(neighbors) for b in row[1:] if a != b}
+        candidates = np.array(sorted(candidates))
+        valid = world.check_edges(nodes[candidates[:, 0]], nodes[candidates[:, 1]], resolution, subset=STATIC)
+        log.info(
+            f"Built roadmap with {num_nodes} nodes and {valid.sum()} of {len(candidates)} edges in "
+            f"{time.time() - t0:.1f}s"
+        )
+        return cls(nodes, candidates[valid], key)
+
+    @staticmethod
+    def cache_key(world, num_nodes, k, resolution, seed):
+        """Hash of the robot, the fixed bodies and the build parameters."""
+        h = hashlib.sha1(Path(world.robot_urdf).read_bytes())
+        h.update(np.array([*world.base_position, *world.base_orientation], dtype=float).tobytes())
+        h.update(np.concatenate([world.lower_limits, world.upper_limits]).tobytes())
+        for body in world.body_cfgs:
+            if not body["movable"]:
+                h.update(Path(body["file"]).read_bytes())
+                pose = [*body["position"], *body["orientation"], body.get("global_scaling", 1.0)]
+                h.update(np.array(pose, dtype=float).tobytes())
+        h.update(np.array([num_nodes, k, resolution, seed, world.margin, ROADMAP_CACHE_VERSION], dtype=float).tobytes())
+        return h.hexdigest()[:16]
+
+    @classmethod
+    def load_or_build(cls, world, num_nodes=2000, k=10, resolution=0.05, seed=0, cache_dir=DEFAULT_CACHE_DIR):
+        """Load the roadmap of the scene config from cache_dir, build and store it if there is none."""
+        key = cls.cache_key(world, num_nodes, k, resolution, seed)
+        cache_file = Path(cache_dir) / f"roadmap_{key}.npz" if cache_dir is not None else None
+        if cache_file is not None and cache_file.is_file():
+            log.info(f"Loading roadmap from {cache_file}")
+            return cls.load(cache_file)
+        roadmap = cls.build(world, num_nodes, k, resolution, seed, key)
+        if cache_file is not None:
+            roadmap.save(cache_file)
+        return roadmap
+
+    def save(self, filename):
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(filename, nodes=self.nodes, edges=self.edges, key=self.key)
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        return cls(data["nodes"], data["edges"], str(data["key"]))
+
+    def _update_scene_state(self, world):
+        state = world.read_scene_state(world.cid, world.robot_uid, world.body_uids)
+        state = np.concatenate([state, sorted(world.ignored_bodies)])
+        if self._scene_state is None or not np.array_equal(state, self._scene_state):
+            self._scene_state = state
+            self._node_valid = {}
+            self._edge_valid = {}
+
+    def _node_ok(self, world, i):
+        if i not in self._node_valid:
+            self._node_valid[i] = world.is_valid(self.nodes[i], DYNAMIC)
+        return self._node_valid[i]
+
+    def _edge_ok(self, world, e, resolution):
+        if e not in self._edge_valid:
+            a, b = self.edges[e]
+            self._edge_valid[e] = world.is_edge_valid(self.nodes[a], self.nodes[b], resolution, DYNAMIC)
+        return self._edge_valid[e]
+
+    def _connect(self, world, q, k, resolution):
+        """Fully checked edges from q to its k nearest nodes, as dict node -> edge length."""
+        distances, indices = self.tree.query(q, min(k, len(self.nodes)))
+        links = {}
+        for distance, i in zip(np.atleast_1d(distances), np.atleast_1d(indices)):
+            if self._node_valid.get(i, True) and world.is_edge_valid(q, self.nodes[i], resolution, ALL):
+                self._node_valid[i] = True
+                links[int(i)] = float(distance)
+        return links
+
+    def _search(self, start_links, goal_links, goal):
+        """A* from START to GOAL, skipping nodes and edges known to be invalid. Returns node and edge indices."""
+        queue = [(0.0, 0.0, START)]
+        costs = {START: 0.0}
+        parents = {START: (None, None)}
+        closed = set()
+        while queue:
+            _, cost, u = heapq.heappop(queue)
+            if u in closed:
+                continue
+            closed.add(u)
+            if u == GOAL:
+                path, edges = [], []
+                while u != START:
+                    u, e = parents[u]
+                    path.append(u)
+                    edges.append(e)
+                return path[::-1][1:], edges[::-1]
+            if u == START:
+                successors = [(v, None, d) for v, d in start_links.items()]
+            else:
+                successors = [
+                    (v, e, self.edge_lengths[e])
+                    for v, e in self.neighbors[u]
+                    if self._edge_valid.get(e, True) and self._node_valid.get(v, True)
+                ]
+                if u in goal_links:
+                    successors.append((GOAL, None, goal_links[u]))
+            for v, e, d in successors:
+                new_cost = cost + d
+                if new_cost < costs.get(v, np.inf):
+                    costs[v] = new_cost
+                    parents[v] = (u, e)
+                    h = 0.0 if v == GOAL else np.linalg.norm(self.nodes[v] - goal)
+                    heapq.heappush(queue, (new_cost + h, new_cost, v))
+        return None, None
+
+    def query(self, world, start, goal, k=10, resolution=0.05, max_searches=100):
+        """
+        Plan from start to goal through the roadmap.
+
+        Args:
+            world: CollisionWorld synced to the current scene.
+            start: (dof,) start configuration.
+            goal: (dof,) goal configuration.
+            k: number of nodes start and goal are connected to.
+            resolution: collision checking resolution of the edges.
+            max_searches: maximum number of graph searches, every failed lazy validation triggers a new search.
+
+        Returns:
+            path: list of configurations from start to goal, None if the roadmap does not connect them.
+            stats: dict with the number of graph searches and lazily invalidated nodes and edges.
+        """
+        start, goal = np.asarray(start, dtype=float), np.asarray(goal, dtype=float)
+        self._update_scene_state(world)
+        stats = {"searches": 0, "invalidated_nodes": 0, "invalidated_edges": 0}
+        if world.is_edge_valid(start, goal, resolution):
+            return [start, goal], stats
+        start_links = self._connect(world, start, k, resolution)
+        goal_links = self._connect(world, goal, k, resolution)
+        if not start_links or not goal_links:
+            return None, stats
+        for _ in range(max_searches):
+            stats["searches"] += 1
+            path, edges = self._search(start_links, goal_links, goal)
+            if path is None:
+                return None, stats
+            invalid_nodes = [i for i in path if not self._node_ok(world, i)]
+            if invalid_nodes:
+                stats["invalidated_nodes"] += len(invalid_nodes)
+                continue
+            invalid_edges = [e for e in edges if e is not None and not self._edge_ok(world, e, resolution)]
+            if invalid_edges:
+                stats["invalidated_edges"] += len(invalid_edges)
+                continue
+            return [start, *self.nodes[path], goal], stats
+        return None, stats
@@ -0,0 +1,112 @@
+import time
+
+import numpy as np
+
+
+class _Tree:
+    """Search tree with nodes stored in a growing array for vectorized nearest neighbour queries."""
+
+    def __init__(self, root, capacity=1024):
+        self.nodes = np.empty((capacity, len(root)))
+        self.parents = np.empty(capacity, dtype=int)
+        self.nodes[0] = root
+        self.parents[0] = -1
+        self.size = 1
+
+    def add(self, q, parent):
+        if self.size == len(self.nodes):
+            self.nodes = np.concatenate([self.nodes, np.empty_like(self.nodes)])
+            self.parents = np.concatenate([self.parents, np.empty_like(self.parents)])
+        self.nodes[self.size] = q
+        self.parents[self.size] = parent
+        self.size += 1
+        return self.size - 1
+
+    def nearest(self, q):
+        return int(np.argmin(np.sum((self.nodes[: self.size] - q) ** 2, axis=1)))
+
+    def path_to_root(self, index):
+        path = []
+        while index >= 0:
+            path.append(self.nodes[index])
+            index = self.parents[index]
+        return path
+
+
+def _steer(q_from, q_to, step_size):
+    delta = q_to - q_from
+    dist = np.linalg.norm(delta)
+    if dist <= step_size:
+        return q_to, True
+    return q_from + delta * (step_size / dist), False
+
+
+def _extend(tree, q_target, step_size, is_edge_valid):
+    """Take one step from the nearest node towards q_target. Returns the new node index or None if blocked."""
+    near = tree.nearest(q_target)
+    q_new, reached = _steer(tree.nodes[near], q_target, step_size)
+    if not is_edge_valid(tree.nodes[near], q_new):
+        return None, False
+    return tree.add(q_new, near), reached
+
+
+def _connect(tree, q_target, step_size, is_edge_valid):
+    """Extend towards q_target until it is reached or blocked."""
+    while True:
+        index, reached = _extend(tree, q_target, step_size, is_edge_valid)
+        if index is None or reached:
+            return index, reached
+
+
+def rrt_connect(
+    start,
+    goal,
+    is_edge_valid,
+    sample_fn,
+    step_size=0.2,
+    max_iterations=5000,
+    max_time=5.0,
+):
+    """
+    Bidirectional RRT-Connect in joint space.
+
+    Args:
+        start: (dof,) start configuration, assumed to be valid.
+        goal: (dof,) goal configuration, assumed to be valid.
+        is_edge_valid: function (q1, q2) -> bool checking the straight edge from q1 to q2.
+        sample_fn: function () -> (dof,) random configuration.
+        step_size: maximum joint-space distance of a tree edge.
+        max_iterations: maximum number of sampling iterations.
+        max_time: time budget in seconds.
+
+    Returns:
+        path: list of configurations from start to goal, None if no path was found.
+        stats: dict with the number of iterations and tree nodes.
+    """
+    start = np.asarray(start, dtype=float)
+    goal = np.asarray(goal, dtype=float)
+    stats = {"iterations": 0, "tree_nodes": 2}
+    if is_edge_valid(start, goal):
+        return [start, goal], stats
+
+    tree_a, tree_b = _Tree(start), _Tree(goal)
+    start_time = time.time()
+    for iteration in range(max_iterations):
+        stats["iterations"] = iteration + 1
+        if time.time() - start_time > max_time:
+            break
+        index_a, _ = _extend(tree_a, sample_fn(), step_size, is_edge_valid)
+        if index_a is not None:
+            index_b, reached = _connect(tree_b, tree_a.nodes[index_a], step_size, is_edge_valid)
+            if reached:
+                path_a = tree_a.path_to_root(index_a)[::-1]
+                path_b = tree_b.path_to_root(index_b)[1:]
+                path = path_a + path_b
+                if not np.array_equal(path[0], start):
+                    # trees were swapped, tree_a grows from the goal
+                    path = path[::-1]
+                stats["tree_nodes"] = tree_a.size + tree_b.size
+                return path, stats
+        tree_a, tree_b = tree_b, tree_a
+    stats["tree_nodes"] = tree_a.size + tree_b.size
+    return None, stats
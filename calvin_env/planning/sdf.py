@@ -0,0 +1,218 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pybullet as p
+from scipy.ndimage import binary_fill_holes
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# A logger for this file
+log = logging.getLogger(__name__)
+
+# bump when the grid layout changes, invalidates cached fields
+SDF_CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = Path(os.environ.get("CALVIN_ENV_CACHE", Path.home() / ".cache" / "calvin_env")) / "sdf"
+
+
+def _interpolate_numpy(values, origin, resolution, points, outside_value):
+    """Trilinear interpolation of a grid at (M, 3) grid-frame points, points outside the grid get outside_value."""
+    x = (points - origin) / resolution
+    shape = np.array(values.shape)
+    inside = np.all((x >= 0) & (x <= shape - 1), axis=1)
+    result = np.full(len(points), outside_value, dtype=float)
+    x = x[inside]
+    i = np.minimum(np.floor(x).astype(int), shape - 2)
+    f = x - i
+    v = values
+    c00 = v[i[:, 0], i[:, 1], i[:, 2]] * (1 - f[:, 0]) + v[i[:, 0] + 1, i[:, 1], i[:, 2]] * f[:, 0]
+    c01 = v[i[:, 0], i[:, 1], i[:, 2] + 1] * (1 - f[:, 0]) + v[i[:, 0] + 1, i[:, 1], i[:, 2] + 1] * f[:, 0]
+    c10 = v[i[:, 0], i[:, 1] + 1, i[:, 2]] * (1 - f[:, 0]) + v[i[:, 0] + 1, i[:, 1] + 1, i[:, 2]] * f[:, 0]
+    c11 = v[i[:, 0], i[:, 1] + 1, i[:, 2] + 1] * (1 - f[:, 0]) + v[i[:, 0] + 1, i[:, 1] + 1, i[:, 2] + 1] * f[:, 0]
+    c0 = c00 * (1 - f[:, 1]) + c10 * f[:, 1]
+    c1 = c01 * (1 - f[:, 1]) + c11 * f[:, 1]
+    result[inside] = c0 * (1 - f[:, 2]) + c1 * f[:, 2]
+    return result
+
+
+if numba is not None:
+
+    @numba.njit(cache=True, fastmath=True)
+    def _interpolate_numba(values, origin, resolution, points, outside_value):
+        nx, ny, nz = values.shape
+        result = np.empty(len(points))
+        for k in range(len(points)):
+            x = (points[k, 0] - origin[0]) / resolution
+            y = (points[k, 1] - origin[1]) / resolution
+            z = (points[k, 2] - origin[2]) / resolution
+            if x < 0 or y < 0 or z < 0 or x > nx - 1 or y > ny - 1 or z > nz - 1:
+                result[k] = outside_value
+                continue
+            i, j, l = min(int(x), nx - 2), min(int(y), ny - 2), min(int(z), nz - 2)
+            fx, fy, fz = x - i, y - j, z - l
+            c00 = values[i, j, l] * (1 - fx) + values[i + 1, j, l] * fx
+            c01 = values[i, j, l + 1] * (1 - fx) + values[i + 1, j, l + 1] * fx
+            c10 = values[i, j + 1, l] * (1 - fx) + values[i + 1, j + 1, l] * fx
+            c11 = values[i, j + 1, l + 1] * (1 - fx) + values[i + 1, j + 1, l + 1] * fx
+            c0 = c00 * (1 - fy) + c10 * fy
+            c1 = c01 * (1 - fy) + c11 * fy
+            result[k] = c0 * (1 - fz) + c1 * fz
+        return result
+
+    interpolate = _interpolate_numba
+else:
+    interpolate = _interpolate_numpy
+
+
+def _pose_to_matrix(position, orientation):
+    T = np.eye(4)
+    T[:3, :3] = np.reshape(p.getMatrixFromQuaternion(orientation), (3, 3))
+    T[:3, 3] = position
+    return T
+
+
+def get_link_frames(cid, body_uid, links):
+    """(L, 4, 4) world transforms of the links, -1 is the base. Same frames as used when building the fields."""
+    frames = []
+    for link in links:
+        if link == -1:
+            frames.append(_pose_to_matrix(*p.getBasePositionAndOrientation(body_uid, physicsClientId=cid)))
+        else:
+            state = p.getLinkState(body_uid, link, physicsClientId=cid)
+            frames.append(_pose_to_matrix(state[0], state[1]))
+    return np.array(frames)
+
+
+class BodySDF:
+    """
+    Truncated signed distance fields of the links of one fixed body, each voxelized in its own link frame.
+
+    Moving parts like drawers and sliders keep their field, queries are transformed into the current link frames.
+    Distances are truncated at max_distance and negative inside the geometry.
+
+    Args:
+        links: link indices with a field, -1 is the base.
+        origins: (L, 3) grid origins in the build frame of every link.
+        values: list of (nx, ny, nz) distance grids.
+        build_frames: (L, 4, 4) world transforms of the links when the grids were built.
+        resolution: grid spacing in m.
+        max_distance: truncation distance in m.
+    """
+
+    def __init__(self, links, origins, values, build_frames, resolution, max_distance):
+        self.links = [int(link) for link in links]
+        self.origins = np.asarray(origins, dtype=float)
+        self.values = [np.ascontiguousarray(v, dtype=float) for v in values]
+        self.build_frames = np.asarray(build_frames, dtype=float)
+        self.resolution = float(resolution)
+        self.max_distance = float(max_distance)
+
+    @classmethod
+    def build(cls, urdf, global_scaling=1.0, resolution=0.02, max_distance=0.1, cache_dir=DEFAULT_CACHE_DIR):
+        """
+        Voxelize a body, or load it from the disk cache.
+
+        The body is loaded at the origin with all joints at 0 in a private client. Every grid point is probed with
+        getClosestPoints, inside and outside are separated by flood filling from the grid boundary because pybullet
+        reports unsigned distances inside concave meshes.
+        """
+        key = cls.cache_key(urdf, global_scaling, resolution, max_distance)
+        cache_file = Path(cache_dir) / f"{Path(urdf).stem}_{key}.npz" if cache_dir is not None else None
+        if cache_file is not None and cache_file.is_file():
+            log.info(f"Loading signed distance field from {cache_file}")
+            return cls.load(cache_file)
+
+        cid = p.connect(p.DIRECT)
+        try:
+            uid = p.loadURDF(str(urdf), useFixedBase=True, globalScaling=global_scaling, physicsClientId=cid)
+            probe = p.createCollisionShape(p.GEOM_SPHERE, radius=1e-3, physicsClientId=cid)
+            links = [
+                link
+                for link in range(-1, p.getNumJoints(uid, physicsClientId=cid))
+                if p.getCollisionShapeData(uid, link, physicsClientId=cid)
+            ]
+            origins, values = [], []
+            for link in links:
+                lower, upper = p.getAABB(uid, link, physicsClientId=cid)
+                origin = np.array(lower) - max_distance
+                shape = np.ceil((np.array(upper) + max_distance - origin) / resolution).astype(int) + 1
+                values.append(cls._voxelize(cid, uid, link, probe, origin, shape, resolution, max_distance))
+                origins.append(origin)
+                log.info(f"Voxelized link {link} of {Path(urdf).name} with {np.prod(shape)} grid points")
+            sdf = cls(links, origins, values, get_link_frames(cid, uid, links), resolution, max_distance)
+        finally:
+            p.disconnect(physicsClientId=cid)
+        if cache_file is not None:
+            sdf.save(cache_file)
+        return sdf
+
+    @staticmethod
+    def _voxelize(cid, uid, link, probe, origin, shape, resolution, max_distance):
+        values = np.full(shape, max_distance)
+        for index in np.ndindex(*shape):
+            point = origin + np.array(index) * resolution
+            closest = p.getClosestPoints(
+                bodyA=uid,
+                bodyB=-1,
+                distance=max_distance,
+                linkIndexA=link,
+                collisionShapeB=probe,
+                collisionShapePositionB=point,
+                physicsClientId=cid,
+            )
+            if closest:
+                values[index] = min(c[8] for c in closest) + 1e-3
+        # points enclosed by the surface band are inside the geometry
+        surface = values <= resolution * np.sqrt(3) / 2
+        inside = binary_fill_holes(surface) & ~surface
+        values[inside] = -values[inside]
+        return values
+
+    @staticmethod
+    def cache_key(urdf, global_scaling, resolution, max_distance):
+        h = hashlib.sha1(Path(urdf).read_bytes())
+        h.update(np.array([global_scaling, resolution, max_distance, SDF_CACHE_VERSION], dtype=float).tobytes())
+        return h.hexdigest()[:16]
+
+    def save(self, filename):
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            filename,
+            links=self.links,
+            origins=self.origins,
+            build_frames=self.build_frames,
+            resolution=self.resolution,
+            max_distance=self.max_distance,
+            **{f"values_{i}": v for i, v in enumerate(self.values)},
+        )
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        links = data["links"]
+        values = [data[f"values_{i}"] for i in range(len(links))]
+        return cls(
+            links, data["origins"], values, data["build_frames"], data["resolution"], float(data["max_distance"])
+        )
+
+    def distance(self, points, link_frames):
+        """
+        Signed distance of (M, 3) world points to the body, truncated at max_distance.
+
+        Args:
+            points: (M, 3) world points.
+            link_frames: (L, 4, 4) current world transforms of the links, see get_link_frames.
+        """
+        points = np.asarray(points, dtype=float)
+        distance = np.full(len(points), self.max_distance)
+        for origin, values, T_build, T_now in zip(self.origins, self.values, self.build_frames, link_frames):
+            # world -> current link frame -> build frame of the grid
+            T = T_build @ np.linalg.inv(T_now)
+            local = points @ T[:3, :3].T + T[:3, 3]
+            distance = np.minimum(distance, interpolate(values, origin, self.resolution, local, self.max_distance))
+        return distance
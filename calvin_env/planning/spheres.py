@@ -0,0 +1,240 @@
+import logging
+from pathlib import Path
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from scipy.spatial import ConvexHull
+
+from calvin_env.planning.sdf import BodySDF, DEFAULT_CACHE_DIR, get_link_frames
+from calvin_env.robot.kinematics import _origin_to_matrix, RobotKinematics
+
+# A logger for this file
+log = logging.getLogger(__name__)
+
+
+def load_mesh_vertices(filename):
+    """Vertices of an obj or stl (ascii or binary) mesh as (V, 3) array."""
+    filename = Path(filename)
+    if filename.suffix.lower() == ".obj":
+        with open(filename) as f:
+            return np.array([line.split()[1:4] for line in f if line.startswith("v ")], dtype=float)
+    data = filename.read_bytes()
+    if data[:5] == b"solid" and b"facet" in data[:1000]:
+        lines = data.decode(errors="ignore").splitlines()
+        return np.array([line.split()[1:4] for line in lines if line.strip().startswith("vertex")], dtype=float)
+    num_triangles = np.frombuffer(data[80:84], dtype=np.uint32)[0]
+    triangles = np.frombuffer(data[84 : 84 + 50 * num_triangles], dtype=np.uint8).reshape(-1, 50)
+    return triangles[:, 12:48].copy().view(np.float32).reshape(-1, 3).astype(float)
+
+
+def fit_spheres(points, num_spheres, resolution=0.005):
+    """
+    Cover the convex hull of points with spheres centered along its principal axis.
+
+    The hull is voxelized, every voxel is assigned to the segment of the principal axis it projects to and the
+    sphere of a segment encloses all its voxels, padded by half a voxel diagonal. pybullet collides meshes of
+    moving links as convex hulls, so the spheres enclose the collision geometry.
+
+    Returns:
+        centers: (num_spheres, 3), radii: (num_spheres,)
+    """
+    hull = ConvexHull(points)
+    lower, upper = points.min(axis=0), points.max(axis=0)
+    axes = [np.arange(lo, hi + resolution, resolution) for lo, hi in zip(lower, upper)]
+    grid = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+    inside = np.all(grid @ hull.equations[:, :3].T + hull.equations[:, 3] <= 1e-9, axis=1)
+    samples = np.concatenate([grid[inside], points[hull.vertices]])
+
+    mean = samples.mean(axis=0)
+    axis = np.linalg.svd(samples - mean, full_matrices=False)[2][0]
+    t = (samples - mean) @ axis
+    bounds = np.linspace(t.min(), t.max(), num_spheres + 1)
+    segment = np.clip(np.searchsorted(bounds, t, side="right") - 1, 0, num_spheres - 1)
+    centers, radii = [], []
+    for i in range(num_spheres):
+        members = samples[segment == i]
+        if not len(members):
+            continue
+        center = (members.min(axis=0) + members.max(axis=0)) / 2
+        centers.append(center)
+        radii.append(np.max(np.linalg.norm(members - center, axis=1)) + resolution * np.sqrt(3) / 2)
+    return np.array(centers), np.array(radii)
+
+
+class SphereModel:
+    """
+    Sphere approximation of the collision geometry of a robot, attached to the link frames of RobotKinematics.
+
+    Links behind actuated joints that are not arm joints (the fingers) are attached to their parent link and
+    covered over the whole joint range, so the model is conservative for any gripper opening.
+
+    Args:
+        kinematics: RobotKinematics of the robot.
+        links: name of the link every sphere is attached to.
+        centers: (S, 3) sphere centers in link coordinates.
+        radii: (S,) sphere radii.
+    """
+
+    def __init__(self, kinematics, links, centers, radii):
+        self.kinematics = kinematics
+        self.centers = np.asarray(centers, dtype=float)
+        self.radii = np.asarray(radii, dtype=float)
+        self.links = list(links)
+        self.link_names = sorted(set(self.links), key=self.links.index)
+        self._link_index = np.array([self.link_names.index(link) for link in self.links])
+
+    @classmethod
+    def from_urdf(
+        cls,
+        urdf_path,
+        base_position=(0, 0, 0),
+        base_orientation=(0, 0, 0, 1),
+        sphere_length_ratio=1.5,
+        max_spheres_per_link=8,
+        exclude_links=(),
+    ):
+        """
+        Fit spheres to the collision meshes of a urdf.
+
+        Args:
+            sphere_length_ratio: number of spheres per link relative to its elongation (length / mean width).
+            max_spheres_per_link: upper bound of spheres per link.
+            exclude_links: names of links without spheres, e.g. links resting on the table.
+        """
+        urdf_path = Path(urdf_path)
+        kinematics = RobotKinematics(str(urdf_path), base_position, base_orientation)
+        root = ET.parse(urdf_path).getroot()
+        limits = {}
+        for joint in root.findall("joint"):
+            limit = joint.find("limit")
+            if limit is not None:
+                limits[joint.get("name")] = (float(limit.get("lower", 0)), float(limit.get("upper", 0)))
+        by_child = {joint["child"]: joint for joint in kinematics.joints}
+
+        links, centers, radii = [], [], []
+        for link in root.findall("link"):
+            name = link.get("name")
+            if name in exclude_links:
+                continue
+            points = []
+            for collision in link.findall("collision"):
+                mesh = collision.find("geometry/mesh")
+                if mesh is None:
+                    log.warning(f"Skipping non-mesh collision geometry of {name}")
+                    continue
+                filename = urdf_path.parent / mesh.get("filename").replace("package://", "")
+                scale = np.array([float(x) for x in mesh.get("scale", "1 1 1").split()])
+                vertices = load_mesh_vertices(filename) * scale
+                T = _origin_to_matrix(collision.find("origin"))
+                points.append(vertices @ T[:3, :3].T + T[:3, 3])
+            if not points:
+                continue
+            points = np.concatenate(points)
+            # lift links behind non-arm joints (fingers) into the frame of the closest arm link, swept over the
+            # joint range
+            attach = name
+            while attach in by_child and by_child[attach]["name"] not in kinematics.arm_joint_names:
+                joint = by_child[attach]
+                values = np.linspace(*limits.get(joint["name"], (0.0, 0.0)), 3) if joint["type"] != "fixed" else [0.0]
+                lifted = []
+                for M in kinematics._joint_motion(joint, np.asarray(values, dtype=float)):
+                    T = joint["origin"] @ M
+                    lifted.append(points @ T[:3, :3].T + T[:3, 3])
+                points = np.concatenate(lifted)
+                attach = joint["parent"]
+            extent = np.sort(points.max(axis=0) - points.min(axis=0))
+            num = int(
+                np.clip(
+                    np.ceil(sphere_length_ratio * extent[2] / max(extent[:2].mean(), 1e-3)), 1, max_spheres_per_link
+                )
+            )
+            link_centers, link_radii = fit_spheres(points, num)
+            links += [attach] * len(link_radii)
+            centers.append(link_centers)
+            radii.append(link_radii)
+        return cls(kinematics, links, np.concatenate(centers), np.concatenate(radii))
+
+    def world_spheres(self, q):
+        """
+        Sphere centers for N configurations with one batched forward kinematics pass.
+
+        Args:
+            q: (N, num_dof) arm joint positions.
+
+        Returns:
+            (N, S, 3) world centers, the radii are self.radii.
+        """
+        transforms = self.kinematics.link_transforms(q, self.link_names)
+        T = np.stack([transforms[link] for link in self.link_names], axis=1)[:, self._link_index]
+        return np.einsum("nsij,sj->nsi", T[..., :3, :3], self.centers) + T[..., :3, 3]
+
+
+class SphereCollisionChecker:
+    """
+    Checks robot configurations against the fixed scene with spheres and precomputed signed distance fields.
+
+    Covers only the fixed bodies (table with drawer, slider and buttons), self collisions and movable objects are
+    left to CollisionWorld.
+
+    Args:
+        spheres: SphereModel of the robot.
+        sdfs: BodySDF of every fixed body.
+        margin: minimum clearance in m.
+    """
+
+    def __init__(self, spheres, sdfs, margin=0.0):
+        self.spheres = spheres
+        self.sdfs = list(sdfs)
+        self.margin = margin
+        self.link_frames = [np.tile(np.eye(4), (len(sdf.links), 1, 1)) for sdf in self.sdfs]
+
+    @classmethod
+    def from_world(cls, world, resolution=0.02, max_distance=None, margin=0.0, cache_dir=DEFAULT_CACHE_DIR, **kwargs):
+        """
+        Build the checker for the robot and the fixed bodies of a CollisionWorld. Distance fields are cached in
+        cache_dir, kwargs are passed to SphereModel.from_urdf.
+
+        Distances are truncated at max_distance, which has to exceed the largest sphere radius plus margin. By default
+        it is rounded up from there to a multiple of resolution.
+        """
+        spheres = SphereModel.from_urdf(
+            world.robot_urdf,
+            world.base_position,
+            world.base_orientation,
+            exclude_links=world.get_link_names(world.static_robot_links),
+            **kwargs,
+        )
+        min_distance = spheres.radii.max() + margin + resolution
+        if max_distance is None:
+            max_distance = np.ceil(min_distance / resolution) * resolution
+        elif max_distance < min_distance:
+            raise ValueError(f"max_distance {max_distance} must be at least {min_distance:.3f} for this sphere model")
+        fixed = [(uid, body) for uid, body in zip(world.body_uids, world.body_cfgs) if not body["movable"]]
+        sdfs = [
+            BodySDF.build(body["file"], body.get("global_scaling", 1.0), resolution, max_distance, cache_dir)
+            for _, body in fixed
+        ]
+        checker = cls(spheres, sdfs, margin)
+        checker.world = world
+        checker.fixed_uids = [uid for uid, _ in fixed]
+        checker.sync()
+        return checker
+
+    def sync(self):
+        """Read the current link frames of the fixed bodies, e.g. after the drawer moved."""
+        self.link_frames = [
+            get_link_frames(self.world.cid, uid, sdf.links) for uid, sdf in zip(self.fixed_uids, self.sdfs)
+        ]
+
+    def clearance(self, q):
+        """(N,) smallest signed distance between any sphere and the fixed scene, negative for penetration."""
+        centers = self.spheres.world_spheres(q)
+        flat = centers.reshape(-1, 3)
+        distance = np.full(len(flat), np.inf)
+        for sdf, frames in zip(self.sdfs, self.link_frames):
+            distance = np.minimum(distance, sdf.distance(flat, frames))
+        return np.min(distance.reshape(centers.shape[:2]) - self.spheres.radii, axis=1)
+
+    def check_configs(self, q):
+        """(N,) bool array, True for configurations clear of the fixed scene."""
+        return self.clearance(q) > self.margin
@@ -0,0 +1,196 @@
+import numpy as np
+
+
+def path_length(path):
+    path = np.asarray(path)
+    return float(np.sum(np.linalg.norm(np.diff(path, axis=0), axis=1)))
+
+
+def remove_duplicates(path, tolerance=1e-9):
+    """Drop waypoints that coincide with their predecessor, the first and the last waypoint are kept."""
+    path = np.asarray(path, dtype=float)
+    if len(path) < 2:
+        return path
+    keep = np.concatenate([[True], np.linalg.norm(np.diff(path, axis=0), axis=1) > tolerance])
+    reduced = path[keep]
+    if len(reduced) > 1:
+        reduced[-1] = path[-1]
+    return reduced
+
+
+def interpolate_path(path, distances):
+    """
+    Points at the given arc lengths along a piecewise linear path.
+
+    Args:
+        path: (N, dof) waypoints, N >= 2.
+        distances: (...) arc lengths from the first waypoint.
+
+    Returns:
+        points: (..., dof) positions.
+        segments: (...) index of the segment every point lies on.
+    """
+    path = np.asarray(path, dtype=float)
+    lengths = np.linalg.norm(np.diff(path, axis=0), axis=1)
+    cumulative = np.concatenate([[0.0], np.cumsum(lengths)])
+    segments = np.clip(np.searchsorted(cumulative, distances, side="right") - 1, 0, len(lengths) - 1)
+    t = np.clip((distances - cumulative[segments]) / np.maximum(lengths[segments], 1e-12), 0.0, 1.0)
+    points = path[segments] + t[..., None] * (path[segments + 1] - path[segments])
+    return points, segments
+
+
+def shortcut_path(path, check_edges, iterations=100, rng=None, batch_size=32):
+    """
+    Randomized shortcutting with batched collision checks.
+
+    Every round samples batch_size pairs of points along the path, half of them at waypoints and half anywhere on the
+    segments, and checks the straight edges between them in one check_edges call. The valid shortcuts are applied greedily by length saved,
+    skipping those that overlap an already applied one.
+
+    Args:
+        path: (N, dof) waypoints.
+        check_edges: function (starts, goals) -> (K,) bool, whether the straight edges are collision free.
+        iterations: total number of shortcut candidates.
+        rng: np.random.Generator.
+        batch_size: number of candidates checked per round.
+
+    Returns:
+        (M, dof) waypoints, never longer than the input path.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    path = remove_duplicates(path)
+    for _ in range(int(np.ceil(iterations / batch_size))):
+        if len(path) <= 2:
+            break
+        cumulative = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(path, axis=0), axis=1))])
+        total = cumulative[-1]
+        s = rng.uniform(0.0, total, (batch_size, 2))
+        s[: batch_size // 2] = cumulative[rng.integers(len(path), size=(batch_size // 2, 2))]
+        s = np.sort(s, axis=1)
+        points, segments = interpolate_path(path, s)
+        savings = (s[:, 1] - s[:, 0]) - np.linalg.norm(points[:, 1] - points[:, 0], axis=1)
+        # points on the same segment are already connected by a straight line
+        candidates = np.flatnonzero((segments[:, 0] < segments[:, 1]) & (savings > 1e-6 * total))
+        if len(candidates) == 0:
+            continue
+        candidates = candidates[np.argsort(-savings[candidates])]
+        valid = np.asarray(check_edges(points[candidates, 0], points[candidates, 1]), dtype=bool)
+        applied = []
+        for c in candidates[valid]:
+            if all(s[c, 1] <= s[a, 0] or s[c, 0] >= s[a, 1] for a in applied):
+                applied.append(c)
+        pieces, last = [], 0
+        for c in sorted(applied, key=lambda a: s[a, 0]):
+            pieces.extend([path[last : segments[c, 0] + 1], *points[c]])
+            last = segments[c, 1] + 1
+        pieces.append(path[last:])
+        path = remove_duplicates(np.concatenate([np.atleast_2d(piece) for piece in pieces]))
+    return path
+
+
+def _trapezoid(velocity, acceleration, length):
+    """Peak velocity, ramp time and duration of rest-to-rest profiles covering length."""
+    peak_velocity = np.minimum(velocity, np.sqrt(acceleration * length))
+    ramp_time = peak_velocity / acceleration
+    return peak_velocity, ramp_time, length / peak_velocity + ramp_time
+
+
+def _evaluate_trapezoid(tau, velocity, acceleration, ramp_time, duration, length):
+    """Distance covered by trapezoidal profiles after tau seconds."""
+    return np.where(
+        tau < ramp_time,
+        0.5 * acceleration * tau**2,
+        np.where(
+            tau > duration - ramp_time,
+            length - 0.5 * acceleration * (duration - tau) ** 2,
+            0.5 * acceleration * ramp_time**2 + velocity * (tau - ramp_time),
+        ),
+    )
+
+
+def time_parameterize(
+    path, max_velocity, max_acceleration, dt, lower_limits=None, upper_limits=None, stop_at_waypoints=True
+):
+    """
+    Retime a piecewise linear path with velocity and acceleration limits and sample it every dt seconds.
+
+    By default every segment follows a trapezoidal (or triangular, if too short to reach the velocity limit) velocity
+    profile that starts and ends at rest, so the trajectory stays exactly on the collision checked path. The profile
+    of a segment is limited by its slowest joint. Dense paths with small direction changes, e.g. solved Cartesian
+    lines, can instead be traversed with one profile over their joint-space arc length, limited by the slowest joint
+    over all segments. Such a profile keeps its speed through the waypoints, it still stops at every corner where the
+    sudden change of direction at the velocity limit would exceed the acceleration limit within one sample period.
+    The total duration is stretched to a multiple of dt, so the last sample is the last waypoint.
+
+    Args:
+        path: (N, dof) waypoints.
+        max_velocity: scalar or (dof,) joint velocity limits in rad/s.
+        max_acceleration: scalar or (dof,) joint acceleration limits in rad/s^2.
+        dt: sample period in seconds, e.g. 1 / control_freq.
+        lower_limits: optional (dof,) joint limits the samples are clipped to, against interpolation round-off.
+        upper_limits: optional (dof,) joint limits.
+        stop_at_waypoints: come to rest at every waypoint, otherwise only at the ends of the path and at sharp
+            corners.
+
+    Returns:
+        times: (T,) sample times, multiples of dt starting at 0.
+        positions: (T, dof) joint positions.
+    """
+    path = remove_duplicates(path)
+    if len(path) < 2:
+        return np.zeros(1), path[:1].copy()
+    delta = np.diff(path, axis=0)
+    segment_lengths = np.linalg.norm(delta, axis=1)
+    # joint rates are the unit segment directions times the rate of the arc length
+    directions = delta / segment_lengths[:, None]
+    with np.errstate(divide="ignore"):
+        segment_velocity = np.min(max_velocity / np.abs(directions), axis=1)
+        segment_acceleration = np.min(max_acceleration / np.abs(directions), axis=1)
+    if stop_at_waypoints:
+        stops = np.ones(len(delta) - 1, dtype=bool)
+    else:
+        # passing a corner at speed changes the joint velocities by the speed times the change of direction, within
+        # one sample period at an isolated corner and within the time between the corners of a curve, half of the
+        # acceleration limit is left for these changes and half for speeding up and slowing down along the path
+        corner_acceleration = 0.5 * np.asarray(max_acceleration)
+        turns = np.abs(np.diff(directions, axis=0))
+        # collinear segments up to round-off
+        turns[turns < 1e-9] = 0.0
+        stops = np.any(np.max(segment_velocity) * turns > corner_acceleration * dt, axis=1)
+        with np.errstate(divide="ignore"):
+            spacing = np.minimum(segment_lengths[:-1], segment_lengths[1:])[:, None]
+            corner_velocity = np.min(np.sqrt(corner_acceleration * spacing / turns), axis=1)
+        corner_velocity[stops] = np.inf
+        curved = np.concatenate([[False], np.isfinite(corner_velocity), [False]])
+        segment_velocity = np.minimum.reduce(
+            [segment_velocity, np.append(corner_velocity, np.inf), np.insert(corner_velocity, 0, np.inf)]
+        )
+        segment_acceleration = np.where(curved[:-1] | curved[1:], 0.5, 1.0) * segment_acceleration
+    # one profile of the arc length per run of segments between two stops, limited by its slowest joint
+    starts = np.concatenate([[0], np.flatnonzero(stops) + 1])
+    velocity = np.minimum.reduceat(segment_velocity, starts)
+    acceleration = np.minimum.reduceat(segment_acceleration, starts)
+    lengths = np.add.reduceat(segment_lengths, starts)
+    peak_velocity, ramp_time, durations = _trapezoid(velocity, acceleration, lengths)
+    knot_times = np.concatenate([[0.0], np.cumsum(durations)])
+    num_steps = max(int(np.ceil(knot_times[-1] / dt - 1e-9)), 1)
+    times = np.arange(num_steps + 1) * dt
+    # evaluate the original profiles at stretched time, which only lowers velocities and accelerations
+    t = times * knot_times[-1] / times[-1]
+    profiles = np.clip(np.searchsorted(knot_times, t, side="right") - 1, 0, len(durations) - 1)
+    tau = np.clip(t - knot_times[profiles], 0.0, durations[profiles])
+    s = _evaluate_trapezoid(
+        tau,
+        peak_velocity[profiles],
+        acceleration[profiles],
+        ramp_time[profiles],
+        durations[profiles],
+        lengths[profiles],
+    )
+    s = np.clip(s, 0.0, lengths[profiles])
+    offsets = np.concatenate([[0.0], np.cumsum(lengths)])
+    positions, _ = interpolate_path(path, offsets[profiles] + s)
+    positions[-1] = path[-1]
+    if lower_limits is not None or upper_limits is not None:
+        positions = np.clip(positions, lower_limits, upper_limits)
+    return times, positions
@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 from ikfast_franka_panda import get_ik
 import numpy as np
 from scipy.spatial.transform import Rotation as R
@@ -22,35 +24,55 @@ class IKfast:
         self.ul_real = ul_real
         self.rp = rp
         self.num_dof = len(self.ll_real)
-        self.weights = weights
+        self.weights = np.asarray(weights)
         self.num_angles = num_angles
-        T_world_robot = np.eye(4)
-        T_world_robot[:3, 3] = base_position
-        T_world_robot[:3, :3] = R.from_quat(base_orientation).as_matrix()
-        self.T_robot_world = np.linalg.inv(T_world_robot)
+        # values of the free (7th) joint that are sampled for every query
+        self.free_angles = np.linspace(self.ll_real[-1], self.ul_real[-1], self.num_angles)
+        self.T_world_robot = np.eye(4)
+        self.T_world_robot[:3, 3] = base_position
+        self.T_world_robot[:3, :3] = R.from_quat(base_orientation).as_matrix()
+        self.T_robot_world = np.linalg.inv(self.T_world_robot)
+        # wrap offsets and joint limits for broadcasting against (num_solutions, num_dof, num_offsets)
+        self._wrap_offsets = np.array([-2.0 * np.pi, 0, 2.0 * np.pi])
+        self._ll = np.asarray(self.ll_real)[:, None]
+        self._ul = np.asarray(self.ul_real)[:, None]
+        self._target_cache = OrderedDict()
+        self.target_cache_size = 64
 
     def world_to_robot(self, pos_w, orn_w):
         """
         pos, quat -> pos, Rot
         """
+        key = (*pos_w, *orn_w)
+        if key in self._target_cache:
+            self._target_cache.move_to_end(key)
+            return self._target_cache[key]
         pose_w = np.eye(4)
         pose_w[:3, 3] = pos_w
         pose_w[:3, :3] = R.from_quat(orn_w).as_matrix()
         pose_r = self.T_robot_world @ pose_w
         pos_r = list(pose_r[:3, 3])
         orn_r = pose_r[:3, :3].tolist()
+        self._target_cache[key] = pos_r, orn_r
+        if len(self._target_cache) > self.target_cache_size:
+            self._target_cache.popitem(last=False)
         return pos_r, orn_r
 
-    def filter_solutions(self, sol):
-        test_sol = np.ones(self.num_dof) * 9999.0
-        for i in range(self.num_dof):
-            for add_ang in [-2.0 * np.pi, 0, 2.0 * np.pi]:
-                test_ang = sol[i] + add_ang
-                if self.ul_real[i] >= test_ang >= self.ll_real[i]:
-                    test_sol[i] = test_ang
-        if np.all(test_sol != 9999.0):
-            return test_sol
-        return None
+    def filter_solutions(self, sols):
+        """
+        Wrap all solutions by +-2pi into the joint limits and drop the ones that can not be wrapped into them.
+        If several offsets are valid for a joint, the largest one is taken.
+
+        Args:
+            sols: (N, num_dof) raw ikfast solutions
+        Returns:
+            (M, num_dof) feasible solutions, M <= N
+        """
+        candidates = np.asarray(sols)[:, :, None] + self._wrap_offsets
+        valid = (candidates >= self._ll) & (candidates <= self._ul)
+        offset_ids = valid.shape[2] - 1 - np.argmax(valid[:, :, ::-1], axis=2)
+        wrapped = np.take_along_axis(candidates, offset_ids[..., None], axis=2)[..., 0]
+        return wrapped[valid.any(axis=2).all(axis=1)]
 
     def take_closest_sol(self, sols, last_q, weights):
         best_sol_ind = np.argmin(np.sum((weights * (sols - np.array(last_q))) ** 2, 1))
@@ -58,14 +80,10 @@ class IKfast:
 
     def get_ik_solution(self, target_pos, target_orn):
         target_pos_robot, target_orn_robot = self.world_to_robot(target_pos, target_orn)
-        sols = []
-        feasible_sols = []
-        for q_6 in np.linspace(self.ll_real[-1], self.ul_real[-1], self.num_angles):
-            sols += get_ik(target_pos_robot, target_orn_robot, [q_6])
-        for sol in sols:
-            sol = self.filter_solutions(sol)
-            if sol is not None:
-                feasible_sols.append(sol)
+        sols = [sol for q_6 in self.free_angles for sol in get_ik(target_pos_robot, target_orn_robot, [q_6])]
+        if len(sols) < 1:
+            return None
+        feasible_sols = self.filter_solutions(sols)
         if len(feasible_sols) < 1:
             return None
         best_sol = self.take_closest_sol(feasible_sols, self.rp[:7], self.weights)
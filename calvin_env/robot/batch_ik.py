@@ -0,0 +1,171 @@
+import logging
+import multiprocessing as mp
+
+import numpy as np
+import pybullet as p
+
+# A logger for this file
+log = logging.getLogger(__name__)
+
+
+class KinematicsClient:
+    """
+    Kinematics-only pybullet client with its own copy of the robot.
+
+    IK and FK queries only move the robot in this client, the live simulation is never touched.
+    """
+
+    def __init__(
+        self,
+        urdf_path,
+        base_position,
+        base_orientation,
+        tcp_link_id,
+        ll_real,
+        ul_real,
+        ll,
+        ul,
+        jr,
+        rp,
+        use_nullspace=True,
+        max_num_iterations=100,
+        residual_threshold=1e-5,
+        threshold_pos=0.005,
+        threshold_orn=0.02,
+    ):
+        self.cid = p.connect(p.DIRECT)
+        self.robot_uid = p.loadURDF(
+            urdf_path, base_position, base_orientation, useFixedBase=True, physicsClientId=self.cid
+        )
+        self.tcp_link_id = tcp_link_id
+        self.ll_real = np.asarray(ll_real)
+        self.ul_real = np.asarray(ul_real)
+        self.num_dof = len(self.ll_real)
+        self.ll, self.ul, self.jr, self.rp = list(ll), list(ul), list(jr), list(rp)
+        self.use_nullspace = use_nullspace
+        self.max_num_iterations = max_num_iterations
+        self.residual_threshold = residual_threshold
+        self.threshold_pos = threshold_pos
+        self.threshold_orn = threshold_orn
+        self.movable_joint_ids = [
+            i
+            for i in range(p.getNumJoints(self.robot_uid, physicsClientId=self.cid))
+            if p.getJointInfo(self.robot_uid, i, physicsClientId=self.cid)[2] != p.JOINT_FIXED
+        ]
+        self.arm_joint_ids = self.movable_joint_ids[: self.num_dof]
+
+    def set_arm_joints(self, q):
+        p.resetJointStatesMultiDof(self.robot_uid, self.arm_joint_ids, [[x] for x in q], physicsClientId=self.cid)
+
+    def get_tcp_pose(self, q):
+        self.set_arm_joints(q)
+        pos, orn = p.getLinkState(
+            self.robot_uid, self.tcp_link_id, computeForwardKinematics=True, physicsClientId=self.cid
+        )[4:6]
+        return np.array(pos), np.array(orn)
+
+    def solve_single(self, pos, orn, seed):
+        """Solve IK for one tcp pose starting from the arm configuration seed, returns (q, success)."""
+        # bullet iterates from the current state of the body, passing currentPositions instead makes it diverge
+        self.set_arm_joints(seed)
+        kwargs = dict(
+            maxNumIterations=self.max_num_iterations,
+            residualThreshold=self.residual_threshold,
+            physicsClientId=self.cid,
+        )
+        if self.use_nullspace:
+            q = p.calculateInverseKinematics(
+                self.robot_uid, self.tcp_link_id, pos, orn, self.ll, self.ul, self.jr, self.rp, **kwargs
+            )
+        else:
+            q = p.calculateInverseKinematics(self.robot_uid, self.tcp_link_id, pos, orn, **kwargs)
+        q = np.clip(q[: self.num_dof], self.ll_real, self.ul_real)
+        tcp_pos, tcp_orn = self.get_tcp_pose(q)
+        orn_err = 2 * np.arccos(np.clip(np.abs(np.dot(tcp_orn, orn)), -1.0, 1.0))
+        success = np.linalg.norm(tcp_pos - pos) < self.threshold_pos and orn_err < self.threshold_orn
+        return q, success
+
+    def solve(self, poses, seed, continuity=True):
+        """
+        Args:
+            poses: (N, 7) tcp poses [x, y, z, qx, qy, qz, qw] in world frame.
+            seed: (num_dof,) arm configuration to start from.
+            continuity: seed every pose with the solution of the previous one instead of the initial seed.
+        Returns:
+            q: (N, num_dof) joint solutions
+            success: (N,) True if the solution reaches the pose within the thresholds
+        """
+        poses = np.atleast_2d(poses)
+        qs = np.zeros((len(poses), self.num_dof))
+        success = np.zeros(len(poses), dtype=bool)
+        current_seed = np.asarray(seed, dtype=float)
+        for i, pose in enumerate(poses):
+            qs[i], success[i] = self.solve_single(pose[:3], pose[3:7], current_seed)
+            if continuity and success[i]:
+                current_seed = qs[i]
+        return qs, success
+
+    def close(self):
+        if self.cid >= 0:
+            p.disconnect(physicsClientId=self.cid)
+            self.cid = -1
+
+
+# one kinematics client per pool worker
+_worker_client = None
+
+
+def _init_worker(client_kwargs):
+    global _worker_client
+    _worker_client = KinematicsClient(**client_kwargs)
+
+
+def _solve_chunk(args):
+    poses, seed, continuity = args
+    return _worker_client.solve(poses, seed, continuity)
+
+
+def _end_seed(qs, success, seed):
+    """Seed a continuous solve carries over after a chunk, the last successful solution or the incoming seed."""
+    return qs[np.flatnonzero(success)[-1]] if np.any(success) else np.asarray(seed, dtype=float)
+
+
+def solve_ik_batch_parallel(
+    client_kwargs, poses, seed, continuity=True, num_workers=4, chunk_size=None, max_joint_step=0.2
+):
+    """
+    Solve IK for a long path with a pool of kinematics clients.
+
+    The path is split into contiguous chunks that are solved in parallel. With continuity, seeds are chained within
+    a chunk, and the first poses of all chunks are solved beforehand as one chained sequence whose solutions seed the
+    chunks, so consecutive chunks start on the same branch of the arm. Chunks whose first pose still has no solution
+    or jumps by more than max_joint_step from the end of the previous chunk are solved once more, seeded with that
+    end, in a single second parallel round.
+    """
+    poses = np.atleast_2d(poses)
+    chunk_size = chunk_size or int(np.ceil(len(poses) / num_workers))
+    chunks = [poses[i : i + chunk_size] for i in range(0, len(poses), chunk_size)]
+    seed = np.asarray(seed, dtype=float)
+    with mp.get_context("spawn").Pool(num_workers, initializer=_init_worker, initargs=(client_kwargs,)) as pool:
+        seeds = [seed] * len(chunks)
+        if continuity and len(chunks) > 1:
+            boundary_qs, boundary_success = pool.apply(_solve_chunk, ((poses[::chunk_size], seed, True),))
+            seeds = [seed] + [
+                _end_seed(boundary_qs[: k + 1], boundary_success[: k + 1], seed) for k in range(1, len(chunks))
+            ]
+        results = pool.map(_solve_chunk, [(chunk, s, continuity) for chunk, s in zip(chunks, seeds)])
+        if continuity:
+            ends = [_end_seed(qs, success, s) for (qs, success), s in zip(results, seeds)]
+            jumps = [
+                k
+                for k in range(1, len(chunks))
+                if not np.array_equal(seeds[k], ends[k - 1])
+                and (not results[k][1][0] or np.any(np.abs(results[k][0][0] - ends[k - 1]) > max_joint_step))
+            ]
+            if jumps:
+                log.debug(f"Solving {len(jumps)} of {len(chunks)} IK chunks again after a jump at the chunk boundary")
+                resolved = pool.map(_solve_chunk, [(chunks[k], ends[k - 1], True) for k in jumps])
+                for k, result in zip(jumps, resolved):
+                    results[k] = result
+    qs, success = zip(*results)
+    return np.concatenate(qs), np.concatenate(success)
@@ -0,0 +1,245 @@
+import logging
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+# A logger for this file
+log = logging.getLogger(__name__)
+
+
+def _origin_to_matrix(origin):
+    T = np.eye(4)
+    if origin is None:
+        return T
+    T[:3, 3] = [float(x) for x in origin.get("xyz", "0 0 0").split()]
+    # urdf rpy are fixed axis rotations about x, y, z
+    T[:3, :3] = R.from_euler("xyz", [float(x) for x in origin.get("rpy", "0 0 0").split()]).as_matrix()
+    return T
+
+
+def _axis_angle_to_matrix(axis, angles):
+    """Batched Rodrigues formula, axis (3,) unit vector, angles (N,) -> (N, 3, 3)."""
+    K = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+    s = np.sin(angles)[:, None, None]
+    c = np.cos(angles)[:, None, None]
+    return np.eye(3) + s * K + (1 - c) * (K @ K)
+
+
+class RobotKinematics:
+    """
+    Batched forward kinematics and Jacobians for a robot described by a URDF.
+
+    The URDF is parsed once, afterwards the poses of all links are computed for N joint configurations in a single
+    vectorized pass over the kinematic tree. Poses are given for the URDF link frames, which coincide with the frames
+    reported by pybullet's getLinkState for the tcp, end effector and gripper camera links of the Panda.
+    """
+
+    def __init__(
+        self,
+        urdf_path,
+        base_position=(0, 0, 0),
+        base_orientation=(0, 0, 0, 1),
+        tcp_link="tcp",
+        end_effector_link="panda_link8",
+        camera_link="gripper_cam",
+    ):
+        """
+        Args:
+            urdf_path: path to the robot urdf.
+            base_position: world position of the root link.
+            base_orientation: world orientation of the root link as quaternion [x, y, z, w].
+            tcp_link, end_effector_link, camera_link: names of the links returned by get_poses.
+        """
+        root = ET.parse(urdf_path).getroot()
+        self.joints = []
+        for joint in root.findall("joint"):
+            axis = joint.find("axis")
+            axis = np.array([float(x) for x in axis.get("xyz").split()]) if axis is not None else np.array([1.0, 0, 0])
+            if np.linalg.norm(axis) > 0:
+                axis = axis / np.linalg.norm(axis)
+            self.joints.append(
+                {
+                    "name": joint.get("name"),
+                    "type": joint.get("type"),
+                    "parent": joint.find("parent").get("link"),
+                    "child": joint.find("child").get("link"),
+                    "origin": _origin_to_matrix(joint.find("origin")),
+                    "axis": axis,
+                }
+            )
+        children = {joint["child"] for joint in self.joints}
+        link_names = [link.get("name") for link in root.findall("link")]
+        self.root_link = next(name for name in link_names if name not in children)
+        self.joints = self._sort_topologically(self.joints, self.root_link)
+
+        self.T_world_base = np.eye(4)
+        self.T_world_base[:3, :3] = R.from_quat(base_orientation).as_matrix()
+        self.T_world_base[:3, 3] = base_position
+        self.tcp_link = tcp_link
+        self.end_effector_link = end_effector_link
+        self.camera_link = camera_link
+
+        # the actuated joints on the path from the root to the tcp define the arm joint order of q
+        chain = self.get_chain(tcp_link)
+        self.arm_joint_names = [joint["name"] for joint in chain if joint["type"] != "fixed"]
+        self.num_dof = len(self.arm_joint_names)
+        self._arm_joint_index = {name: i for i, name in enumerate(self.arm_joint_names)}
+        self._chain_cache = {}
+
+    @staticmethod
+    def _sort_topologically(joints, root_link):
+        by_parent = {}
+        for joint in joints:
+            by_parent.setdefault(joint["parent"], []).append(joint)
+        ordered, stack = [], [root_link]
+        while stack:
+            link = stack.pop()
+            for joint in by_parent.get(link, []):
+                ordered.append(joint)
+                stack.append(joint["child"])
+        return ordered
+
+    def get_chain(self, link):
+        """Joints from the root link to link."""
+        by_child = {joint["child"]: joint for joint in self.joints}
+        chain = []
+        while link != self.root_link:
+            joint = by_child[link]
+            chain.append(joint)
+            link = joint["parent"]
+        return chain[::-1]
+
+    def fk_jacobian(self, q, link=None):
+        """
+        Pose and Jacobian of a link for a single configuration, cheaper than the batched functions for N = 1.
+
+        Args:
+            q: (num_dof,) arm joint positions.
+            link: name of the link, defaults to the tcp.
+        Returns:
+            T: (4, 4) world transform of the link.
+            J: (6, num_dof) geometric Jacobian [linear; angular] in world frame.
+        """
+        link = self.tcp_link if link is None else link
+        if link not in self._chain_cache:
+            self._chain_cache[link] = [
+                (joint, self._arm_joint_index.get(joint["name"]), *self._skew_terms(joint["axis"]))
+                for joint in self.get_chain(link)
+            ]
+        T = self.T_world_base.copy()
+        axes = np.zeros((self.num_dof, 3))
+        origins = np.zeros((self.num_dof, 3))
+        prismatic = np.zeros(self.num_dof, dtype=bool)
+        for joint, index, K, K2 in self._chain_cache[link]:
+            T = T @ joint["origin"]
+            if joint["type"] == "fixed":
+                continue
+            value = q[index] if index is not None else 0.0
+            motion = np.eye(4)
+            if joint["type"] == "prismatic":
+                motion[:3, 3] = value * joint["axis"]
+            else:
+                motion[:3, :3] += np.sin(value) * K + (1 - np.cos(value)) * K2
+            T = T @ motion
+            if index is not None:
+                axes[index] = T[:3, :3] @ joint["axis"]
+                origins[index] = T[:3, 3]
+                prismatic[index] = joint["type"] == "prismatic"
+        J = np.zeros((6, self.num_dof))
+        J[:3] = np.where(prismatic[:, None], axes, np.cross(axes, T[:3, 3] - origins)).T
+        J[3:] = np.where(prismatic[:, None], 0.0, axes).T
+        return T, J
+
+    @staticmethod
+    def _skew_terms(axis):
+        K = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+        return K, K @ K
+
+    def _joint_motion(self, joint, values):
+        T = np.tile(np.eye(4), (len(values), 1, 1))
+        if joint["type"] in ("revolute", "continuous"):
+            T[:, :3, :3] = _axis_angle_to_matrix(joint["axis"], values)
+        elif joint["type"] == "prismatic":
+            T[:, :3, 3] = values[:, None] * joint["axis"]
+        return T
+
+    def link_transforms(self, q, links=None):
+        """
+        Args:
+            q: (N, num_dof) or (num_dof,) arm joint positions. Actuated joints that are not part of the arm
+               (e.g. the fingers) are kept at 0.
+            links: names of the links to compute, defaults to all links.
+        Returns:
+            dict link name -> (N, 4, 4) homogeneous transforms in world frame.
+        """
+        q = np.atleast_2d(np.asarray(q, dtype=float))
+        assert q.shape[1] == self.num_dof
+        if links is not None:
+            needed = {joint["child"] for link in links for joint in self.get_chain(link)}
+        transforms = {self.root_link: np.broadcast_to(self.T_world_base, (len(q), 4, 4))}
+        for joint in self.joints:
+            if links is not None and joint["child"] not in needed:
+                continue
+            T = transforms[joint["parent"]] @ joint["origin"]
+            if joint["type"] != "fixed":
+                index = self._arm_joint_index.get(joint["name"])
+                values = q[:, index] if index is not None else np.zeros(len(q))
+                T = T @ self._joint_motion(joint, values)
+            transforms[joint["child"]] = T
+        if links is not None:
+            return {link: transforms[link] for link in links}
+        return transforms
+
+    def forward_kinematics(self, q, link):
+        """Returns world position (N, 3) and orientation quaternion [x, y, z, w] (N, 4) of a link."""
+        T = self.link_transforms(q, [link])[link]
+        return T[:, :3, 3].copy(), R.from_matrix(T[:, :3, :3]).as_quat()
+
+    def get_poses(self, q):
+        """
+        Tcp, end effector and gripper camera poses in one pass.
+
+        Args:
+            q: (N, num_dof) arm joint positions.
+        Returns:
+            dict with keys "tcp", "end_effector", "gripper_cam", each (N, 7) poses [x, y, z, qx, qy, qz, qw].
+        """
+        names = {"tcp": self.tcp_link, "end_effector": self.end_effector_link, "gripper_cam": self.camera_link}
+        transforms = self.link_transforms(q, list(names.values()))
+        poses = {}
+        for key, link in names.items():
+            T = transforms[link]
+            poses[key] = np.concatenate([T[:, :3, 3], R.from_matrix(T[:, :3, :3]).as_quat()], axis=1)
+        return poses
+
+    def jacobian(self, q, link=None, local_position=(0, 0, 0)):
+        """
+        Geometric Jacobian with respect to the arm joints, expressed in world frame.
+
+        Args:
+            q: (N, num_dof) arm joint positions.
+            link: name of the link, defaults to the tcp.
+            local_position: point on the link in link coordinates.
+        Returns:
+            (N, 6, num_dof) Jacobians, rows are [linear velocity, angular velocity].
+        """
+        link = self.tcp_link if link is None else link
+        chain = self.get_chain(link)
+        transforms = self.link_transforms(q, [joint["child"] for joint in chain])
+        T = transforms[link]
+        point = T[:, :3, :3] @ np.asarray(local_position, dtype=float) + T[:, :3, 3]
+        J = np.zeros((len(T), 6, self.num_dof))
+        for joint in chain:
+            index = self._arm_joint_index.get(joint["name"])
+            if index is None:
+                continue
+            # the joint axis is fixed in the child frame
+            T_joint = transforms[joint["child"]]
+            axis = T_joint[:, :3, :3] @ joint["axis"]
+            if joint["type"] == "prismatic":
+                J[:, :3, index] = axis
+            else:
+                J[:, :3, index] = np.cross(axis, point - T_joint[:, :3, 3])
+                J[:, 3:, index] = axis
+        return J
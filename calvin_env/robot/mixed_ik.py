@@ -1,3 +1,6 @@
+from collections import OrderedDict
+import time
+
 import numpy as np
 import pybullet as p
 from scipy.spatial.transform import Rotation as R
@@ -25,6 +28,13 @@ class MixedIK:
         threshold_orn=0.05,
         weights=(1, 1, 1, 1, 1, 1, 1),
         num_angles=50,
+        max_num_iterations=20,
+        residual_threshold=1e-4,
+        cache_size=1024,
+        cache_pos_resolution=1e-4,
+        cache_orn_resolution=1e-3,
+        cache_seed_resolution=0.05,
+        kinematics=None,
     ):
         self.robot_uid = robot_uid
         self.cid = cid
@@ -41,6 +51,8 @@ class MixedIK:
                 robot_uid, cid, rp, ll_real, ul_real, base_position, base_orientation, weights, num_angles
             )
         self.tcp_link_id = tcp_link_id
+        # numpy forward kinematics (RobotKinematics), used instead of IKfast FK if given
+        self.kinematics = kinematics
         self.ll = ll
         self.ul = ul
         self.jr = jr
@@ -51,8 +63,23 @@ class MixedIK:
         self.threshold_pos = threshold_pos
         self.threshold_orn = threshold_orn
         self.is_using_IK_fast = False
+        self.max_num_iterations = max_num_iterations
+        self.residual_threshold = residual_threshold
+        # LRU cache of solutions keyed on the quantized target pose and seed region
+        self.cache_size = cache_size
+        self.cache_pos_resolution = cache_pos_resolution
+        self.cache_orn_resolution = cache_orn_resolution
+        self.cache_seed_resolution = cache_seed_resolution
+        self._cache = OrderedDict()
+        self.last_stats = {}
+        self._fk_cache = OrderedDict()
+        self.fk_cache_size = 32
+        self.stats = {"calls": 0, "cache_hits": 0, "bullet": 0, "ikfast": 0, "time": 0.0}
 
     def get_bullet_ik(self, desired_ee_pos, desired_ee_orn):
+        # bullet starts iterating from the current joint state of the robot. Passing the same state again as
+        # currentPositions makes the solver diverge, so the solver is always warm started implicitly.
+        kwargs = dict(maxNumIterations=self.max_num_iterations, residualThreshold=self.residual_threshold)
         if self.use_nullspace:
             jnt_ps = p.calculateInverseKinematics(
                 self.robot_uid,
@@ -64,10 +91,11 @@ class MixedIK:
                 self.jr,
                 self.rp,
                 physicsClientId=self.cid,
+                **kwargs,
             )
         else:
             jnt_ps = p.calculateInverseKinematics(
-                self.robot_uid, self.tcp_link_id, desired_ee_pos, desired_ee_orn, physicsClientId=self.cid
+                self.robot_uid, self.tcp_link_id, desired_ee_pos, desired_ee_orn, physicsClientId=self.cid, **kwargs
             )
         # clip joint positions outside the joint ranges
         jnt_ps = np.clip(jnt_ps[: self.num_dof], self.ll_real, self.ul_real)
@@ -80,39 +108,117 @@ class MixedIK:
         pose_r = np.eye(4)
         pose_r[:3, 3] = pos_r
         pose_r[:3, :3] = orn_r
-        pose_w = np.linalg.inv(self.ik_fast.T_robot_world) @ pose_r
+        pose_w = self.ik_fast.T_world_robot @ pose_r
         pos_r = pose_w[:3, 3]
         orn_r = R.from_matrix(pose_w[:3, :3]).as_quat()
         return pos_r, orn_r
 
+    def get_world_fk(self, q):
+        """Tcp forward kinematics in world frame, memoized for recently queried configurations."""
+        key = tuple(q)
+        if key in self._fk_cache:
+            self._fk_cache.move_to_end(key)
+            return self._fk_cache[key]
+        if self.kinematics is not None:
+            pos, orn = self.kinematics.forward_kinematics(q[: self.num_dof], self.kinematics.tcp_link)
+            pos, orn = pos[0], orn[0]
+        else:
+            pos, orn = self.robot_to_world(*self.get_fk(list(q)))
+        self._fk_cache[key] = pos, orn
+        if len(self._fk_cache) > self.fk_cache_size:
+            self._fk_cache.popitem(last=False)
+        return pos, orn
+
     def pose_within_threshold(self, target_pos, target_orn, q):
-        pos, orn = self.get_fk(q)
-        pos, orn = self.robot_to_world(pos, orn)
+        pos, orn = self.get_world_fk(q)
         angular_diff = angle_between_quaternions(orn, target_orn)
         threshold_pos_exceeded = np.linalg.norm(target_pos - pos) > self.threshold_pos
         threshold_orn_exceeded = angular_diff > self.threshold_orn
         return not (threshold_pos_exceeded or threshold_orn_exceeded)
 
     def get_joint_states(self):
-        return list(zip(*p.getJointStates(self.robot_uid, range(self.num_dof))))[0]
+        return list(zip(*p.getJointStates(self.robot_uid, range(self.num_dof), physicsClientId=self.cid)))[0]
 
     def get_ik(self, target_pos, target_orn):
+        t0 = time.time()
+        self.stats["calls"] += 1
+        key = None
+        if self.cache_size > 0:
+            key = self._cache_key(target_pos, target_orn, self.get_joint_states())
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                self._record_stats("cache", target_pos, target_orn, None, t0)
+                q, self.is_using_IK_fast = self._cache[key]
+                return q.copy()
+
+        q, backend = self._solve_ik(target_pos, target_orn)
+        self.stats[backend] += 1
+        self._record_stats(backend, target_pos, target_orn, q, t0)
+        if key is not None:
+            # the backend decides how the next target is solved, restore it together with the solution
+            self._cache[key] = q.copy(), self.is_using_IK_fast
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return q
+
+    def _solve_ik(self, target_pos, target_orn):
         if self.is_using_IK_fast and not self.pose_within_threshold(target_pos, target_orn, self.get_joint_states()):
             q_ik_fast = self.ik_fast.get_ik_solution(target_pos, target_orn)
             if q_ik_fast is not None:
                 self.is_using_IK_fast = True
-                return q_ik_fast
+                return q_ik_fast, "ikfast"
             else:
                 self.is_using_IK_fast = False
                 q_bullet = self.get_bullet_ik(target_pos, target_orn)
-                return q_bullet
+                return q_bullet, "bullet"
         self.is_using_IK_fast = False
         q_bullet = self.get_bullet_ik(target_pos, target_orn)
         if self.use_ik_fast and not self.pose_within_threshold(target_pos, target_orn, q_bullet):
             q_ik_fast = self.ik_fast.get_ik_solution(target_pos, target_orn)
             if q_ik_fast is not None:
                 self.is_using_IK_fast = True
-                return q_ik_fast
+                return q_ik_fast, "ikfast"
             else:
-                return q_bullet
-        return q_bullet
+                return q_bullet, "bullet"
+        return q_bullet, "bullet"
+
+    def _cache_key(self, target_pos, target_orn, seed):
+        target_orn = np.asarray(target_orn)
+        # q and -q encode the same rotation
+        if target_orn[np.argmax(np.abs(target_orn))] < 0:
+            target_orn = -target_orn
+        return (
+            tuple(np.round(np.asarray(target_pos) / self.cache_pos_resolution).astype(int)),
+            tuple(np.round(target_orn / self.cache_orn_resolution).astype(int)),
+            tuple(np.round(np.asarray(seed) / self.cache_seed_resolution).astype(int)),
+        )
+
+    def _record_stats(self, backend, target_pos, target_orn, q, t0):
+        residual_pos = residual_orn = None
+        if q is not None and (self.use_ik_fast or self.kinematics is not None):
+            pos, orn = self.get_world_fk(q)
+            residual_pos = float(np.linalg.norm(np.asarray(target_pos) - pos))
+            residual_orn = float(angle_between_quaternions(orn, target_orn))
+        duration = time.time() - t0
+        self.stats["time"] += duration
+        # bullet does not report the number of iterations it used, only the configured budget is known
+        self.last_stats = {
+            "backend": backend,
+            "cache_hit": backend == "cache",
+            "max_iterations": self.max_num_iterations if backend == "bullet" else None,
+            "residual_pos": residual_pos,
+            "residual_orn": residual_orn,
+            "time": duration,
+        }
+
+    def get_stats(self):
+        calls = max(self.stats["calls"], 1)
+        return {
+            **self.stats,
+            "cache_hit_rate": self.stats["cache_hits"] / calls,
+            "mean_time": self.stats["time"] / calls,
+        }
+
+    def clear_cache(self):
+        self._cache.clear()
@@ -0,0 +1,118 @@
+import logging
+import time
+
+import numpy as np
+
+# A logger for this file
+log = logging.getLogger(__name__)
+
+
+def _quat_to_matrix(quat):
+    x, y, z, w = quat
+    return np.array(
+        [
+            [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+            [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+            [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+        ]
+    )
+
+
+def _rotation_error(R_target, R_current):
+    """Rotation vector in world frame that rotates R_current onto R_target."""
+    R_err = R_target @ R_current.T
+    cos_angle = np.clip((np.trace(R_err) - 1) / 2, -1.0, 1.0)
+    angle = np.arccos(cos_angle)
+    axis = np.array([R_err[2, 1] - R_err[1, 2], R_err[0, 2] - R_err[2, 0], R_err[1, 0] - R_err[0, 1]])
+    if angle < 1e-6:
+        return axis / 2
+    return axis * angle / (2 * np.sin(angle))
+
+
+class ResolvedRateController:
+    """
+    Maps Cartesian tcp deltas to joint deltas through the Jacobian instead of solving IK every step.
+
+    The joint step is computed with damped least squares, the remaining redundancy of the arm is used to pull the
+    joints towards the rest pose. If the tcp is too far from the commanded pose for the linearization to be
+    accurate, the controller falls back to full IK.
+    """
+
+    def __init__(
+        self,
+        kinematics,
+        ll_real,
+        ul_real,
+        rp,
+        damping=0.05,
+        null_space_gain=0.1,
+        fallback_threshold_pos=0.05,
+        fallback_threshold_orn=0.3,
+    ):
+        """
+        Args:
+            kinematics: RobotKinematics of the robot.
+            ll_real, ul_real: arm joint limits.
+            rp: rest pose the null space motion is biased to.
+            damping: damping factor of the least squares solution, trades tracking accuracy near singularities for
+                bounded joint velocities.
+            null_space_gain: gain of the null space motion towards the rest pose.
+            fallback_threshold_pos: tracking error in m above which full IK is used.
+            fallback_threshold_orn: tracking error in rad above which full IK is used.
+        """
+        self.kinematics = kinematics
+        self.ll_real = np.asarray(ll_real)
+        self.ul_real = np.asarray(ul_real)
+        self.num_dof = len(self.ll_real)
+        self.rp = np.asarray(rp[: self.num_dof])
+        self.damping = damping
+        self.null_space_gain = null_space_gain
+        self.fallback_threshold_pos = fallback_threshold_pos
+        self.fallback_threshold_orn = fallback_threshold_orn
+        self.stats = {"calls": 0, "fallbacks": 0, "time": 0.0}
+
+    @staticmethod
+    def get_pose_error(T, target_pos, target_orn):
+        pos_err = np.asarray(target_pos) - T[:3, 3]
+        orn_err = _rotation_error(_quat_to_matrix(target_orn), T[:3, :3])
+        return np.concatenate([pos_err, orn_err])
+
+    def step(self, q, target_pos, target_orn):
+        """
+        Args:
+            q: current arm joint positions.
+            target_pos: commanded tcp position.
+            target_orn: commanded tcp orientation (quaternion).
+        Returns:
+            joint positions reaching the target to first order, or None if the tracking error exceeds the fallback
+            thresholds and full IK should be used instead.
+        """
+        t0 = time.time()
+        self.stats["calls"] += 1
+        q = np.asarray(q[: self.num_dof], dtype=float)
+        T, J = self.kinematics.fk_jacobian(q)
+        error = self.get_pose_error(T, target_pos, target_orn)
+        pos_err, orn_err = np.linalg.norm(error[:3]), np.linalg.norm(error[3:])
+        if pos_err > self.fallback_threshold_pos or orn_err > self.fallback_threshold_orn:
+            self.stats["fallbacks"] += 1
+            self.stats["time"] += time.time() - t0
+            return None
+        # damped pseudo inverse J^T (J J^T + lambda^2 I)^-1
+        J_pinv = J.T @ np.linalg.inv(J @ J.T + self.damping**2 * np.eye(6))
+        dq = J_pinv @ error
+        null_space = np.eye(self.num_dof) - J_pinv @ J
+        dq += null_space @ (self.null_space_gain * (self.rp - q))
+        q_next = np.clip(q + dq, self.ll_real, self.ul_real)
+        self.stats["time"] += time.time() - t0
+        return q_next
+
+    def get_stats(self):
+        calls = max(self.stats["calls"], 1)
+        return {
+            **self.stats,
+            "fallback_rate": self.stats["fallbacks"] / calls,
+            "mean_time": self.stats["time"] / calls,
+        }
+
+    def reset_stats(self):
+        self.stats = {"calls": 0, "fallbacks": 0, "time": 0.0}
@@ -1,14 +1,26 @@
+from collections import Counter
+from functools import partial
 import logging
+import os
+from pathlib import Path
+
 import numpy as np
 import pybullet as p
 import torch
 
+from calvin_env.planning.reachability import ReachabilityMap
+from calvin_env.robot.batch_ik import KinematicsClient, solve_ik_batch_parallel
+from calvin_env.robot.kinematics import RobotKinematics
 from calvin_env.robot.mixed_ik import MixedIK
-from calvin_env.utils.noise import Identity, NoiseModel
+from calvin_env.robot.resolved_rate import ResolvedRateController
+from calvin_env.utils.lazy_mapping import LazyMapping
+from calvin_env.utils.noise import Identity, make_rng, NoiseModel, PackedNoise
 
 # A logger for this file
 log = logging.getLogger(__name__)
 
+REPO_BASE = Path(__file__).parents[2]
+
 
 class Robot:
     def __init__(
@@ -36,11 +48,18 @@ class Robot:
         magic_scaling_factor_pos=1,
         magic_scaling_factor_orn=1,
         use_target_pose=True,
+        ik_max_iterations=20,
+        ik_residual_threshold=1e-4,
+        ik_cache_size=1024,
+        data_path="calvin_env/assets/data",
+        resolved_rate=None,
+        reachability_map=None,
         **kwargs,
     ):
         log.info("Loading robot")
         self.cid = cid
         self.filename = filename
+        self.data_path = Path(data_path) if os.path.isabs(data_path) else REPO_BASE / data_path
         self.use_nullspace = use_nullspace
         self.max_velocity = max_velocity
         self.use_ik_fast = use_ik_fast
@@ -57,6 +76,8 @@ class Robot:
         self.joint_velocities_noise: NoiseModel = Identity()
         self.joint_positions_noise: NoiseModel = Identity()
         self.joint_forces_noise: NoiseModel = Identity()
+        self.noise_rng = make_rng()
+        self._joint_noise = None
 
         # Setup constraints
         self.robot_uid = None
@@ -74,6 +95,24 @@ class Robot:
         self.target_pos = None
         self.target_orn = None
         self.use_target_pose = use_target_pose
+        self.ik_max_iterations = ik_max_iterations
+        self.ik_residual_threshold = ik_residual_threshold
+        self.ik_cache_size = ik_cache_size
+        self._kinematics_client = None
+        self.kinematics = None
+        # kwargs of the ResolvedRateController used by the quat_rel_rate action type
+        self.resolved_rate_cfg = resolved_rate if resolved_rate is not None else {}
+        self.resolved_rate = None
+        # npz written by scripts/build_reachability_map.py, loaded on first use
+        self.reachability_map_file = reachability_map
+        self._reachability_map = None
+        # last gripper pose and its view matrix, robot_info computes the view matrix on first access
+        self._gripper_view_matrix = None
+        # simulation tick, advanced by the env before the physics steps, and the contacts computed in it
+        self.tick = 0
+        self._contacts = None
+        self.info_access_counts = None
+        self.info_compute_counts = None
         # self.reconfigure = False
 
     def load(self):
@@ -107,6 +146,22 @@ class Robot:
         self.jr = [7] * num_dof
         # restposes for null space
         self.rp = list(self.initial_joint_positions) + [self.gripper_joint_limits[1]] * 2
+        # joint index arrays and motor forces for the batched motor commands
+        self.motor_joint_ids = list(range(self.end_effector_link_id))
+        self.motor_forces = [self.max_joint_force] * len(self.motor_joint_ids)
+        self.arm_forces = [self.max_joint_force] * len(self.arm_joint_ids)
+        self.reset_joint_ids = [*self.arm_joint_ids, *self.gripper_joint_ids]
+        self.reset_forces = [self.max_joint_force] * len(self.arm_joint_ids) + [self.max_gripper_force] * len(
+            self.gripper_joint_ids
+        )
+        # fixed joints have no state, resetting or commanding them is a no-op
+        self.movable_joint_ids = [
+            i
+            for i in range(p.getNumJoints(self.robot_uid, physicsClientId=self.cid))
+            if p.getJointInfo(self.robot_uid, i, physicsClientId=self.cid)[2] != p.JOINT_FIXED
+        ]
+        self.movable_forces = [self.max_joint_force] * len(self.movable_joint_ids)
+        self.set_motor_max_velocities()
         self.reset()
         self.mixed_ik = MixedIK(
             self.robot_uid,
@@ -125,6 +180,13 @@ class Robot:
             threshold_orn=0.1,
             weights=(10, 8, 6, 6, 2, 2, 1),
             num_angles=30,
+            max_num_iterations=self.ik_max_iterations,
+            residual_threshold=self.ik_residual_threshold,
+            cache_size=self.ik_cache_size,
+            kinematics=self.get_kinematics(),
+        )
+        self.resolved_rate = ResolvedRateController(
+            self.get_kinematics(), self.ll_real, self.ul_real, self.rp, **self.resolved_rate_cfg
         )
 
     def add_base_cylinder(self):
@@ -146,6 +208,7 @@ class Robot:
         p.createMultiBody(baseVisualShapeIndex=cylinder)
 
     def reset(self, robot_state=None):
+        self.advance_tick()
         if robot_state is None:
             gripper_state = self.gripper_joint_limits[1]
             joint_states = self.initial_joint_positions
@@ -155,28 +218,11 @@ class Robot:
             gripper_state = robot_state[self.get_observation_labels().index("gripper_opening_width")] / 2
 
         assert len(joint_states) == len(self.arm_joint_ids)
-        for i, _id in enumerate(self.arm_joint_ids):
-            p.resetJointState(self.robot_uid, _id, joint_states[i], physicsClientId=self.cid)
-            p.setJointMotorControl2(
-                bodyIndex=self.robot_uid,
-                jointIndex=_id,
-                controlMode=p.POSITION_CONTROL,
-                force=self.max_joint_force,
-                targetPosition=joint_states[i],
-                maxVelocity=self.max_velocity,
-                physicsClientId=self.cid,
-            )
-        for i in self.gripper_joint_ids:
-            p.resetJointState(self.robot_uid, i, gripper_state, physicsClientId=self.cid)
-            p.setJointMotorControl2(
-                bodyIndex=self.robot_uid,
-                jointIndex=i,
-                controlMode=p.POSITION_CONTROL,
-                force=self.max_gripper_force,
-                targetPosition=gripper_state,
-                maxVelocity=1,
-                physicsClientId=self.cid,
-            )
+        targets = [*joint_states, *[gripper_state] * len(self.gripper_joint_ids)]
+        p.resetJointStatesMultiDof(
+            self.robot_uid, self.reset_joint_ids, [[x] for x in targets], physicsClientId=self.cid
+        )
+        self.set_position_targets(self.reset_joint_ids, targets, self.reset_forces)
         tcp_pos, tcp_orn = p.getLinkState(self.robot_uid, self.tcp_link_id, physicsClientId=self.cid)[:2]
         if self.euler_obs:
             tcp_orn = p.getEulerFromQuaternion(tcp_orn)
@@ -223,30 +269,6 @@ class Robot:
         #print(f"Gripper pose: {gripper_pose}")
         #print(f"TCP pose: {tcp_pose}")
 
-        # Convert quaternion to rotation matrix (returned as 9 values in row-major order)
-        R = p.getMatrixFromQuaternion(orientation)
-        # The rotation matrix is:
-        # [ R[0] R[1] R[2] ]
-        # [ R[3] R[4] R[5] ]
-        # [ R[6] R[7] R[8] ]
-        #
-        # Here, we define:
-        # - forward vector: along the gripper's local Z axis, using the third column (R[2], R[5], R[8])
-        # - up vector: along the gripper's local Y axis, using the second column (R[1], R[4], R[7])
-        forward = [R[2], R[5], R[8]]
-        up = [R[1], R[4], R[7]]
-
-        # Define the target as a point a small distance ahead along the forward vector.
-        # For instance, target = position + forward (scaled by a desired distance, here using 1.0)
-        target = [position[i] + forward[i] for i in range(3)]
-
-        # Now, compute the view matrix for the gripper camera.
-        gripper_view_matrix = p.computeViewMatrix(
-            cameraEyePosition=position,
-            cameraTargetPosition=target,
-            cameraUpVector=up,
-            physicsClientId=self.cid,
-        )
         # Get arm joint positions
         arm_joint_positions = []
         arm_joint_velocities = []
@@ -299,15 +321,109 @@ class Robot:
             "gripper_opening_state": gripper_opening_state,
             "gripper_finger_forces": gripper_finger_forces,
             "gripper_finger_positions": gripper_finger_positions,
-            "gripper_view_matrix": gripper_view_matrix,
             "gripper_pose": gripper_pose,
             "tcp_pose": tcp_pose,
             "tcp_state": gripper_opening_state,
             "uid": self.robot_uid,
-            "contacts": p.getContactPoints(bodyA=self.robot_uid, physicsClientId=self.cid),
+            # contacts of the last physics step, they can not be recovered once the simulation advanced
+        }
+        lazy_fields = {
+            # the view matrix only depends on the gripper pose, it stays valid after the simulation advanced
+            "gripper_view_matrix": partial(self.get_gripper_view_matrix, position, orientation),
+            "contacts": partial(self.get_contacts, self.tick),
         }
+        robot_info = LazyMapping(robot_info, lazy_fields, self.info_access_counts)
         return robot_state, robot_info
 
+    def seed_noise(self, rng):
+        """Draw the observation noise from the np.random.Generator rng."""
+        self.noise_rng = rng
+        self._joint_noise = None
+
+    def apply_joint_noise(self, positions, velocities, forces):
+        """
+        Apply the joint position, velocity and force noise models with one draw on the packed joint state.
+
+        Returns:
+            noisy copies of positions, velocities and forces.
+        """
+        models = (self.joint_positions_noise, self.joint_velocities_noise, self.joint_forces_noise)
+        sizes = (len(positions), len(velocities), len(forces))
+        if self._joint_noise is None or self._joint_noise[0] != (models, sizes):
+            # noise models were exchanged, rebuild the packed noise
+            try:
+                packed = PackedNoise(models, sizes, rng=self.noise_rng)
+            except ValueError:
+                packed = None
+                for model in models:
+                    model.seed(self.noise_rng)
+            self._joint_noise = ((models, sizes), packed)
+        packed = self._joint_noise[1]
+        if packed is None:
+            return [model.apply(np.asarray(x)) for model, x in zip(models, (positions, velocities, forces))]
+        return packed.apply_fields(positions, velocities, forces)
+
+    def get_gripper_view_matrix(self, position, orientation):
+        key = (*position, *orientation)
+        if self._gripper_view_matrix is not None and self._gripper_view_matrix[0] == key:
+            return self._gripper_view_matrix[1]
+        if self.info_compute_counts is not None:
+            self.info_compute_counts["gripper_view_matrix"] += 1
+        # Convert quaternion to rotation matrix (returned as 9 values in row-major order)
+        R = p.getMatrixFromQuaternion(orientation)
+        # The rotation matrix is:
+        # [ R[0] R[1] R[2] ]
+        # [ R[3] R[4] R[5] ]
+        # [ R[6] R[7] R[8] ]
+        #
+        # Here, we define:
+        # - forward vector: along the gripper's local Z axis, using the third column (R[2], R[5], R[8])
+        # - up vector: along the gripper's local Y axis, using the second column (R[1], R[4], R[7])
+        forward = [R[2], R[5], R[8]]
+        up = [R[1], R[4], R[7]]
+
+        # Define the target as a point a small distance ahead along the forward vector.
+        # For instance, target = position + forward (scaled by a desired distance, here using 1.0)
+        target = [position[i] + forward[i] for i in range(3)]
+
+        # Now, compute the view matrix for the gripper camera.
+        view_matrix = p.computeViewMatrix(
+            cameraEyePosition=position,
+            cameraTargetPosition=target,
+            cameraUpVector=up,
+            physicsClientId=self.cid,
+        )
+        self._gripper_view_matrix = key, view_matrix
+        return view_matrix
+
+    def get_contacts(self, tick):
+        """
+        Contact points of the robot in the last physics step, memoized for the current simulation tick.
+
+        Raises:
+            RuntimeError: if the simulation advanced past tick, the contacts of an earlier tick are lost. Read them
+                (or call resolve() on robot_info) before stepping.
+        """
+        if tick != self.tick:
+            raise RuntimeError(
+                f"contacts of simulation tick {tick} were read at tick {self.tick}, read them before the simulation "
+                f"advances"
+            )
+        if self._contacts is None or self._contacts[0] != tick:
+            if self.info_compute_counts is not None:
+                self.info_compute_counts["contacts"] += 1
+            self._contacts = tick, p.getContactPoints(bodyA=self.robot_uid, physicsClientId=self.cid)
+        return self._contacts[1]
+
+    def advance_tick(self):
+        """Start a new simulation tick, has to be called before the simulation state changes."""
+        self.tick += 1
+
+    def track_info_access(self):
+        """Count lookups of every robot_info field and computations of the lazy fields."""
+        self.info_access_counts = Counter()
+        self.info_compute_counts = Counter()
+
     def get_observation_labels(self):
         tcp_pos_labels = [f"tcp_pos_{ax}" for ax in ("x", "y", "z")]
         if self.euler_obs:
@@ -340,6 +456,75 @@ class Robot:
             abs_orn = np.array(tcp_orn) + rel_rot
             return abs_pos, abs_orn, gripper
 
+    def get_urdf_path(self):
+        return self.filename if os.path.isabs(self.filename) else (self.data_path / self.filename).as_posix()
+
+    def get_kinematics(self):
+        """Batched numpy forward kinematics of the robot, parsed from the urdf on first use."""
+        if self.kinematics is None:
+            tcp_link, end_effector_link = (
+                p.getJointInfo(self.robot_uid, i, physicsClientId=self.cid)[12].decode()
+                for i in (self.tcp_link_id, self.end_effector_link_id)
+            )
+            self.kinematics = RobotKinematics(
+                self.get_urdf_path(),
+                self.base_position,
+                self.base_orientation,
+                tcp_link=tcp_link,
+                end_effector_link=end_effector_link,
+            )
+        return self.kinematics
+
+    def get_kinematics_client_kwargs(self):
+        return dict(
+            urdf_path=self.get_urdf_path(),
+            base_position=self.base_position,
+            base_orientation=self.base_orientation,
+            tcp_link_id=self.tcp_link_id,
+            ll_real=self.ll_real,
+            ul_real=self.ul_real,
+            ll=self.ll,
+            ul=self.ul,
+            jr=self.jr,
+            rp=self.rp,
+            use_nullspace=self.use_nullspace,
+        )
+
+    def solve_ik_batch(self, poses, seed=None, continuity=True, num_workers=1):
+        """
+        Solve IK for a whole tcp path on a kinematics-only client, without disturbing the live simulation.
+
+        Args:
+            poses: (N, 7) tcp poses [x, y, z, qx, qy, qz, qw] in world frame.
+            seed: arm configuration the first pose is seeded with, defaults to the current arm configuration.
+            continuity: seed every pose with the solution of the previous one.
+            num_workers: solve contiguous chunks of the path in a process pool if > 1.
+        Returns:
+            q: (N, 7) joint solutions
+            success: (N,) True if the solution reaches the pose
+        """
+        seed = self.get_arm_joint_positions() if seed is None else np.asarray(seed)
+        if num_workers > 1:
+            return solve_ik_batch_parallel(
+                self.get_kinematics_client_kwargs(), poses, seed, continuity, num_workers=num_workers
+            )
+        if self._kinematics_client is None:
+            self._kinematics_client = KinematicsClient(**self.get_kinematics_client_kwargs())
+        return self._kinematics_client.solve(poses, seed, continuity)
+
+    def get_reachability_map(self):
+        """Precomputed ReachabilityMap of the robot, None if no map is configured."""
+        if self._reachability_map is None and self.reachability_map_file is not None:
+            self._reachability_map = ReachabilityMap.load(self.reachability_map_file)
+        return self._reachability_map
+
+    def is_reachable(self, pos, orn):
+        """Whether the reachability map has an IK solution near the tcp pose (orientation as quaternion)."""
+        reachability_map = self.get_reachability_map()
+        if reachability_map is None:
+            return True
+        return bool(reachability_map.is_reachable(pos, orn)[0])
+
     def apply_joint_action(self, action):
         assert len(action) == 10
         jnt_ps = np.array(action[:9])
@@ -368,6 +553,13 @@ class Robot:
             abs_pos, abs_rot_euler, self.gripper_action = self.relative_to_absolute(action["action"])
             abs_rot_quat = p.getQuaternionFromEuler(abs_rot_euler)
             jnt_ps = self.mixed_ik.get_ik(abs_pos, abs_rot_quat)
+        elif action["type"] == "quat_rel_rate":
+            # same semantics as quat_rel, but joint targets come from the resolved-rate controller
+            abs_pos, abs_rot_euler, self.gripper_action = self.relative_to_absolute(action["action"])
+            abs_rot_quat = p.getQuaternionFromEuler(abs_rot_euler)
+            jnt_ps = self.resolved_rate.step(self.get_arm_joint_positions(), abs_pos, abs_rot_quat)
+            if jnt_ps is None:
+                jnt_ps = self.mixed_ik.get_ik(abs_pos, abs_rot_quat)
         elif action["type"] == "quat_abs":
             abs_pos, abs_rot_quat, self.gripper_action = np.split(action["action"], [3, 7])
             jnt_ps = self.mixed_ik.get_ik(abs_pos, abs_rot_quat)
@@ -382,21 +574,40 @@ class Robot:
         assert self.gripper_action in (-1, 1)
         self.control_motors(jnt_ps)
 
-    def control_motors(self, joint_positions):
-        for i in range(self.end_effector_link_id):
-            # p.resetJointState(self.robot_uid, i, jnt_ps[i])
+    def set_motor_max_velocities(self):
+        """
+        The max velocity of a position controlled motor persists in the physics server until it is overwritten.
+        setJointMotorControlArray has no max velocity argument, so it is set once per joint here and the batched
+        commands reuse it. Arm joints are limited to max_velocity, the fingers to 1.
+        """
+        for i in self.movable_joint_ids:
             p.setJointMotorControl2(
                 bodyIndex=self.robot_uid,
                 jointIndex=i,
                 controlMode=p.POSITION_CONTROL,
-                force=self.max_joint_force,
-                targetPosition=joint_positions[i],
-                maxVelocity=self.max_velocity,
+                maxVelocity=1 if i in self.gripper_joint_ids else self.max_velocity,
                 physicsClientId=self.cid,
             )
 
+    def set_position_targets(self, joint_ids, target_positions, forces):
+        """Position control for several joints with a single motor command."""
+        p.setJointMotorControlArray(
+            bodyIndex=self.robot_uid,
+            jointIndices=joint_ids,
+            controlMode=p.POSITION_CONTROL,
+            targetPositions=target_positions,
+            forces=forces,
+            physicsClientId=self.cid,
+        )
+
+    def control_motors(self, joint_positions):
+        self.set_position_targets(self.motor_joint_ids, joint_positions[: len(self.motor_joint_ids)], self.motor_forces)
         self.control_gripper(self.gripper_action)
 
+    def get_arm_joint_positions(self):
+        joint_states = p.getJointStates(self.robot_uid, self.arm_joint_ids, physicsClientId=self.cid)
+        return np.array([state[0] for state in joint_states])
+
     def control_gripper(self, gripper_action):
         if gripper_action == 1:
             gripper_finger_position = self.gripper_joint_limits[1]
@@ -404,16 +615,10 @@ class Robot:
         else:
             gripper_finger_position = self.gripper_joint_limits[0]
             self.gripper_force = self.max_gripper_force
-        for id in self.gripper_joint_ids:
-            p.setJointMotorControl2(
-                bodyIndex=self.robot_uid,
-                jointIndex=id,
-                controlMode=p.POSITION_CONTROL,
-                targetPosition=gripper_finger_position,
-                force=self.gripper_force,
-                maxVelocity=1,
-                physicsClientId=self.cid,
-            )
+        num_fingers = len(self.gripper_joint_ids)
+        self.set_position_targets(
+            self.gripper_joint_ids, [gripper_finger_position] * num_fingers, [self.gripper_force] * num_fingers
+        )
 
     def serialize(self):
         return {
@@ -429,28 +634,22 @@ class Robot:
         }
 
     def reset_from_storage(self, data):
+        self.advance_tick()
         p.resetBasePositionAndOrientation(
             bodyUniqueId=self.robot_uid, posObj=data["pose"][0], ornObj=data["pose"][1], physicsClientId=self.cid
         )
         num_joints = len(data["joints"])
         assert num_joints == p.getNumJoints(self.robot_uid, physicsClientId=self.cid)
-        for i, (value, velocity, *_) in enumerate(data["joints"]):
-            p.resetJointState(
-                bodyUniqueId=self.robot_uid,
-                jointIndex=i,
-                targetValue=value,
-                targetVelocity=velocity,
-                physicsClientId=self.cid,
-            )
-            p.setJointMotorControl2(
-                bodyIndex=self.robot_uid,
-                jointIndex=i,
-                controlMode=p.POSITION_CONTROL,
-                force=self.max_joint_force,
-                targetPosition=value,
-                maxVelocity=self.max_velocity,
-                physicsClientId=self.cid,
-            )
+        values = [data["joints"][i][0] for i in self.movable_joint_ids]
+        velocities = [data["joints"][i][1] for i in self.movable_joint_ids]
+        p.resetJointStatesMultiDof(
+            self.robot_uid,
+            self.movable_joint_ids,
+            [[x] for x in values],
+            targetVelocities=[[v] for v in velocities],
+            physicsClientId=self.cid,
+        )
+        self.set_position_targets(self.movable_joint_ids, values, self.movable_forces)
         self.control_gripper(data["gripper_action"])
 
     def __str__(self):
@@ -0,0 +1,84 @@
+import argparse
+import time
+
+import numpy as np
+
+from calvin_env.envs.calvin_env import get_env_from_cfg
+from calvin_env.planning.collision import CollisionWorld
+
+"""
+Benchmarks collision checks per second of the planning collision world.
+
+Compares contacts filtered in python after every check against pybullet-side pair filtering with the sampled allowed
+collision matrix, for single configurations, configuration batches and edges. Also reports configurations on which
+both disagree, which means the allowed collision matrix missed a rarely colliding link pair.
+"""
+
+
+def time_configs(world, qs):
+    t0 = time.time()
+    valid = np.array([world.is_valid(q) for q in qs])
+    return len(qs) / (time.time() - t0), valid
+
+
+def time_batch(world, qs):
+    t0 = time.time()
+    valid = world.check_configs(qs)
+    return len(qs) / (time.time() - t0), valid
+
+
+def time_edges(world, starts, goals, resolution):
+    checks = world.num_checks
+    t0 = time.time()
+    valid = world.check_edges(starts, goals, resolution)
+    dt = time.time() - t0
+    return len(starts) / dt, (world.num_checks - checks) / dt, valid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark collision checks per second of the planning world")
+    parser.add_argument("--num_configs", type=int, default=5000)
+    parser.add_argument("--num_edges", type=int, default=500)
+    parser.add_argument("--resolution", type=float, default=0.05)
+    parser.add_argument("--acm_samples", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    env = get_env_from_cfg(vis=False)
+    env.reset()
+    t0 = time.time()
+    filtered = CollisionWorld.from_env(env, acm_samples=args.acm_samples)
+    print(
+        f"allowed collision matrix: {len(filtered.allowed_collisions)} pairs from {args.acm_samples} samples, "
+        f"sampled or loaded from the cache in {time.time() - t0:.2f}s"
+    )
+    unfiltered = CollisionWorld.from_env(env, filter_pairs=False)
+
+    rng = np.random.default_rng(args.seed)
+    qs = rng.uniform(filtered.lower_limits, filtered.upper_limits, (args.num_configs, filtered.num_dof))
+    starts = rng.uniform(filtered.lower_limits, filtered.upper_limits, (args.num_edges, filtered.num_dof))
+    goals = rng.uniform(filtered.lower_limits, filtered.upper_limits, (args.num_edges, filtered.num_dof))
+
+    print(f"{'':12s} {'configs/s':>10s} {'batch/s':>10s} {'edges/s':>10s} {'edge checks/s':>14s} {'invalid':>8s}")
+    results = {}
+    for name, world in (("unfiltered", unfiltered), ("filtered", filtered)):
+        single_rate, valid = time_configs(world, qs)
+        batch_rate, batch_valid = time_batch(world, qs)
+        assert np.array_equal(valid, batch_valid)
+        edge_rate, edge_check_rate, edges_valid = time_edges(world, starts, goals, args.resolution)
+        results[name] = valid, edges_valid
+        print(
+            f"{name:12s} {single_rate:10.0f} {batch_rate:10.0f} {edge_rate:10.1f} {edge_check_rate:14.0f} "
+            f"{np.mean(~valid):8.3f}"
+        )
+    config_disagreements = np.sum(results["unfiltered"][0] != results["filtered"][0])
+    edge_disagreements = np.sum(results["unfiltered"][1] != results["filtered"][1])
+    print(f"disagreements: {config_disagreements} configurations, {edge_disagreements} edges")
+
+    filtered.close()
+    unfiltered.close()
+    env.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+from pathlib import Path
+import time
+
+import hydra
+import numpy as np
+from omegaconf import OmegaConf
+import pybullet as p
+
+import calvin_env
+from calvin_env.envs.calvin_env import get_env_from_cfg
+from calvin_env.envs.physics import PHYSICS_PROFILES
+
+"""
+Replays windows of a rendered dataset with every physics profile and reports
+- simulation throughput in control steps per second (physics only, no rendering)
+- which tasks were solved in each window and how often every profile agrees with the reference profile
+"""
+
+
+def load_windows(dataset_dir, num_windows, window_len):
+    dataset_dir = Path(dataset_dir)
+    ep_start_end_ids = np.sort(np.load(dataset_dir / "ep_start_end_ids.npy"), axis=0)
+    windows = []
+    for start, end in ep_start_end_ids:
+        for window_start in range(start, end + 1 - window_len, window_len):
+            frames = [
+                np.load(dataset_dir / f"episode_{i:07d}.npz") for i in range(window_start, window_start + window_len)
+            ]
+            actions = []
+            for frame in frames:
+                action = frame["actions"]
+                orn = p.getQuaternionFromEuler(action[3:6]) if len(action) == 7 else action[3:7]
+                actions.append(np.concatenate([action[:3], orn, action[-1:]]))
+            windows.append((frames[0]["robot_obs"], frames[0]["scene_obs"], np.array(actions)))
+            if len(windows) == num_windows:
+                return windows
+    return windows
+
+
+def replay(env, tasks, windows):
+    solved = []
+    num_steps, duration = 0, 0.0
+    for robot_obs, scene_obs, actions in windows:
+        env.reset(robot_obs=robot_obs, scene_obs=scene_obs, static=False)
+        start_info = env._get_info()
+        # the contacts of the start info are read after the simulation advanced
+        start_info["robot_info"].resolve()
+        t0 = time.time()
+        for action in actions:
+            env.robot.apply_action({"action": action, "type": "quat_abs"})
+            env._step_physics()
+            env.scene.step()
+        duration += time.time() - t0
+        num_steps += len(actions)
+        solved.append(tasks.get_task_info(start_info, env._get_info()))
+    return solved, num_steps / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark speed and task agreement of physics profiles")
+    parser.add_argument("dataset", type=str, help="rendered dataset dir with ep_start_end_ids.npy")
+    parser.add_argument("--num_windows", type=int, default=50)
+    parser.add_argument("--window_len", type=int, default=64)
+    parser.add_argument("--reference", type=str, default="accurate")
+    parser.add_argument("--profiles", type=str, nargs="+", default=list(PHYSICS_PROFILES.keys()))
+    args = parser.parse_args()
+
+    windows = load_windows(args.dataset, args.num_windows, args.window_len)
+    tasks_cfg = OmegaConf.load(Path(calvin_env.__file__).parent / "assets/conf/tasks/master_tasks.yaml")
+    tasks = hydra.utils.instantiate(tasks_cfg)
+
+    results = {}
+    for profile in dict.fromkeys([args.reference, *args.profiles]):
+        env = get_env_from_cfg(vis=False, physics_profile=profile, use_scene_info=True)
+        results[profile] = replay(env, tasks, windows)
+        env.close()
+
+    reference_solved, _ = results[args.reference]
+    print(f"{len(windows)} windows of {args.window_len} steps, reference profile: {args.reference}")
+    for profile, (solved, steps_per_sec) in results.items():
+        agreement = np.mean([a == b for a, b in zip(solved, reference_solved)])
+        num_solved = sum(len(s) for s in solved)
+        print(f"{profile:10s} {steps_per_sec:8.1f} steps/s  solved tasks {num_solved:4d}  agreement {agreement:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import timeit
+
+import numpy as np
+import pybullet as p
+
+from calvin_env.utils import pose
+
+"""
+Benchmarks the vectorized pose math in calvin_env.utils.pose against per-pose pybullet calls.
+
+For every conversion and batch size the pybullet version loops over the poses, the vectorized version converts the
+whole (N, k) array at once. Also reports the maximum deviation between both, rotations are compared as matrices since
+pybullet may return negated quaternions.
+"""
+
+
+def pybullet_angle(q1, q2):
+    return p.getAxisAngleFromQuaternion(p.getDifferenceQuaternion(q2, q1))[1]
+
+
+def pybullet_relative_pose(pos_a, orn_a, pos_b, orn_b):
+    return p.multiplyTransforms(*p.invertTransform(pos_a, orn_a), pos_b, orn_b)
+
+
+def get_cases(n, rng):
+    euler = rng.uniform(-np.pi, np.pi, (n, 3))
+    quat = pose.euler_to_quat(euler)
+    quat2 = pose.euler_to_quat(rng.uniform(-np.pi, np.pi, (n, 3)))
+    pos, pos2 = rng.normal(size=(n, 3)), rng.normal(size=(n, 3))
+    # the pybullet versions get tuples, like the poses returned by pybullet queries
+    quat_t, quat2_t, euler_t = [tuple(map(tuple, x.tolist())) for x in (quat, quat2, euler)]
+    pos_t, pos2_t = [tuple(map(tuple, x.tolist())) for x in (pos, pos2)]
+    if n == 1:
+        # single poses take the scalar code path
+        euler, quat, quat2, pos, pos2 = euler[0], quat[0], quat2[0], pos[0], pos2[0]
+    return {
+        "quat_to_euler": (
+            lambda: [p.getEulerFromQuaternion(q) for q in quat_t],
+            lambda: pose.quat_to_euler(quat),
+        ),
+        "euler_to_quat": (
+            lambda: [p.getQuaternionFromEuler(e) for e in euler_t],
+            lambda: pose.euler_to_quat(euler),
+        ),
+        "quat_to_matrix": (
+            lambda: [np.reshape(p.getMatrixFromQuaternion(q), (3, 3)) for q in quat_t],
+            lambda: pose.quat_to_matrix(quat),
+        ),
+        "quat_angle": (
+            lambda: [pybullet_angle(q1, q2) for q1, q2 in zip(quat_t, quat2_t)],
+            lambda: pose.quat_angle(quat, quat2),
+        ),
+        "relative_pose": (
+            lambda: [pybullet_relative_pose(*args) for args in zip(pos_t, quat_t, pos2_t, quat2_t)],
+            lambda: pose.relative_pose(pos, quat, pos2, quat2),
+        ),
+    }
+
+
+def max_deviation(name, reference, result):
+    if name == "relative_pose":
+        pos_err = np.abs(np.array([x[0] for x in reference]) - result[0]).max()
+        orn_err = np.abs(pose.quat_to_matrix([x[1] for x in reference]) - pose.quat_to_matrix(result[1])).max()
+        return max(pos_err, orn_err)
+    if name == "euler_to_quat":
+        return np.abs(pose.quat_to_matrix(reference) - pose.quat_to_matrix(result)).max()
+    if name == "quat_angle":
+        # pybullet does not fold the angle to [0, pi]
+        reference = np.pi - np.abs(np.pi - np.array(reference))
+    return np.abs(np.array(reference) - result).max()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark vectorized pose math against per-pose pybullet calls")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000])
+    parser.add_argument("--min_time", type=float, default=0.2, help="minimum measurement time per case in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'function':16s} {'N':>6s} {'pybullet':>12s} {'vectorized':>12s} {'speedup':>8s} {'max dev':>9s}")
+    for n in args.sizes:
+        for name, (reference_fn, vectorized_fn) in get_cases(n, rng).items():
+            times = []
+            for fn in (reference_fn, vectorized_fn):
+                number, _ = timeit.Timer(fn).autorange()
+                number = max(1, int(number * args.min_time / 0.2))
+                times.append(min(timeit.repeat(fn, number=number, repeat=3)) / number)
+            deviation = max_deviation(name, reference_fn(), vectorized_fn())
+            print(
+                f"{name:16s} {n:6d} {times[0] * 1e6:10.1f}us {times[1] * 1e6:10.1f}us "
+                f"{times[0] / times[1]:7.2f}x {deviation:9.1e}"
+            )
+
+
+if __name__ == "__main__":
+    main()
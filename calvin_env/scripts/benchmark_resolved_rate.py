@@ -0,0 +1,83 @@
+import argparse
+from pathlib import Path
+import time
+
+import numpy as np
+import pybullet as p
+
+from calvin_env.envs.calvin_env import get_env_from_cfg
+from calvin_env.utils.pose import euler_to_quat
+
+"""
+Compares the resolved-rate controller (quat_rel_rate) with the IK path (quat_rel) for the same relative actions.
+
+Reports the per-step controller latency, i.e. the time from the relative action to the joint motor commands, the
+fallback rate of the resolved-rate controller and the deviation of the resulting tcp trajectories.
+"""
+
+
+def load_rel_actions(dataset_dir, num_steps):
+    files = sorted(Path(dataset_dir).glob("episode_*.npz"))[:num_steps]
+    first = np.load(files[0])
+    actions = []
+    for file in files:
+        action = np.load(file)["rel_actions"]
+        orn = p.getQuaternionFromEuler(action[3:6]) if len(action) == 7 else action[3:7]
+        actions.append(np.concatenate([action[:3], orn, action[-1:]]))
+    return np.array(actions), first["robot_obs"], first["scene_obs"]
+
+
+def random_rel_actions(num_steps, seed):
+    rng = np.random.default_rng(seed)
+    # smooth random motion, relative actions are normalized to [-1, 1]
+    pos = np.clip(np.cumsum(rng.normal(0, 0.1, (num_steps, 3)), axis=0), -1, 1)
+    euler = np.clip(np.cumsum(rng.normal(0, 0.05, (num_steps, 3)), axis=0), -1, 1)
+    orn = euler_to_quat(euler)
+    gripper = np.where((np.arange(num_steps) // 30) % 2 == 0, 1, -1)[:, None]
+    return np.concatenate([pos, orn, gripper], axis=1), None, None
+
+
+def rollout(env, actions, action_mode, robot_obs, scene_obs):
+    env.reset(robot_obs=robot_obs, scene_obs=scene_obs, static=False)
+    tcp, latency = [], []
+    for action in actions:
+        t0 = time.perf_counter()
+        env.robot.apply_action({"action": action, "type": action_mode})
+        latency.append(time.perf_counter() - t0)
+        env._step_physics()
+        env.scene.step()
+        tcp.append(env.robot.get_observation()[0][:3])
+    return np.array(tcp), np.array(latency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the resolved-rate controller against per-step IK")
+    parser.add_argument("--dataset", type=str, default=None, help="rendered episode dir, random actions if unset")
+    parser.add_argument("--num_steps", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.dataset is not None:
+        actions, robot_obs, scene_obs = load_rel_actions(args.dataset, args.num_steps)
+    else:
+        actions, robot_obs, scene_obs = random_rel_actions(args.num_steps, args.seed)
+
+    env = get_env_from_cfg(vis=False)
+    ik_tcp, ik_latency = rollout(env, actions, "quat_rel", robot_obs, scene_obs)
+    env.robot.resolved_rate.reset_stats()
+    rr_tcp, rr_latency = rollout(env, actions, "quat_rel_rate", robot_obs, scene_obs)
+    stats = env.robot.resolved_rate.get_stats()
+    env.close()
+
+    for name, latency in [("quat_rel (IK)", ik_latency), ("quat_rel_rate", rr_latency)]:
+        print(
+            f"{name:15s} latency mean {latency.mean() * 1e6:8.1f} us  "
+            f"p50 {np.percentile(latency, 50) * 1e6:8.1f} us  p99 {np.percentile(latency, 99) * 1e6:8.1f} us"
+        )
+    print(f"speedup {ik_latency.mean() / rr_latency.mean():.2f}x, fallback rate {stats['fallback_rate']:.3f}")
+    deviation = np.linalg.norm(ik_tcp - rr_tcp, axis=1)
+    print(f"tcp deviation between modes: max {deviation.max():.4f} m  mean {deviation.mean():.4f} m")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+from pathlib import Path
+import time
+
+import numpy as np
+
+from calvin_env.envs.calvin_env import get_env_from_cfg
+from calvin_env.planning.reachability import DEFAULT_BOUNDS, DEFAULT_CACHE_DIR, default_orientations, ReachabilityMap
+
+"""
+Builds the reachability map of the robot over the table workspace offline.
+
+IK is solved for every voxel center and gripper orientation in parallel, the map is written to the reachability cache
+and can be used by setting robot.reachability_map to the printed file. Afterwards random poses in the workspace are
+looked up and solved with IK, to report the query time and how often the map agrees with IK.
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="build the reachability map of the robot over the table workspace")
+    parser.add_argument("--voxel_size", type=float, default=0.04)
+    parser.add_argument("--lower", type=float, nargs=3, default=DEFAULT_BOUNDS[0])
+    parser.add_argument("--upper", type=float, nargs=3, default=DEFAULT_BOUNDS[1])
+    parser.add_argument("--num_yaw", type=int, default=8, help="number of top-down gripper orientations")
+    parser.add_argument("--num_workers", type=int, default=4)
+    parser.add_argument("--cache_dir", type=str, default=str(DEFAULT_CACHE_DIR))
+    parser.add_argument("--num_queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    env = get_env_from_cfg(vis=False)
+    env.reset()
+    robot = env.robot
+    client_kwargs = robot.get_kinematics_client_kwargs()
+    bounds = (args.lower, args.upper)
+    orientations = default_orientations(args.num_yaw)
+    key = ReachabilityMap.cache_key(client_kwargs, bounds, args.voxel_size, orientations)
+    filename = Path(args.cache_dir) / f"reachability_{key}.npz"
+    if filename.is_file():
+        reachability_map = ReachabilityMap.load(filename)
+        print(f"loaded {filename}")
+    else:
+        reachability_map = ReachabilityMap.build(
+            client_kwargs,
+            robot.get_kinematics(),
+            robot.initial_joint_positions,
+            bounds,
+            args.voxel_size,
+            orientations,
+            args.num_workers,
+            key,
+        )
+        reachability_map.save(filename)
+        print(f"saved {filename}")
+    num_cells = f"{reachability_map.shape} x {len(orientations)}"
+    print(f"grid of {num_cells} voxels x orientations, {reachability_map.reachable.mean():.1%} reachable")
+
+    rng = np.random.default_rng(args.seed)
+    positions = rng.uniform(args.lower, args.upper, (args.num_queries, 3))
+    cells = rng.integers(len(orientations), size=args.num_queries)
+    t0 = time.time()
+    results = [reachability_map.query(pos, orientations[k]) for pos, k in zip(positions, cells)]
+    query_time = (time.time() - t0) / args.num_queries
+    agree, seeded_ik, rest_ik = 0, 0, 0
+    for pos, k, (reachable, _, solution) in zip(positions, cells, results):
+        pose = np.concatenate([pos, orientations[k]])[None]
+        _, success = robot.solve_ik_batch(pose, seed=robot.initial_joint_positions)
+        agree += reachable == success[0]
+        rest_ik += success[0]
+        if solution is not None:
+            seeded_ik += robot.solve_ik_batch(pose, seed=solution)[1][0]
+    print(f"query time: {query_time * 1e6:.1f}us")
+    print(f"map agrees with IK from the rest pose for {agree} of {args.num_queries} poses")
+    print(f"IK successes: {rest_ik} seeded with the rest pose, {seeded_ik} seeded with the stored solution")
+
+    env.close()
+
+
+if __name__ == "__main__":
+    main()
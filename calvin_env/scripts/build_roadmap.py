@@ -0,0 +1,53 @@
+import argparse
+import time
+
+import numpy as np
+
+from calvin_env.envs.calvin_env import get_env_from_cfg
+from calvin_env.planning.collision import CollisionWorld
+from calvin_env.planning.roadmap import DEFAULT_CACHE_DIR, Roadmap
+
+"""
+Builds the planning roadmap of the static scene offline and stores it in the roadmap cache.
+
+Afterwards answers random queries between valid configurations in the current scene state, to report roadmap query
+times and how many queries the roadmap answers without falling back to RRT-Connect.
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="build and test the planning roadmap of the static scene")
+    parser.add_argument("--num_nodes", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--resolution", type=float, default=0.05)
+    parser.add_argument("--cache_dir", type=str, default=str(DEFAULT_CACHE_DIR))
+    parser.add_argument("--num_queries", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    env = get_env_from_cfg(vis=False)
+    env.reset()
+    world = CollisionWorld.from_env(env)
+    t0 = time.time()
+    roadmap = Roadmap.load_or_build(world, args.num_nodes, args.k, args.resolution, args.seed, args.cache_dir)
+    print(f"roadmap with {len(roadmap.nodes)} nodes and {len(roadmap.edges)} edges ready in {time.time() - t0:.1f}s")
+
+    rng = np.random.default_rng(args.seed + 1)
+    times, solved = [], 0
+    for _ in range(args.num_queries):
+        qs = rng.uniform(world.lower_limits, world.upper_limits, (100, world.num_dof))
+        start, goal = qs[world.check_configs(qs)][:2]
+        t0 = time.time()
+        path, _ = roadmap.query(world, start, goal, args.k, args.resolution)
+        times.append(time.time() - t0)
+        solved += path is not None
+    times = np.array(times) * 1000
+    print(f"solved {solved} of {args.num_queries} queries")
+    print(f"query time: mean {times.mean():.1f}ms, median {np.median(times):.1f}ms, max {times.max():.1f}ms")
+
+    world.close()
+    env.close()
+
+
+if __name__ == "__main__":
+    main()
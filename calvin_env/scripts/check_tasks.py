@@ -55,6 +55,8 @@ def run_env(cfg):
             # env.render()
             env.reset(scene_obs=data["scene_obs"], robot_obs=data["robot_obs"])
             start_info = env.get_info()
+            # the contacts of the start info are read after the simulation advanced
+            start_info["robot_info"].resolve()
             cv2.imshow("keylistener", np.zeros((300, 300)))
             k = cv2.waitKey(0) % 256
             if k == ord("a"):
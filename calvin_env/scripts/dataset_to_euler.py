@@ -2,9 +2,10 @@ from pathlib import Path
 from shutil import copyfile, copytree
 
 import numpy as np
-import pybullet as p
 from tqdm import tqdm
 
+from calvin_env.utils.pose import quat_to_euler
+
 load_path = Path("/home/hermannl/phd/data/banana_dataset_01_29/validation")
 
 save_path = Path("/home/hermannl/phd/data/banana_dataset_01_29_euler/validation")
@@ -13,14 +14,14 @@ save_path.mkdir(parents=True, exist_ok=True)
 for file in tqdm(load_path.glob("*.npz")):
     data = np.load(file)
     robot_obs = data["robot_obs"]
-    robot_obs_euler = np.concatenate([robot_obs[:3], p.getEulerFromQuaternion(robot_obs[3:7]), robot_obs[7:]])
+    robot_obs_euler = np.concatenate([robot_obs[:3], quat_to_euler(robot_obs[3:7]), robot_obs[7:]])
     scene_obs = data["scene_obs"]
-    scene_obs_euler = scene_obs[:3]
-    for i in range(6):
-        scene_obs_euler = np.append(scene_obs_euler, scene_obs[3 + i * 7 : 3 + i * 7 + 3])
-        scene_obs_euler = np.append(scene_obs_euler, p.getEulerFromQuaternion(scene_obs[3 + i * 7 + 3 : 3 + i * 7 + 7]))
+    # 6 object poses (position, quaternion) after the 3 scalar states, converted at once
+    object_poses = scene_obs[3 : 3 + 6 * 7].reshape(6, 7)
+    object_poses_euler = np.concatenate([object_poses[:, :3], quat_to_euler(object_poses[:, 3:])], axis=1)
+    scene_obs_euler = np.concatenate([scene_obs[:3], object_poses_euler.flatten()])
     actions = data["actions"]
-    actions_euler = np.concatenate([actions[:3], p.getEulerFromQuaternion(actions[3:7]), actions[7:]])
+    actions_euler = np.concatenate([actions[:3], quat_to_euler(actions[3:7]), actions[7:]])
     data_euler = dict(data.items())
     data_euler["robot_obs"] = robot_obs_euler
     data_euler["scene_obs"] = scene_obs_euler
@@ -0,0 +1,81 @@
+import argparse
+
+import numpy as np
+import pybullet as p
+
+from calvin_env.envs.calvin_env import get_env_from_cfg
+
+"""
+Regression check for the robot motor commands.
+
+Drives the robot with a seeded sequence of joint and Cartesian actions, gripper toggles, resets to an observation,
+resets to the initial pose and restores a serialized state, and records the joint states after every step.
+Record a reference with one version of the code and check another version against it, e.g.
+
+    python motor_command_regression.py record reference.npz   # before a change
+    python motor_command_regression.py check reference.npz    # after a change
+
+The check passes only if all joint positions and velocities are bitwise identical.
+"""
+
+
+def rollout(num_steps, seed):
+    env = get_env_from_cfg(vis=False)
+    env.reset()
+    robot = env.robot
+    rng = np.random.default_rng(seed)
+    joint_states = []
+    stored = None
+    for t in range(num_steps):
+        gripper = 1 if (t // 40) % 2 else -1
+        if t % 3 == 0:
+            action = np.concatenate([rng.uniform(-0.05, 0.05, 7), [gripper]])
+            action_mode = "joint_rel"
+        else:
+            orn = p.getQuaternionFromEuler(rng.uniform(-0.3, 0.3, 3))
+            action = np.concatenate([rng.uniform(-1, 1, 3), orn, [gripper]])
+            action_mode = "quat_rel"
+        robot.apply_action({"action": action, "type": action_mode})
+        env._step_physics()
+        if t == num_steps // 4:
+            stored = robot.serialize()
+        elif t == num_steps // 2:
+            robot.reset_from_storage(stored)
+        elif t == 3 * num_steps // 4:
+            robot.reset(robot.get_observation()[0])
+        elif t == 7 * num_steps // 8:
+            robot.reset()
+        states = p.getJointStates(
+            robot.robot_uid, range(p.getNumJoints(robot.robot_uid, physicsClientId=env.cid)), physicsClientId=env.cid
+        )
+        joint_states.append([state[:2] for state in states])
+    env.close()
+    return np.array(joint_states)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="record or check joint trajectories driven by the motor commands")
+    parser.add_argument("mode", choices=["record", "check"])
+    parser.add_argument("file", type=str, help="npz file with the reference trajectory")
+    parser.add_argument("--num_steps", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.mode == "record":
+        joint_states = rollout(args.num_steps, args.seed)
+        np.savez(args.file, joint_states=joint_states, num_steps=args.num_steps, seed=args.seed)
+        print(f"recorded {len(joint_states)} steps to {args.file}")
+        return
+
+    reference = np.load(args.file)
+    joint_states = rollout(int(reference["num_steps"]), int(reference["seed"]))
+    mismatch = np.any(joint_states != reference["joint_states"], axis=(1, 2))
+    if mismatch.any():
+        first = np.argmax(mismatch)
+        max_diff = np.abs(joint_states - reference["joint_states"]).max()
+        raise SystemExit(f"trajectories differ from step {first} on, max abs diff {max_diff}")
+    print(f"{len(joint_states)} steps bitwise identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -84,7 +84,7 @@ def run_env(cfg):
             action = np.split(data["actions"], [3, 6])
             action = noise(action)
 
-            rel_actions.append(utils.to_relative_action(data["actions"], data["robot_obs"][:6]))
+            rel_actions.append(utils.to_relative_actions(data["actions"], data["robot_obs"][:6]))
             # action = utils.to_relative_action(data["actions"], data["robot_obs"], max_pos=0.04, max_orn=0.1)
             # tcp_pos, tcp_orn = p.getLinkState(env.robot.robot_uid, env.robot.tcp_link_id, physicsClientId=env.cid)[:2]
             # tcp_orn = p.getEulerFromQuaternion(tcp_orn)
@@ -42,20 +42,25 @@ for subdir in ["training", "validation"]:
     new_ep_start_end_ids = []
 
     for start, end in tqdm(ep_start_end_ids):
+        # np.load is lazy, only the low-dimensional arrays are read in this first pass
+        low_dim = []
+        for old_i in range(start, end + 1):
+            with np.load(src_path / subdir / f"episode_{old_i:06d}.npz") as data:
+                low_dim.append((data["actions"], data["robot_obs"]))
+        actions, robot_obs = map(np.stack, zip(*low_dim))
+        # the action of every kept frame is the action of the next (skipped) frame
+        next_actions = np.concatenate([actions[1:], actions[-1:]])
+        rel_actions = utils.to_relative_actions(
+            next_actions, robot_obs, max_pos=args.max_rel_pos, max_orn=args.max_rel_orn
+        )
 
-        ep_len = end - start + 1
         for offset in (0, 1):
             new_start = new_i
             for old_i in range(start + offset, end + 1, 2):
-                old_data = np.load(src_path / subdir / f"episode_{old_i:06d}.npz")
-                data = dict(old_data)
+                data = dict(np.load(src_path / subdir / f"episode_{old_i:06d}.npz"))
                 if old_i < end:
-                    next_old_data = np.load(src_path / subdir / f"episode_{old_i + 1:06d}.npz")
-                    next_data = dict(next_old_data)
-                    data["actions"] = next_data["actions"]
-                    data["rel_actions"] = utils.to_relative_action(
-                        data["actions"], data["robot_obs"], max_pos=args.max_rel_pos, max_orn=args.max_rel_orn
-                    )
+                    data["actions"] = next_actions[old_i - start]
+                    data["rel_actions"] = rel_actions[old_i - start]
                 np.savez(dest_path / subdir / f"episode_{new_i:06d}.npz", **data)
                 new_i += 1
             new_end = new_i - 1
@@ -0,0 +1,57 @@
+import argparse
+from pathlib import Path
+
+import hydra
+import numpy as np
+from omegaconf import OmegaConf
+import pybullet as p
+
+import calvin_env
+from calvin_env.envs.calvin_env import get_env_from_cfg
+
+"""
+Shows which robot_info fields are accessed in a typical rollout.
+
+Steps the environment with random relative actions and, like the evaluation loop, checks the solved tasks against
+the info of the first step after every step. Reports how often every robot_info field was looked up and how often
+the lazy fields (contacts, gripper view matrix) actually had to be computed.
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="count robot_info field accesses during a rollout")
+    parser.add_argument("--num_steps", type=int, default=200)
+    parser.add_argument("--no_tasks", action="store_true", help="do not check tasks after every step")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    env = get_env_from_cfg(vis=False, use_scene_info=True)
+    tasks = None
+    if not args.no_tasks:
+        tasks_cfg = OmegaConf.load(Path(calvin_env.__file__).parent / "assets/conf/tasks/master_tasks.yaml")
+        tasks = hydra.utils.instantiate(tasks_cfg)
+
+    rng = np.random.default_rng(args.seed)
+    _, _, _, start_info = env.reset()
+    # the task checks read the start contacts after the simulation advanced
+    start_info["robot_info"].resolve()
+    env.robot.track_info_access()
+    for t in range(args.num_steps):
+        orn = p.getQuaternionFromEuler(rng.uniform(-0.5, 0.5, 3))
+        action = np.concatenate([rng.uniform(-1, 1, 3), orn, [1 if (t // 50) % 2 else -1]])
+        _, _, _, info = env.step(action, "quat_rel")
+        if tasks is not None:
+            tasks.get_task_info(start_info, info)
+    access_counts = env.robot.info_access_counts
+    compute_counts = env.robot.info_compute_counts
+    env.close()
+
+    print(f"robot_info accesses in {args.num_steps} steps")
+    for key, count in sorted(access_counts.items(), key=lambda x: -x[1]):
+        print(f"{key:26s} {count:6d}  ({count / args.num_steps:.2f} per step)")
+    for key in ("contacts", "gripper_view_matrix"):
+        print(f"{key} computed {compute_counts[key]} times ({compute_counts[key] / args.num_steps:.2f} per step)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+from pathlib import Path
+import time
+
+import numpy as np
+import pybullet as p
+
+from calvin_env.envs.calvin_env import get_env_from_cfg
+
+"""
+Compares trajectories simulated with adaptive physics substepping against a fixed-step baseline.
+
+Both environments are reset to the same state and driven with the same action sequence, either the absolute actions
+of a rendered episode or random joint space actions. Reports joint, tcp and scene deviations per step and the speedup.
+"""
+
+
+def load_episode_actions(dataset_dir, num_steps):
+    files = sorted(Path(dataset_dir).glob("episode_*.npz"))[:num_steps]
+    first = np.load(files[0])
+    actions = []
+    for file in files:
+        action = np.load(file)["actions"]
+        orn = p.getQuaternionFromEuler(action[3:6]) if len(action) == 7 else action[3:7]
+        actions.append(np.concatenate([action[:3], orn, action[-1:]]))
+    return np.array(actions), "quat_abs", first["robot_obs"], first["scene_obs"]
+
+
+def random_joint_actions(num_steps, seed):
+    rng = np.random.default_rng(seed)
+    joint_deltas = np.cumsum(rng.normal(0, 0.005, (num_steps, 7)), axis=0).clip(-0.05, 0.05)
+    gripper = np.where((np.arange(num_steps) // 30) % 2 == 0, 1, -1)[:, None]
+    return np.concatenate([joint_deltas, gripper], axis=1), "joint_rel", None, None
+
+
+def rollout(env, actions, action_mode, robot_obs, scene_obs):
+    env.reset(robot_obs=robot_obs, scene_obs=scene_obs, static=False)
+    joints, tcp, scene = [], [], []
+    t0 = time.time()
+    for action in actions:
+        env.robot.apply_action({"action": action, "type": action_mode})
+        env._step_physics()
+        env.scene.step()
+        robot_state, robot_info = env.robot.get_observation()
+        joints.append(robot_info["arm_joint_positions"])
+        tcp.append(robot_info["tcp_pos"])
+        scene.append(env.scene.get_obs())
+    duration = time.time() - t0
+    return np.array(joints), np.array(tcp), np.array(scene), duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="validate adaptive substepping against a fixed-step baseline")
+    parser.add_argument("--dataset", type=str, default=None, help="rendered episode dir, random actions if unset")
+    parser.add_argument("--num_steps", type=int, default=300)
+    parser.add_argument("--baseline_time_step", type=float, default=480.0, help="fixed bullet_time_step in Hz")
+    parser.add_argument("--free_time_step", type=float, default=1 / 120)
+    parser.add_argument("--contact_time_step", type=float, default=1 / 480)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.dataset is not None:
+        actions, action_mode, robot_obs, scene_obs = load_episode_actions(args.dataset, args.num_steps)
+    else:
+        actions, action_mode, robot_obs, scene_obs = random_joint_actions(args.num_steps, args.seed)
+
+    baseline_env = get_env_from_cfg(vis=False, bullet_time_step=args.baseline_time_step, adaptive_substepping=None)
+    baseline = rollout(baseline_env, actions, action_mode, robot_obs, scene_obs)
+    baseline_env.close()
+
+    adaptive_cfg = {"free_time_step": args.free_time_step, "contact_time_step": args.contact_time_step}
+    adaptive_env = get_env_from_cfg(vis=False, adaptive_substepping=adaptive_cfg)
+    adaptive = rollout(adaptive_env, actions, action_mode, robot_obs, scene_obs)
+    stats = adaptive_env.substepper.get_stats()
+    adaptive_env.close()
+
+    for name, ref, test in zip(["joint [rad]", "tcp [m]", "scene"], baseline[:3], adaptive[:3]):
+        err = np.abs(ref - test).max(axis=1)
+        print(f"{name:12s} max err {err.max():.5f}  mean err {err.mean():.5f}  final err {err[-1]:.5f}")
+    print(f"baseline: {len(actions) / baseline[3]:.1f} control steps/s")
+    print(f"adaptive: {len(actions) / adaptive[3]:.1f} control steps/s ({stats})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+from pathlib import Path
+import time
+
+import numpy as np
+import pybullet as p
+
+import calvin_env
+from calvin_env.robot.kinematics import RobotKinematics
+
+"""
+Validates the numpy forward kinematics and Jacobians against pybullet for random arm configurations.
+
+Reports the max deviation of tcp, end effector and gripper camera poses and of the tcp Jacobian, and the time per
+configuration of both implementations. Exits with an error if any deviation exceeds the tolerance.
+"""
+
+
+def main():
+    default_urdf = Path(calvin_env.__file__).parent / "assets/data/franka_panda/panda_longer_finger.urdf"
+    parser = argparse.ArgumentParser(description="validate numpy forward kinematics against pybullet")
+    parser.add_argument("--urdf", type=str, default=default_urdf.as_posix())
+    parser.add_argument("--base_position", type=float, nargs=3, default=[-0.34, -0.46, 0.24])
+    parser.add_argument("--base_orientation", type=float, nargs=3, default=[0, 0, 0], help="euler angles")
+    parser.add_argument("--num_samples", type=int, default=1000)
+    parser.add_argument("--tolerance", type=float, default=1e-6)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    base_orientation = p.getQuaternionFromEuler(args.base_orientation)
+    cid = p.connect(p.DIRECT)
+    robot_uid = p.loadURDF(args.urdf, args.base_position, base_orientation, useFixedBase=True, physicsClientId=cid)
+    joint_infos = [
+        p.getJointInfo(robot_uid, i, physicsClientId=cid) for i in range(p.getNumJoints(robot_uid, physicsClientId=cid))
+    ]
+    link_ids = {info[12].decode(): i for i, info in enumerate(joint_infos)}
+    joint_ids = {info[1].decode(): i for i, info in enumerate(joint_infos)}
+    movable_ids = [i for i, info in enumerate(joint_infos) if info[2] != p.JOINT_FIXED]
+    kinematics = RobotKinematics(args.urdf, args.base_position, base_orientation)
+    arm_ids = [joint_ids[name] for name in kinematics.arm_joint_names]
+    lower = np.array([p.getJointInfo(robot_uid, i, physicsClientId=cid)[8] for i in arm_ids])
+    upper = np.array([p.getJointInfo(robot_uid, i, physicsClientId=cid)[9] for i in arm_ids])
+    q = np.random.default_rng(args.seed).uniform(lower, upper, (args.num_samples, kinematics.num_dof))
+
+    t0 = time.time()
+    poses = kinematics.get_poses(q)
+    jacobians = kinematics.jacobian(q)
+    numpy_time = time.time() - t0
+
+    links = {
+        "tcp": kinematics.tcp_link,
+        "end_effector": kinematics.end_effector_link,
+        "gripper_cam": kinematics.camera_link,
+    }
+    errors = {key: 0.0 for key in [*links, "jacobian"]}
+    t0 = time.time()
+    for i, q_i in enumerate(q):
+        for joint_id, value in zip(arm_ids, q_i):
+            p.resetJointState(robot_uid, joint_id, value, physicsClientId=cid)
+        for key, link in links.items():
+            state = p.getLinkState(robot_uid, link_ids[link], computeForwardKinematics=True, physicsClientId=cid)
+            orn = poses[key][i, 3:]
+            # q and -q encode the same rotation
+            orn = orn if np.dot(orn, state[5]) >= 0 else -orn
+            error = max(np.abs(poses[key][i, :3] - state[4]).max(), np.abs(orn - state[5]).max())
+            errors[key] = max(errors[key], error)
+        all_q = [p.getJointState(robot_uid, j, physicsClientId=cid)[0] for j in movable_ids]
+        linear, angular = p.calculateJacobian(
+            robot_uid,
+            link_ids[kinematics.tcp_link],
+            [0, 0, 0],
+            all_q,
+            [0.0] * len(movable_ids),
+            [0.0] * len(movable_ids),
+            physicsClientId=cid,
+        )
+        columns = [movable_ids.index(j) for j in arm_ids]
+        jacobian = np.concatenate([np.array(linear)[:, columns], np.array(angular)[:, columns]])
+        errors["jacobian"] = max(errors["jacobian"], np.abs(jacobian - jacobians[i]).max())
+    bullet_time = time.time() - t0
+    p.disconnect(physicsClientId=cid)
+
+    for key, error in errors.items():
+        print(f"{key:14s} max err {error:.2e}")
+    print(f"numpy:   {numpy_time / args.num_samples * 1e6:8.2f} us per configuration (fk + jacobian)")
+    print(f"pybullet: {bullet_time / args.num_samples * 1e6:8.2f} us per configuration (fk + jacobian)")
+    if max(errors.values()) > args.tolerance:
+        raise SystemExit(f"deviation exceeds tolerance {args.tolerance}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import time
+
+import numpy as np
+import pybullet as p
+
+from calvin_env.envs.calvin_env import get_env_from_cfg
+from calvin_env.planning.collision import CollisionWorld
+from calvin_env.planning import sdf
+from calvin_env.planning.spheres import SphereCollisionChecker
+
+"""
+Validates the sphere / signed distance field collision checker against pybullet.
+
+For random arm configurations the sphere clearance to the fixed scene is compared with the closest distance pybullet
+reports between the robot and the fixed bodies. The sphere model must never report a configuration as free that
+pybullet reports in collision (false negatives), and its clearance should only overestimate the pybullet distance by
+the interpolation error of the field, which the margin has to cover. Also reports the time per configuration of both.
+"""
+
+
+def pybullet_clearance(world, fixed_uids, q, max_distance):
+    world.set_arm(q)
+    distance = max_distance
+    for uid in fixed_uids:
+        for contact in p.getClosestPoints(world.robot_uid, uid, max_distance, physicsClientId=world.cid):
+            if contact[3] not in world.static_robot_links:
+                distance = min(distance, contact[8])
+    return distance
+
+
+def main():
+    parser = argparse.ArgumentParser(description="validate sphere collision checks against pybullet")
+    parser.add_argument("--num_configs", type=int, default=5000)
+    parser.add_argument("--resolution", type=float, default=0.02, help="grid spacing of the distance fields")
+    parser.add_argument("--margin", type=float, default=0.01)
+    parser.add_argument("--cache_dir", type=str, default=str(sdf.DEFAULT_CACHE_DIR))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    env = get_env_from_cfg(vis=False)
+    env.reset()
+    world = CollisionWorld.from_env(env)
+    t0 = time.time()
+    checker = SphereCollisionChecker.from_world(
+        world, resolution=args.resolution, margin=args.margin, cache_dir=args.cache_dir
+    )
+    print(f"sphere model with {len(checker.spheres.radii)} spheres built in {time.time() - t0:.2f}s")
+    print(f"interpolation backend: {'numba' if sdf.numba is not None else 'numpy'}")
+    fixed_uids = checker.fixed_uids
+
+    rng = np.random.default_rng(args.seed)
+    qs = rng.uniform(world.lower_limits, world.upper_limits, (args.num_configs, world.num_dof))
+    checker.clearance(qs[:1])  # compile the numba kernel outside of the measurement
+    t0 = time.time()
+    clearance = checker.clearance(qs)
+    sphere_time = (time.time() - t0) / len(qs)
+    t0 = time.time()
+    reference = np.array([pybullet_clearance(world, fixed_uids, q, 0.1) for q in qs])
+    pybullet_time = (time.time() - t0) / len(qs)
+
+    in_collision = reference < 0
+    sphere_free = clearance > args.margin
+    near = reference < 0.1
+    error = clearance[near] - reference[near]
+    print(f"time per configuration: spheres {sphere_time * 1e6:.1f}us, pybullet {pybullet_time * 1e6:.1f}us")
+    print(f"pybullet collisions: {in_collision.sum()} of {len(qs)}")
+    print(f"sphere collisions (margin {args.margin}): {(~sphere_free).sum()}")
+    print(f"false negatives: {(in_collision & sphere_free).sum()}")
+    print(f"false positives: {(~in_collision & ~sphere_free).sum()}")
+    print(f"clearance overestimate: max {error.max() * 1000:.1f}mm (must stay below the margin)")
+    print(f"clearance underestimate: mean {-error.mean() * 1000:.1f}mm")
+
+    world.close()
+    env.close()
+
+
+if __name__ == "__main__":
+    main()
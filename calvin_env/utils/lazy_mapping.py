@@ -0,0 +1,47 @@
+from collections.abc import Mapping
+
+
+class LazyMapping(Mapping):
+    """
+    Read-only mapping in which some values are only computed on first access.
+
+    Args:
+        values: eagerly computed entries.
+        lazy: key -> zero-argument callable computing the entry.
+        access_counts: optional collections.Counter, every key lookup is counted in it.
+    """
+
+    def __init__(self, values, lazy, access_counts=None):
+        self._values = dict(values)
+        self._lazy = dict(lazy)
+        self.access_counts = access_counts
+
+    def __getitem__(self, key):
+        if self.access_counts is not None:
+            self.access_counts[key] += 1
+        if key not in self._values and key in self._lazy:
+            self._values[key] = self._lazy.pop(key)()
+        return self._values[key]
+
+    def __iter__(self):
+        # iterate over a snapshot, lookups during iteration move entries from _lazy to _values
+        return iter([*self._values, *self._lazy])
+
+    def __len__(self):
+        return len(self._values) + len(self._lazy)
+
+    def __contains__(self, key):
+        return key in self._values or key in self._lazy
+
+    def resolve(self):
+        """Compute all pending entries."""
+        for key in list(self._lazy):
+            self._values[key] = self._lazy.pop(key)()
+
+    def __reduce__(self):
+        # pickle and deepcopy as a plain dict, the callables usually reference the simulation
+        self.resolve()
+        return dict, (self._values,)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._values}, pending={list(self._lazy)})"
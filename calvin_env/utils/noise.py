@@ -1,8 +1,27 @@
-from typing import Tuple
+from typing import Sequence, Tuple
 import numpy as np
 
 
+def make_rng(seed=None, worker_id: int = 0) -> np.random.Generator:
+    """
+    Random generator for one worker, independent of the generators of the other workers.
+
+    Gives the same stream as np.random.SeedSequence(seed).spawn(num_workers)[worker_id], so vectorized environments
+    are reproducible no matter in which process a worker runs.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(worker_id,)))
+
+
+def spawn_rngs(seed, num_workers: int):
+    return [make_rng(seed, worker_id) for worker_id in range(num_workers)]
+
+
 class NoiseModel(object):
+    def __init__(self, rng: np.random.Generator = None):
+        self.rng = rng if rng is not None else make_rng()
+
+    def seed(self, rng: np.random.Generator):
+        self.rng = rng
 
     def apply(self, val: np.ndarray) -> np.ndarray:
         raise NotImplementedError()
@@ -13,14 +32,117 @@ class Identity(NoiseModel):
         return val
 
 
-class GaussianNoise(NoiseModel):
+class _NormalBlock:
+    """
+    Prefetches standard normal samples of a fixed size in blocks, i.e. one generator call per block_size draws.
+
+    Generators fill arrays sequentially, so the samples are the same as with one generator call per draw.
+    """
+
+    def __init__(self, size, block_size):
+        self.size = size
+        self.block_size = block_size
+        self._block = None
+        self._index = block_size
 
-    def __init__(self, variance, min_max_clip: Tuple[float, float] = None):
+    def next(self, rng: np.random.Generator):
+        if self._index == self.block_size:
+            self._block = rng.standard_normal((self.block_size, self.size))
+            self._index = 0
+        sample = self._block[self._index]
+        self._index += 1
+        return sample
+
+
+class GaussianNoise(NoiseModel):
+    def __init__(
+        self,
+        variance,
+        min_max_clip: Tuple[float, float] = None,
+        rng: np.random.Generator = None,
+        block_size: int = 256,
+    ):
+        super().__init__(rng)
         self._variance = variance
         self._min_max_clip = min_max_clip
+        self._block_size = block_size
+        self._samples = None
+
+    def seed(self, rng: np.random.Generator):
+        super().seed(rng)
+        # drop samples prefetched from the previous generator
+        self._samples = None
 
     def apply(self, val: np.ndarray):
-        val += np.random.normal(0.0, scale=self._variance, size=val.shape)
+        val = np.asarray(val, dtype=float)
+        if self._samples is None or self._samples.size != val.size:
+            self._samples = _NormalBlock(val.size, self._block_size)
+        val = val + self._variance * self._samples.next(self.rng).reshape(val.shape)
         if self._min_max_clip is not None:
             val = np.clip(val, *self._min_max_clip)
         return val
+
+
+class PackedNoise(NoiseModel):
+    """
+    Applies the noise models of several fields to one packed array with a single draw and a single clip.
+
+    Args:
+        models: noise model of every field, only Identity and GaussianNoise can be packed.
+        sizes: number of entries of every field in the packed array.
+        rng: random generator, replaces the generators of the individual models.
+        block_size: number of draws prefetched with one generator call.
+    """
+
+    def __init__(
+        self,
+        models: Sequence[NoiseModel],
+        sizes: Sequence[int],
+        rng: np.random.Generator = None,
+        block_size: int = 256,
+    ):
+        super().__init__(rng)
+        scale, low, high = [], [], []
+        for model, size in zip(models, sizes):
+            if isinstance(model, GaussianNoise):
+                clip = model._min_max_clip if model._min_max_clip is not None else (-np.inf, np.inf)
+                scale.append(np.full(size, model._variance, dtype=float))
+                low.append(np.full(size, clip[0], dtype=float))
+                high.append(np.full(size, clip[1], dtype=float))
+            elif type(model) is Identity:
+                scale.append(np.zeros(size))
+                low.append(np.full(size, -np.inf))
+                high.append(np.full(size, np.inf))
+            else:
+                raise ValueError(f"Cannot pack noise model {type(model).__name__}")
+        self.sizes = list(sizes)
+        ends = np.cumsum(self.sizes).tolist()
+        self._slices = [slice(end - size, end) for size, end in zip(self.sizes, ends)]
+        self._scale = np.concatenate(scale)
+        self._low = np.concatenate(low)
+        self._high = np.concatenate(high)
+        self._noisy = np.flatnonzero(self._scale)
+        self._noisy_scale = self._scale[self._noisy]
+        self._clip = bool(np.isfinite(self._low).any() or np.isfinite(self._high).any())
+        self._block_size = block_size
+        self._samples = _NormalBlock(len(self._noisy), block_size)
+
+    def seed(self, rng: np.random.Generator):
+        super().seed(rng)
+        self._samples = _NormalBlock(len(self._noisy), self._block_size)
+
+    def apply(self, val: np.ndarray):
+        """Return a noisy copy of the packed (sum(sizes),) array."""
+        return self._apply(np.array(val, dtype=float))
+
+    def _apply(self, val):
+        if len(self._noisy):
+            val[self._noisy] += self._noisy_scale * self._samples.next(self.rng)
+        if self._clip:
+            np.clip(val, self._low, self._high, out=val)
+        return val
+
+    def apply_fields(self, *fields):
+        """Pack the fields, apply the noise and return the noisy fields."""
+        noisy = self._apply(np.concatenate(fields, dtype=float))
+        return [noisy[s] for s in self._slices]
@@ -0,0 +1,314 @@
+"""
+Vectorized pose math.
+
+All functions accept a single pose or a batch, i.e. arrays of shape (k,) or (..., k), and return arrays with the same
+leading dimensions. The conventions follow pybullet: quaternions are (x, y, z, w), euler angles are (roll, pitch, yaw)
+with R = Rz(yaw) @ Ry(pitch) @ Rx(roll), and flattened rotation matrices are row-major as returned by
+p.getMatrixFromQuaternion.
+
+Single poses take a scalar code path since numpy overhead would dominate otherwise. Still, a single pybullet call is
+faster than any python implementation, these functions pay off once poses come in batches (see
+scripts/benchmark_pose_math.py).
+"""
+
+import math
+
+import numpy as np
+
+
+def quat_to_euler(quat):
+    """
+    Convert quaternions to euler angles, same as p.getEulerFromQuaternion.
+
+    Args:
+        quat: (..., 4) quaternions (x, y, z, w).
+
+    Returns:
+        (..., 3) euler angles (roll, pitch, yaw).
+    """
+    if _is_single(quat):
+        return np.array(_quat_to_euler_single(*_floats(quat)))
+    quat = np.asarray(quat, dtype=float)
+    x, y, z, w = np.moveaxis(quat, -1, 0)
+    sqx, sqy, sqz, sqw = x * x, y * y, z * z, w * w
+    # the quaternion is not normalized beforehand, like in pybullet
+    sarg = -2 * (x * z - w * y)
+    roll = np.arctan2(2 * (y * z + w * x), sqw - sqx - sqy + sqz)
+    pitch = np.arcsin(np.clip(sarg, -1, 1))
+    yaw = np.arctan2(2 * (x * y + w * z), sqw + sqx - sqy - sqz)
+    # close to gimbal lock pybullet sets roll to zero and puts the whole rotation about the vertical axis into yaw
+    upper, lower = sarg >= 0.99999, sarg <= -0.99999
+    roll = np.where(upper | lower, 0.0, roll)
+    pitch = np.where(upper, 0.5 * np.pi, np.where(lower, -0.5 * np.pi, pitch))
+    yaw = np.where(upper, 2 * np.arctan2(-x, y), np.where(lower, 2 * np.arctan2(x, -y), yaw))
+    return np.stack([roll, pitch, yaw], axis=-1)
+
+
+def euler_to_quat(euler):
+    """
+    Convert euler angles to quaternions, same as p.getQuaternionFromEuler.
+
+    Args:
+        euler: (..., 3) euler angles (roll, pitch, yaw).
+
+    Returns:
+        (..., 4) quaternions (x, y, z, w).
+    """
+    if _is_single(euler):
+        return np.array(_euler_to_quat_single(*_floats(euler)))
+    half = 0.5 * np.asarray(euler, dtype=float)
+    cr, cp, cy = np.moveaxis(np.cos(half), -1, 0)
+    sr, sp, sy = np.moveaxis(np.sin(half), -1, 0)
+    return np.stack(
+        [
+            sr * cp * cy - cr * sp * sy,
+            cr * sp * cy + sr * cp * sy,
+            cr * cp * sy - sr * sp * cy,
+            cr * cp * cy + sr * sp * sy,
+        ],
+        axis=-1,
+    )
+
+
+def quat_to_matrix(quat):
+    """
+    Convert quaternions to rotation matrices, same as np.reshape(p.getMatrixFromQuaternion(quat), (3, 3)).
+
+    Args:
+        quat: (..., 4) quaternions (x, y, z, w), need not be normalized.
+
+    Returns:
+        (..., 3, 3) rotation matrices.
+    """
+    quat = np.asarray(quat, dtype=float)
+    x, y, z, w = np.moveaxis(quat, -1, 0)
+    s = 2.0 / np.sum(quat * quat, axis=-1)
+    xs, ys, zs = x * s, y * s, z * s
+    wx, wy, wz = w * xs, w * ys, w * zs
+    xx, xy, xz = x * xs, x * ys, x * zs
+    yy, yz, zz = y * ys, y * zs, z * zs
+    rows = [
+        [1.0 - (yy + zz), xy - wz, xz + wy],
+        [xy + wz, 1.0 - (xx + zz), yz - wx],
+        [xz - wy, yz + wx, 1.0 - (xx + yy)],
+    ]
+    return np.stack([np.stack(row, axis=-1) for row in rows], axis=-2)
+
+
+def matrix_to_quat(matrix):
+    """
+    Convert rotation matrices to quaternions.
+
+    Args:
+        matrix: (..., 3, 3) rotation matrices.
+
+    Returns:
+        (..., 4) unit quaternions (x, y, z, w) with w >= 0.
+    """
+    m = np.asarray(matrix, dtype=float)
+    m00, m11, m22 = m[..., 0, 0], m[..., 1, 1], m[..., 2, 2]
+    # four candidate solutions, pick the numerically best conditioned one per matrix
+    candidates = np.stack(
+        [
+            np.stack(
+                [
+                    1 + m00 - m11 - m22,
+                    m[..., 0, 1] + m[..., 1, 0],
+                    m[..., 0, 2] + m[..., 2, 0],
+                    m[..., 2, 1] - m[..., 1, 2],
+                ],
+                -1,
+            ),
+            np.stack(
+                [
+                    m[..., 0, 1] + m[..., 1, 0],
+                    1 - m00 + m11 - m22,
+                    m[..., 1, 2] + m[..., 2, 1],
+                    m[..., 0, 2] - m[..., 2, 0],
+                ],
+                -1,
+            ),
+            np.stack(
+                [
+                    m[..., 0, 2] + m[..., 2, 0],
+                    m[..., 1, 2] + m[..., 2, 1],
+                    1 - m00 - m11 + m22,
+                    m[..., 1, 0] - m[..., 0, 1],
+                ],
+                -1,
+            ),
+            np.stack(
+                [
+                    m[..., 2, 1] - m[..., 1, 2],
+                    m[..., 0, 2] - m[..., 2, 0],
+                    m[..., 1, 0] - m[..., 0, 1],
+                    1 + m00 + m11 + m22,
+                ],
+                -1,
+            ),
+        ],
+        axis=-2,
+    )
+    best = np.argmax(np.stack([m00, m11, m22, m00 + m11 + m22], axis=-1), axis=-1)
+    quat = np.take_along_axis(candidates, best[..., None, None], axis=-2)[..., 0, :]
+    quat = quat / np.linalg.norm(quat, axis=-1, keepdims=True)
+    return np.where(quat[..., 3:] < 0, -quat, quat)
+
+
+def euler_to_matrix(euler):
+    """Convert (..., 3) euler angles to (..., 3, 3) rotation matrices."""
+    return quat_to_matrix(euler_to_quat(euler))
+
+
+def matrix_to_euler(matrix):
+    """Convert (..., 3, 3) rotation matrices to (..., 3) euler angles."""
+    return quat_to_euler(matrix_to_quat(matrix))
+
+
+def quat_multiply(q1, q2):
+    """
+    Hamilton product q1 * q2 of quaternions (x, y, z, w).
+
+    Same rotation as the orientation part of p.multiplyTransforms, pybullet may return the negated quaternion.
+    """
+    q1 = np.asarray(q1, dtype=float)
+    q2 = np.asarray(q2, dtype=float)
+    x1, y1, z1, w1 = np.moveaxis(q1, -1, 0)
+    x2, y2, z2, w2 = np.moveaxis(q2, -1, 0)
+    return np.stack(
+        [
+            w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+            w1 * y2 + y1 * w2 + z1 * x2 - x1 * z2,
+            w1 * z2 + z1 * w2 + x1 * y2 - y1 * x2,
+            w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+        ],
+        axis=-1,
+    )
+
+
+def quat_conjugate(quat):
+    """Conjugate of quaternions (x, y, z, w), the inverse for unit quaternions."""
+    quat = np.asarray(quat, dtype=float)
+    return np.concatenate([-quat[..., :3], quat[..., 3:]], axis=-1)
+
+
+def quat_rotate(quat, vec):
+    """
+    Rotate vectors by unit quaternions.
+
+    Args:
+        quat: (..., 4) quaternions (x, y, z, w).
+        vec: (..., 3) vectors.
+
+    Returns:
+        (..., 3) rotated vectors.
+    """
+    quat = np.asarray(quat, dtype=float)
+    vec = np.asarray(vec, dtype=float)
+    u, w = quat[..., :3], quat[..., 3:]
+    t = 2 * np.cross(u, vec)
+    return vec + w * t + np.cross(u, t)
+
+
+def quat_angle(q1, q2):
+    """
+    Minimum rotation angle between orientations given as unit quaternions (x, y, z, w).
+
+    Returns:
+        (...) angles in [0, pi].
+    """
+    if _is_single(q1) and _is_single(q2):
+        return _quat_angle_single(_floats(q1), _floats(q2))
+    vec = quat_multiply(q1, quat_conjugate(q2))[..., :3]
+    return 2 * np.arcsin(np.clip(np.linalg.norm(vec, axis=-1), 0, 1))
+
+
+def wrap_angle(angle):
+    """Wrap angles to [-pi, pi)."""
+    return (np.asarray(angle) + np.pi) % (2 * np.pi) - np.pi
+
+
+def angle_diff(a, b):
+    """Signed difference b - a of angles, wrapped to [-pi, pi)."""
+    return wrap_angle(np.asarray(b) - np.asarray(a))
+
+
+def compose_pose(pos_a, orn_a, pos_b, orn_b):
+    """
+    Compose poses like p.multiplyTransforms: returns the pose b given in frame a, expressed in the world frame.
+
+    Args:
+        pos_a, pos_b: (..., 3) positions.
+        orn_a, orn_b: (..., 4) quaternions (x, y, z, w).
+
+    Returns:
+        (pos, orn) with shapes (..., 3) and (..., 4).
+    """
+    return np.asarray(pos_a, dtype=float) + quat_rotate(orn_a, pos_b), quat_multiply(orn_a, orn_b)
+
+
+def invert_pose(pos, orn):
+    """Inverse of poses, same as p.invertTransform."""
+    orn_inv = quat_conjugate(orn)
+    return -quat_rotate(orn_inv, pos), orn_inv
+
+
+def relative_pose(pos_a, orn_a, pos_b, orn_b):
+    """
+    Pose of frame b relative to frame a, i.e. inv(a) * b.
+
+    Args:
+        pos_a, pos_b: (..., 3) positions in the world frame.
+        orn_a, orn_b: (..., 4) quaternions (x, y, z, w) in the world frame.
+
+    Returns:
+        (pos, orn) of b in frame a with shapes (..., 3) and (..., 4).
+    """
+    orn_a_inv = quat_conjugate(orn_a)
+    pos = quat_rotate(orn_a_inv, np.asarray(pos_b, dtype=float) - np.asarray(pos_a, dtype=float))
+    return pos, quat_multiply(orn_a_inv, orn_b)
+
+
+def _is_single(x):
+    if isinstance(x, np.ndarray):
+        return x.ndim == 1
+    return isinstance(x, (tuple, list)) and not isinstance(x[0], (tuple, list, np.ndarray))
+
+
+def _floats(x):
+    return x.tolist() if isinstance(x, np.ndarray) else x
+
+
+def _quat_to_euler_single(x, y, z, w):
+    sarg = -2 * (x * z - w * y)
+    if sarg >= 0.99999:
+        return 0.0, 0.5 * math.pi, 2 * math.atan2(-x, y)
+    if sarg <= -0.99999:
+        return 0.0, -0.5 * math.pi, 2 * math.atan2(x, -y)
+    sqx, sqy, sqz, sqw = x * x, y * y, z * z, w * w
+    return (
+        math.atan2(2 * (y * z + w * x), sqw - sqx - sqy + sqz),
+        math.asin(sarg),
+        math.atan2(2 * (x * y + w * z), sqw + sqx - sqy - sqz),
+    )
+
+
+def _euler_to_quat_single(roll, pitch, yaw):
+    cr, cp, cy = math.cos(0.5 * roll), math.cos(0.5 * pitch), math.cos(0.5 * yaw)
+    sr, sp, sy = math.sin(0.5 * roll), math.sin(0.5 * pitch), math.sin(0.5 * yaw)
+    return (
+        sr * cp * cy - cr * sp * sy,
+        cr * sp * cy + sr * cp * sy,
+        cr * cp * sy - sr * sp * cy,
+        cr * cp * cy + sr * sp * sy,
+    )
+
+
+def _quat_angle_single(q1, q2):
+    x1, y1, z1, w1 = q1
+    x2, y2, z2, w2 = q2
+    # vector part of q1 * conj(q2)
+    x = -w1 * x2 + x1 * w2 - y1 * z2 + z1 * y2
+    y = -w1 * y2 + y1 * w2 - z1 * x2 + x1 * z2
+    z = -w1 * z2 + z1 * w2 - x1 * y2 + y1 * x2
+    return 2 * math.asin(min(math.sqrt(x * x + y * y + z * z), 1.0))
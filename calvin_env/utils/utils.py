@@ -11,8 +11,7 @@ from typing import Union
 import git
 import numpy as np
 
-from tapas_gmm.viz import quaternion
-
+from calvin_env.utils.pose import angle_diff, euler_to_quat, quat_angle, quat_to_euler, wrap_angle
 
 # A logger for this file
 logger = logging.getLogger(__name__)
@@ -86,15 +85,9 @@ def unit_vector(vector):
 def angle_between_quaternions(q1, q2):
     """
     Returns the minimum rotation angle between to orientations expressed as quaternions
-    quaternions use X,Y,Z,W convention
+    quaternions use X,Y,Z,W convention, also works on (N, 4) arrays
     """
-    q1 = xyzw_to_wxyz(q1)
-    q2 = xyzw_to_wxyz(q2)
-    q1 = quaternion.from_float_array(q1)
-    q2 = quaternion.from_float_array(q2)
-
-    theta = 2 * np.arcsin(np.linalg.norm((q1 * q2.conjugate()).vec))
-    return theta
+    return quat_angle(q1, q2)
 
 
 def angle_between(v1, v2):
@@ -155,22 +148,77 @@ def get_egl_device_id(cuda_id: int) -> Union[int]:
 
 
 def angle_between_angles(a, b):
-    diff = b - a
-    return (diff + np.pi) % (2 * np.pi) - np.pi
+    return angle_diff(a, b)
+
+
+def _split_tcp_pose(x, euler):
+    """Split tcp poses (..., k) into position and euler orientation, orientations may be euler or quaternion."""
+    if euler:
+        return x[..., :3], x[..., 3:6]
+    return x[..., :3], quat_to_euler(x[..., 3:7])
+
+
+def _gripper_sign(gripper):
+    # 1 is open, -1 is close, old recordings use 0 for close
+    return np.where(gripper > 0, 1.0, -1.0)
+
+
+def to_relative_actions(actions, robot_obs, max_pos=0.02, max_orn=0.05, euler_obs=None):
+    """
+    Convert absolute actions of a whole episode into relative actions.
+
+    Args:
+        actions: (T, 7) absolute actions with euler orientation or (T, 8) with quaternion orientation.
+        robot_obs: (T, k) robot observations, the tcp pose is in the first 6 (euler) or 7 (quaternion) entries.
+        max_pos: position offset that corresponds to a relative action of 1.
+        max_orn: orientation offset that corresponds to a relative action of 1.
+        euler_obs: whether robot_obs has euler orientations, defaults to the orientation type of the actions.
+
+    Returns:
+        (T, 7) relative actions (position, euler, gripper) in [-1, 1], gripper actions are mapped to 1 / -1.
+    """
+    actions = np.asarray(actions, dtype=float)
+    robot_obs = np.asarray(robot_obs, dtype=float)
+    euler_actions = actions.shape[-1] == 7
+    if euler_obs is None:
+        euler_obs = euler_actions
+    abs_pos, abs_orn = _split_tcp_pose(actions, euler_actions)
+    obs_pos, obs_orn = _split_tcp_pose(robot_obs, euler_obs)
+
+    rel_pos = np.clip(abs_pos - obs_pos, -max_pos, max_pos) / max_pos
+    rel_orn = np.clip(angle_diff(obs_orn, abs_orn), -max_orn, max_orn) / max_orn
+    return np.concatenate([rel_pos, rel_orn, _gripper_sign(actions[..., -1:])], axis=-1)
 
 
 def to_relative_action(actions, robot_obs, max_pos=0.02, max_orn=0.05):
-    assert isinstance(actions, np.ndarray)
-    assert isinstance(robot_obs, np.ndarray)
+    """Relative action of a single step with euler orientations, see to_relative_actions."""
+    return to_relative_actions(actions, robot_obs, max_pos, max_orn, euler_obs=True)
 
-    rel_pos = actions[:3] - robot_obs[:3]
-    rel_pos = np.clip(rel_pos, -max_pos, max_pos) / max_pos
 
-    rel_orn = angle_between_angles(robot_obs[3:6], actions[3:6])
-    rel_orn = np.clip(rel_orn, -max_orn, max_orn) / max_orn
+def to_absolute_actions(rel_actions, robot_obs, max_pos=0.02, max_orn=0.05, euler_obs=True):
+    """
+    Inverse of to_relative_actions, exact for actions that were not clipped.
+
+    Args:
+        rel_actions: (T, 7) relative actions (position, euler, gripper).
+        robot_obs: (T, k) robot observations, the tcp pose is in the first 6 (euler) or 7 (quaternion) entries.
+        max_pos: position offset that corresponds to a relative action of 1.
+        max_orn: orientation offset that corresponds to a relative action of 1.
+        euler_obs: whether robot_obs has euler orientations.
 
-    gripper = actions[-1:]
-    return np.concatenate([rel_pos, rel_orn, gripper])
+    Returns:
+        Absolute actions with the orientation type of robot_obs, i.e. (T, 7) with euler angles in [-pi, pi) or
+        (T, 8) with quaternions.
+    """
+    rel_actions = np.asarray(rel_actions, dtype=float)
+    robot_obs = np.asarray(robot_obs, dtype=float)
+    obs_pos, obs_orn = _split_tcp_pose(robot_obs, euler_obs)
+
+    abs_pos = obs_pos + rel_actions[..., :3] * max_pos
+    abs_orn = wrap_angle(obs_orn + rel_actions[..., 3:6] * max_orn)
+    if not euler_obs:
+        abs_orn = euler_to_quat(abs_orn)
+    return np.concatenate([abs_pos, abs_orn, _gripper_sign(rel_actions[..., -1:])], axis=-1)
 
 
 def set_egl_device(device):